@@ -0,0 +1,331 @@
+"""
+benchmarks.py - Headless benchmarks for the Air Canvas hot paths
+
+Every benchmark runs on synthetic input and reports median milliseconds.
+Results can be stored as a baseline and later runs compared against it;
+the run fails when a benchmark is slower than the baseline by more than
+the regression threshold.
+
+Usage:
+    python benchmarks.py --save-baseline
+    python benchmarks.py --compare --threshold 25
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+import config
+from canvas import Canvas
+from color_detection import ColorDetector, FILTERS, create_filter
+from drawing_tools import BrushTool, RectangleTool, ToolManager
+from ui import UserInterface
+from utils import save_image
+
+def time_call(func, repeat=50, warmup=3):
+    """Get the median time of a call in milliseconds"""
+    for _ in range(warmup):
+        func()
+    
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    
+    return float(np.median(samples)) * 1000.0
+
+def make_test_frame(width=config.WINDOW_WIDTH, height=config.WINDOW_HEIGHT, seed=0, offset=0):
+    """Create a noisy frame with a few colored blobs, shifted right by offset"""
+    rng = np.random.default_rng(seed)
+    frame = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    frame = cv2.GaussianBlur(frame, (15, 15), 0)
+    for i, color_name in enumerate(('blue', 'red', 'green')):
+        center = (width * (i + 1) // 4 + offset, height // 2)
+        cv2.circle(frame, center, 30, config.COLORS[color_name]['bgr'], -1)
+    return frame
+
+def make_stroke(count, width=config.WINDOW_WIDTH, height=config.WINDOW_HEIGHT - config.UI_HEIGHT):
+    """Create a long wavy stroke of integer points across the canvas"""
+    t = np.linspace(0.0, 1.0, count)
+    xs = 20 + t * (width - 40)
+    ys = height / 2 + np.sin(t * 12 * np.pi) * height / 3
+    return [(int(x), int(y)) for x, y in zip(xs, ys)]
+
+def bench_segmentation(repeat=50):
+    """Time cvtColor + inRange, with and without a hue range wrapping around 180"""
+    frame = make_test_frame()
+    detector = ColorDetector(headless=True)
+    results = {}
+    
+    print(f"Segmentation of a {frame.shape[1]}x{frame.shape[0]} frame (median ms)")
+    for color_name in ('blue', 'red'):
+        detector.set_color_preset(color_name)
+        results[f"segment_hsv_{color_name}"] = time_call(lambda: detector.threshold(frame), repeat)
+        print(f"  {color_name:<8} hsv {results[f'segment_hsv_{color_name}']:7.3f}")
+    
+    return results
+
+def bench_detection(repeat=50, resolutions=((640, 360), (1280, 720), (1920, 1080))):
+    """Time ColorDetector.detect on a moving marker at several resolutions"""
+    results = {}
+    
+    print("Detection of a moving marker (median ms)")
+    for width, height in resolutions:
+        frames = [make_test_frame(width, height, offset=dx) for dx in range(0, 40, 8)]
+        
+        for tracking in (False, True):
+            detector = ColorDetector(headless=True)
+            detector.set_color_preset('blue')
+            detector.tracking = tracking
+            state = {'frame': 0}
+            
+            def detect():
+                # detect draws onto the frame, so work on a copy
+                frame = frames[state['frame'] % len(frames)].copy()
+                detector.detect(frame, state['frame'] / config.REPLAY_FPS)
+                state['frame'] += 1
+            
+            name = f"detect_{width}x{height}_{'roi' if tracking else 'full'}"
+            results[name] = time_call(detect, repeat)
+            print(f"  {name:<24} {results[name]:7.3f}")
+    
+    return results
+
+def bench_smoothing(repeat=500):
+    """Time get_smoothed_position with each pointer filter"""
+    results = {}
+    points = make_stroke(repeat)
+    
+    print("Pointer filters (median ms)")
+    for filter_name in FILTERS:
+        detector = ColorDetector(headless=True)
+        detector.filter = create_filter(filter_name)
+        state = {'frame': 0}
+        
+        def smooth():
+            i = state['frame']
+            detector.frame_timestamp = i / config.REPLAY_FPS
+            detector.filter.update(points[i % len(points)], detector.frame_timestamp)
+            detector.get_smoothed_position()
+            state['frame'] += 1
+        
+        results[f"smooth_{filter_name}"] = time_call(smooth, repeat)
+        print(f"  {filter_name:<16} {results[f'smooth_{filter_name}']:7.4f}")
+    
+    return results
+
+def bench_history(repeat=50):
+    """Time Canvas.save_state and undo after a short brush stroke"""
+    canvas = Canvas()
+    brush = BrushTool(canvas)
+    stroke = make_stroke(20)
+    
+    def stroke_and_save():
+        for point in stroke:
+            brush.handle_drawing(point)
+        brush.reset()
+        start = time.perf_counter()
+        canvas.save_state()
+        return time.perf_counter() - start
+    
+    def save_undo():
+        for point in stroke:
+            brush.handle_drawing(point)
+        brush.reset()
+        canvas.save_state()
+        start = time.perf_counter()
+        canvas.undo()
+        return time.perf_counter() - start
+    
+    results = {
+        'history_save_state': float(np.median([stroke_and_save() for _ in range(repeat)])) * 1000.0,
+        'history_undo': float(np.median([save_undo() for _ in range(repeat)])) * 1000.0,
+    }
+    
+    print("Undo history (median ms)")
+    for name, ms in results.items():
+        print(f"  {name:<24} {ms:7.3f}")
+    return results
+
+def bench_brush(repeat=10, points=2000):
+    """Time BrushTool.handle_drawing over a long stroke, per stroke"""
+    stroke = make_stroke(points)
+    
+    def draw_stroke():
+        canvas = Canvas()
+        brush = BrushTool(canvas)
+        for point in stroke:
+            brush.handle_drawing(point)
+        brush.reset()
+    
+    name = f"brush_stroke_{points}"
+    results = {name: time_call(draw_stroke, repeat, warmup=1)}
+    print("Brush stroke (median ms)")
+    print(f"  {name:<24} {results[name]:7.3f}")
+    return results
+
+def bench_preview(repeat=200):
+    """Time ShapeTool.preview_shape while dragging a rectangle"""
+    canvas = Canvas()
+    tool = RectangleTool(canvas)
+    tool.start_shape((100, 100))
+    points = make_stroke(repeat)
+    state = {'frame': 0}
+    
+    def preview():
+        tool.preview_shape(points[state['frame'] % len(points)])
+        state['frame'] += 1
+    
+    results = {'preview_rectangle': time_call(preview, repeat)}
+    print("Shape preview (median ms)")
+    print(f"  {'preview_rectangle':<24} {results['preview_rectangle']:7.3f}")
+    return results
+
+def bench_ui(repeat=200):
+    """Time UserInterface.create_ui, cached and redrawn, and handle_click"""
+    canvas = Canvas()
+    tool_manager = ToolManager(canvas)
+    ui = UserInterface(config.WINDOW_WIDTH, config.WINDOW_HEIGHT)
+    out = np.empty((config.UI_HEIGHT, config.WINDOW_WIDTH, 3), dtype=np.uint8)
+    
+    def redraw():
+        # A state change forces the status text to be redrawn
+        tool_manager.version += 1
+        ui.create_ui(tool_manager, out)
+    
+    # Sweep across the panel, over buttons and gaps alike
+    positions = [(x, config.UI_HEIGHT // 2) for x in range(0, config.WINDOW_WIDTH, 7)]
+    state = {'frame': 0}
+    
+    def click():
+        i = state['frame']
+        ui.handle_click(positions[i % len(positions)], tool_manager, canvas, i / config.REPLAY_FPS)
+        state['frame'] += 1
+    
+    results = {
+        'ui_create_cached': time_call(lambda: ui.create_ui(tool_manager, out), repeat),
+        'ui_create_redraw': time_call(redraw, repeat),
+        'ui_handle_click': time_call(click, repeat),
+    }
+    
+    print("User interface (median ms)")
+    for name, ms in results.items():
+        print(f"  {name:<24} {ms:7.4f}")
+    return results
+
+def bench_save_image(repeat=5):
+    """Time utils.save_image of a drawn canvas in the configured format"""
+    canvas = Canvas()
+    brush = BrushTool(canvas)
+    for point in make_stroke(500):
+        brush.handle_drawing(point)
+    
+    save_dir = config.SAVE_DIR
+    with tempfile.TemporaryDirectory() as directory:
+        config.SAVE_DIR = directory
+        try:
+            ms = time_call(lambda: save_image(canvas.canvas, "benchmark"), repeat, warmup=1)
+        finally:
+            config.SAVE_DIR = save_dir
+    
+    name = f"save_image_{config.SAVE_FORMAT}"
+    results = {name: ms}
+    print("Image saving (median ms)")
+    print(f"  {name:<24} {ms:7.3f}")
+    return results
+
+BENCHMARKS = (
+    bench_segmentation,
+    bench_detection,
+    bench_smoothing,
+    bench_history,
+    bench_brush,
+    bench_preview,
+    bench_ui,
+    bench_save_image,
+)
+
+def run_all():
+    """Run every benchmark and return {name: median ms}"""
+    results = {}
+    for bench in BENCHMARKS:
+        results.update(bench())
+    return results
+
+def load_baseline(path):
+    """Load stored benchmark results"""
+    with open(path) as f:
+        return json.load(f)['results']
+
+def save_baseline(results, path):
+    """Store benchmark results as the baseline for later runs"""
+    with open(path, 'w') as f:
+        json.dump({'created': time.strftime("%Y-%m-%d %H:%M:%S"), 'results': results},
+                  f, indent=2, sort_keys=True)
+    return path
+
+def compare(results, baseline, threshold=config.BENCHMARK_REGRESSION_PCT,
+            min_delta=config.BENCHMARK_MIN_DELTA_MS):
+    """Compare results with a baseline, returning the regressed benchmark names.
+    
+    A benchmark regresses when it is more than threshold percent slower
+    than its baseline, and by at least min_delta milliseconds so timer
+    noise on the fastest paths is not reported.
+    """
+    regressions = []
+    
+    print(f"\n{'benchmark':<26}{'baseline':>10}{'now':>10}{'change':>9}")
+    for name, ms in results.items():
+        if name not in baseline:
+            print(f"{name:<26}{'-':>10}{ms:>10.3f}{'new':>9}")
+            continue
+        
+        base = baseline[name]
+        change = (ms - base) / base * 100.0 if base > 0 else 0.0
+        regressed = change > threshold and ms - base >= min_delta
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<26}{base:>10.3f}{ms:>10.3f}{change:>8.1f}%"
+              f"{'  REGRESSION' if regressed else ''}")
+    
+    return regressions
+
+def main():
+    """Run all benchmarks, optionally storing or checking a baseline"""
+    parser = argparse.ArgumentParser(description="Headless Air Canvas benchmarks")
+    parser.add_argument("--baseline", default=config.BENCHMARK_BASELINE,
+                        help="Baseline results file")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Store this run as the baseline")
+    parser.add_argument("--compare", action="store_true",
+                        help="Fail if a benchmark regressed against the baseline")
+    parser.add_argument("--threshold", type=float, default=config.BENCHMARK_REGRESSION_PCT,
+                        help="Allowed slowdown in percent before failing")
+    args = parser.parse_args()
+    
+    results = run_all()
+    
+    if args.save_baseline:
+        print(f"\nBaseline written to {save_baseline(results, args.baseline)}")
+    
+    if args.compare:
+        if not os.path.isfile(args.baseline):
+            print(f"\nNo baseline at {args.baseline}, run with --save-baseline first")
+            return 2
+        
+        regressions = compare(results, load_baseline(args.baseline), args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} benchmark(s) regressed by more than "
+                  f"{args.threshold:.0f}%: {', '.join(regressions)}")
+            return 1
+        print("\nNo regressions")
+    
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
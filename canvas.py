@@ -2,88 +2,492 @@
 canvas.py - Canvas management for the Air Canvas application
 """
 
+import math
+import zlib
+from collections import deque
 import numpy as np
 import cv2
 import config
-from utils import save_image
+from utils import save_image, get_save_path, clip_rect, union_rect, points_rect
+from document import Document
+from layers import LayerStack
+
+class HistoryEntry:
+    """One changed region of a layer in an undoable operation, before and after.
+    
+    A side that is None stands for a blank region.
+    """
+    def __init__(self, rect, before, after, compression_level=0, layer=0):
+        self.rect = rect
+        self.layer = layer
+        channels = (before if before is not None else after).shape[2]
+        self.shape = (rect[3] - rect[1], rect[2] - rect[0], channels)
+        self.dtype = np.uint8
+        self.compression_level = compression_level
+        self.before = self.pack(before)
+        self.after = self.pack(after)
+    
+    def pack(self, pixels):
+        """Store a copy of a region, compressed if enabled"""
+        if pixels is None:
+            return None
+        if self.compression_level > 0:
+            return zlib.compress(np.ascontiguousarray(pixels).tobytes(), self.compression_level)
+        return pixels.copy()
+    
+    def unpack(self, data):
+        """Get a stored region back as an array"""
+        if data is None:
+            return None
+        if self.compression_level > 0:
+            return np.frombuffer(zlib.decompress(data), dtype=self.dtype).reshape(self.shape)
+        return data
+    
+    def get_before(self):
+        """Get the region as it was before the operation"""
+        return self.unpack(self.before)
+    
+    def get_after(self):
+        """Get the region as it was after the operation"""
+        return self.unpack(self.after)
+    
+    def nbytes(self):
+        """Get the memory used by the entry"""
+        return sum(0 if data is None else len(data) if self.compression_level > 0 else data.nbytes
+                   for data in (self.before, self.after))
+
+class CanvasHistory:
+    """Undo/redo stacks of region deltas kept within a byte budget.
+    
+    Each operation is a list of HistoryEntry, one per changed layer tile.
+    """
+    def __init__(self, budget=config.HISTORY_BUDGET_BYTES,
+                 compression_level=config.HISTORY_COMPRESSION_LEVEL):
+        self.budget = budget
+        self.compression_level = compression_level
+        self.undo_stack = deque()
+        self.redo_stack = []
+        self.size = 0
+    
+    def push(self, regions):
+        """Record an operation's (layer, rect, before, after) regions,
+        discarding anything that could be redone"""
+        for step in self.redo_stack:
+            self.size -= self.get_step_size(step)
+        self.redo_stack = []
+        
+        step = [HistoryEntry(rect, before, after, self.compression_level, layer)
+                for layer, rect, before, after in regions]
+        self.undo_stack.append(step)
+        self.size += self.get_step_size(step)
+        
+        # Forget the oldest operations once over budget, keeping the newest
+        while self.size > self.budget and len(self.undo_stack) > 1:
+            self.size -= self.get_step_size(self.undo_stack.popleft())
+    
+    def get_step_size(self, step):
+        """Get the memory used by one operation"""
+        return sum(entry.nbytes() for entry in step)
+    
+    def can_undo(self):
+        """Check if there is an operation to undo"""
+        return len(self.undo_stack) > 0
+    
+    def can_redo(self):
+        """Check if there is an operation to redo"""
+        return len(self.redo_stack) > 0
+    
+    def undo(self):
+        """Move the newest operation to the redo stack and return its entries"""
+        step = self.undo_stack.pop()
+        self.redo_stack.append(step)
+        return step
+    
+    def redo(self):
+        """Move the newest undone operation back and return its entries"""
+        step = self.redo_stack.pop()
+        self.undo_stack.append(step)
+        return step
+    
+    def clear(self):
+        """Forget all operations"""
+        self.undo_stack.clear()
+        self.redo_stack = []
+        self.size = 0
+
+def shift_point(point, origin):
+    """Express a board point relative to origin"""
+    return (point[0] - origin[0], point[1] - origin[1])
+
+def opaque(color):
+    """Get the BGRA form of a BGR color for drawing on a layer"""
+    return (int(color[0]), int(color[1]), int(color[2]), 255)
+
+# Drawing with this on a layer makes it transparent again
+TRANSPARENT = (0, 0, 0, 0)
 
 class Canvas:
-    def __init__(self):
-        """Initialize the canvas"""
-        # Create canvas with white background
+    def __init__(self, writer=None, board_width=config.BOARD_WIDTH,
+                 board_height=config.BOARD_HEIGHT):
+        """Initialize the canvas, saving images through writer if given"""
+        # The Paint window shows a viewport of a larger board
         self.width = config.WINDOW_WIDTH
         self.height = config.WINDOW_HEIGHT - config.UI_HEIGHT
-        self.canvas = np.ones((self.height, self.width, 3), dtype=np.uint8) * 255
+        self.board_width = max(board_width, self.width)
+        self.board_height = max(board_height, self.height)
         
-        # Canvas state history for undo
-        self.states = []
-        self.max_states = config.MAX_STATES
+        # Strokes, shapes and text are drawn on separate layers of tiles
+        # allocated when first drawn on, flattened into a cached composite;
+        # the rest of the board is white and takes no memory
+        self.layers = LayerStack(self.board_width, self.board_height)
         
-        # Initial state
-        self.save_state()
+        # Viewport: board position of its top-left corner and zoom (screen
+        # pixels per board pixel). view is what the Paint window shows,
+        # re-rendered from the composite where view_stale (board rect) says
+        self.view_x = 0
+        self.view_y = 0
+        self.zoom = 1.0
+        self.view = np.full((self.height, self.width, 3), 255, dtype=np.uint8)
+        self.view_stale = None
+        
+        # Canvas history for undo/redo, stored as changed regions only.
+        # Each layer keeps its tiles as of the last saved state until it
+        # is saved, so the "before" pixels of an operation are known.
+        self.history = CanvasHistory()
+        
+        # Incremented on every change so viewers can tell when to refresh
+        self.version = 0
+        
+        # Incremented on every operation saved, undone or redone
+        self.commits = 0
+        
+        # Vector record of everything drawn, in board coordinates, kept in
+        # step with the history
+        self.document = Document(self.board_width, self.board_height)
+        
+        # Background ImageWriter; without one, saves are written inline
+        self.writer = writer
+    
+    @property
+    def canvas(self):
+        """The viewport image, as shown in the Paint window"""
+        return self.get_view()
+    
+    def get_view(self):
+        """Get the viewport image, re-rendering the parts that changed.
+        
+        The returned image is updated in place by later calls.
+        """
+        rect = self.view_stale
+        if rect is None:
+            return self.view
+        self.view_stale = None
+        
+        # Screen area covering the changed board area
+        zoom = self.zoom
+        sx1 = max(0, int(math.floor((rect[0] - self.view_x) * zoom)))
+        sy1 = max(0, int(math.floor((rect[1] - self.view_y) * zoom)))
+        sx2 = min(self.width, int(math.ceil((rect[2] - self.view_x) * zoom)))
+        sy2 = min(self.height, int(math.ceil((rect[3] - self.view_y) * zoom)))
+        if sx2 <= sx1 or sy2 <= sy1:
+            return self.view
+        
+        target = self.view[sy1:sy2, sx1:sx2]
+        if zoom == 1.0:
+            self.layers.read((self.view_x + sx1, self.view_y + sy1,
+                              self.view_x + sx2, self.view_y + sy2), out=target)
+            return self.view
+        
+        board_rect = (int(math.floor(self.view_x + sx1 / zoom)),
+                      int(math.floor(self.view_y + sy1 / zoom)),
+                      int(math.ceil(self.view_x + sx2 / zoom)),
+                      int(math.ceil(self.view_y + sy2 / zoom)))
+        pixels = self.layers.read(board_rect)
+        target[:] = cv2.resize(pixels, (sx2 - sx1, sy2 - sy1),
+                               interpolation=cv2.INTER_AREA if zoom < 1.0 else cv2.INTER_NEAREST)
+        return self.view
+    
+    def get_view_rect(self):
+        """Get the board rect shown in the viewport"""
+        return (self.view_x, self.view_y,
+                self.view_x + int(math.ceil(self.width / self.zoom)),
+                self.view_y + int(math.ceil(self.height / self.zoom)))
+    
+    def set_view(self, x, y, zoom=None):
+        """Move the viewport to board position (x, y), optionally changing the zoom"""
+        if zoom is not None:
+            min_zoom = max(self.width / self.board_width, self.height / self.board_height)
+            self.zoom = min(max(zoom, min_zoom), config.VIEW_MAX_ZOOM)
+        
+        # Keep the viewport on the board
+        max_x = self.board_width - int(math.ceil(self.width / self.zoom))
+        max_y = self.board_height - int(math.ceil(self.height / self.zoom))
+        self.view_x = max(0, min(int(round(x)), max_x))
+        self.view_y = max(0, min(int(round(y)), max_y))
+        
+        self.view_stale = self.get_view_rect()
+        self.version += 1
+    
+    def pan(self, dx, dy):
+        """Move the viewport by (dx, dy) screen pixels"""
+        self.set_view(self.view_x + dx / self.zoom, self.view_y + dy / self.zoom)
+    
+    def zoom_by(self, factor):
+        """Zoom the viewport by factor, keeping its center in place"""
+        center_x = self.view_x + self.width / (2 * self.zoom)
+        center_y = self.view_y + self.height / (2 * self.zoom)
+        zoom = self.zoom * factor
+        self.set_view(center_x - self.width / (2 * zoom), center_y - self.height / (2 * zoom), zoom)
+    
+    def reset_view(self):
+        """Show the top-left corner of the board at full size"""
+        self.set_view(0, 0, 1.0)
+    
+    def to_board(self, point):
+        """Convert a viewport position to board coordinates"""
+        if point is None:
+            return None
+        if self.zoom == 1.0:
+            return (self.view_x + int(point[0]), self.view_y + int(point[1]))
+        return (int(round(self.view_x + point[0] / self.zoom)),
+                int(round(self.view_y + point[1] / self.zoom)))
+    
+    def to_board_length(self, length):
+        """Convert a length in screen pixels, such as a thickness, to board pixels"""
+        return max(1, int(round(length / self.zoom)))
+    
+    def mark_dirty(self, rect):
+        """Record that a region of the board changed, returning it clipped"""
+        rect = clip_rect(rect, self.board_width, self.board_height)
+        if rect is not None:
+            self.layers.invalidate(rect)
+            self.view_stale = union_rect(self.view_stale, rect)
+            self.version += 1
+        return rect
+    
+    def paint(self, rect, draw, layer):
+        """Apply draw(image, origin) to a layer's pixels under rect.
+        
+        Only the tiles the rect intersects are touched; draw gets their
+        BGRA pixels as one image whose top-left corner is board position
+        origin. Returns the dirty region.
+        """
+        # Antialiased edges may reach a pixel past the computed bounds
+        rect = clip_rect((rect[0] - 1, rect[1] - 1, rect[2] + 1, rect[3] + 1),
+                         self.board_width, self.board_height)
+        if rect is None:
+            return None
+        
+        layer = self.layers.get_layer(layer)
+        layer.surface.draw(rect, draw)
+        self.layers.invalidate(rect)
+        self.view_stale = union_rect(self.view_stale, rect)
+        self.version += 1
+        return rect
     
     def save_state(self):
         """Save the current canvas state"""
-        self.states.append(self.canvas.copy())
-        if len(self.states) > self.max_states:
-            self.states.pop(0)
+        regions = self.layers.commit()
+        if not regions:
+            # Nothing reached the board, so the document keeps nothing either
+            self.document.discard_changes()
+            return False
+        
+        self.history.push(regions)
+        self.document.checkpoint()
+        self.commits += 1
+        return True
+    
+    def discard_changes(self):
+        """Drop changes made since the last saved state"""
+        for rect in self.layers.revert():
+            self.mark_dirty(rect)
+    
+    def restore_region(self, layer, rect, pixels):
+        """Write a region of a layer as part of the saved state"""
+        self.layers.restore(layer, rect, pixels)
+        self.mark_dirty(rect)
     
     def undo(self):
         """Revert to the previous canvas state"""
-        if len(self.states) > 1:
-            # Remove current state
-            self.states.pop()
-            # Set canvas to previous state
-            self.canvas = self.states[-1].copy()
-            return True
-        return False
+        if not self.history.can_undo():
+            return False
+        
+        # Unsaved changes go too, as the state they were drawn on is undone
+        self.discard_changes()
+        for entry in self.history.undo():
+            self.restore_region(entry.layer, entry.rect, entry.get_before())
+        self.document.undo()
+        self.commits += 1
+        return True
+    
+    def redo(self):
+        """Reapply the last undone state"""
+        if not self.history.can_redo():
+            return False
+        
+        self.discard_changes()
+        for entry in self.history.redo():
+            self.restore_region(entry.layer, entry.rect, entry.get_after())
+        self.document.redo()
+        self.commits += 1
+        return True
     
     def clear(self):
         """Clear the canvas"""
-        self.canvas.fill(255)
+        for rect in self.layers.clear(config.ERASER_LAYERS):
+            self.mark_dirty(rect)
+        self.document.add_clear()
         self.save_state()
     
+    def set_layer_visible(self, name, visible):
+        """Show or hide a layer"""
+        self.layers.set_visible(name, visible)
+        self.view_stale = self.get_view_rect()
+        self.version += 1
+    
+    def set_layer_opacity(self, name, opacity):
+        """Set the opacity of a layer between 0 and 1"""
+        self.layers.set_opacity(name, opacity)
+        self.view_stale = self.get_view_rect()
+        self.version += 1
+    
+    def set_background(self, image, origin=(0, 0)):
+        """Place a BGR image on the bottom layer at a board position, as an undoable operation"""
+        x, y = origin
+        height, width = image.shape[:2]
+        rect = clip_rect((x, y, x + width, y + height), self.board_width, self.board_height)
+        if rect is None:
+            return False
+        
+        x1, y1, x2, y2 = rect
+        image = image[y1 - y:y2 - y, x1 - x:x2 - x]
+        self.layers.layers[0].surface.write_region(rect, cv2.cvtColor(image, cv2.COLOR_BGR2BGRA))
+        self.document.add_background(image, (x1, y1))
+        self.mark_dirty(rect)
+        return self.save_state()
+    
+    def get_image(self):
+        """Get everything drawn, plus the viewport, as one image"""
+        rect = union_rect(self.get_view_rect(), self.layers.get_content_rect())
+        rect = clip_rect(rect, self.board_width, self.board_height)
+        return self.layers.read(rect)
+    
     def save(self, prefix="drawing"):
-        """Save the canvas as an image"""
-        return save_image(self.canvas, prefix)
+        """Save the drawing as an image, returning the path or None if refused"""
+        image = self.get_image()
+        if self.writer is not None:
+            return self.writer.submit(image, prefix)
+        return save_image(image, prefix)
+    
+    def save_document(self, prefix="drawing"):
+        """Save the vector document of the drawing"""
+        filename = self.document.save(get_save_path(prefix, config.DOCUMENT_EXTENSION))
+        print(f"Document saved as {filename}")
+        return filename
     
-    def draw_line(self, start_point, end_point, color, thickness):
-        """Draw a line on the canvas"""
+    def draw_line(self, start_point, end_point, color, thickness, layer='strokes'):
+        """Draw a line on a layer, returning the dirty region"""
         if start_point is None or end_point is None:
-            return
+            return None
         
-        cv2.line(self.canvas, start_point, end_point, color, thickness)
+        start = self.to_board(start_point)
+        end = self.to_board(end_point)
+        thickness = self.to_board_length(thickness)
+        color = opaque(color)
+        return self.paint(points_rect((start, end), thickness),
+                          lambda image, origin: cv2.line(image, shift_point(start, origin),
+                                                         shift_point(end, origin), color,
+                                                         thickness),
+                          layer)
     
-    def draw_circle(self, center, radius, color, thickness):
-        """Draw a circle on the canvas"""
+    def draw_circle(self, center, radius, color, thickness, layer='shapes'):
+        """Draw a circle on a layer, returning the dirty region"""
         if center is None or radius <= 0:
-            return
+            return None
         
-        cv2.circle(self.canvas, center, radius, color, thickness)
+        center = self.to_board(center)
+        radius = self.to_board_length(radius)
+        thickness = self.to_board_length(thickness) if thickness > 0 else thickness
+        color = opaque(color)
+        return self.paint(points_rect((center,), radius + max(thickness, 1)),
+                          lambda image, origin: cv2.circle(image, shift_point(center, origin),
+                                                           radius, color, thickness),
+                          layer)
     
-    def draw_rectangle(self, start_point, end_point, color, thickness):
-        """Draw a rectangle on the canvas"""
+    def draw_rectangle(self, start_point, end_point, color, thickness, layer='shapes'):
+        """Draw a rectangle on a layer, returning the dirty region"""
         if start_point is None or end_point is None:
-            return
+            return None
         
-        cv2.rectangle(self.canvas, start_point, end_point, color, thickness)
+        start = self.to_board(start_point)
+        end = self.to_board(end_point)
+        thickness = self.to_board_length(thickness) if thickness > 0 else thickness
+        color = opaque(color)
+        return self.paint(points_rect((start, end), max(thickness, 1)),
+                          lambda image, origin: cv2.rectangle(image, shift_point(start, origin),
+                                                              shift_point(end, origin), color,
+                                                              thickness),
+                          layer)
     
     def erase(self, center, radius):
-        """Erase area on the canvas"""
+        """Erase area on the canvas, returning the dirty region.
+        
+        Erasing makes config.ERASER_LAYERS transparent, uncovering the
+        layers below rather than painting white over them.
+        """
         if center is None or radius <= 0:
-            return
+            return None
+        
+        center = self.to_board(center)
+        radius = self.to_board_length(radius)
+        rect = points_rect((center,), radius + 1)
         
-        cv2.circle(self.canvas, center, radius, (255, 255, 255), -1)
+        def draw(image, origin):
+            cv2.circle(image, shift_point(center, origin), radius, TRANSPARENT, -1)
+        
+        dirty = None
+        for name in config.ERASER_LAYERS:
+            # Nothing to erase where a layer has no tiles
+            if self.layers.get_layer(name).surface.has_tiles(rect):
+                dirty = self.paint(rect, draw, name)
+        return dirty
     
-    def draw_text(self, text, position, color, font_scale=1.0, thickness=2):
-        """Draw text on the canvas"""
+    def draw_text(self, text, position, color, font_scale=1.0, thickness=2, layer='text'):
+        """Draw text on a layer, returning the dirty region"""
         if position is None or not text:
-            return
+            return None
         
         font = cv2.FONT_HERSHEY_SIMPLEX
-        cv2.putText(self.canvas, text, position, font, 
-                  font_scale, color, thickness, cv2.LINE_AA)
+        position = self.to_board(position)
+        font_scale /= self.zoom
+        thickness = self.to_board_length(thickness)
+        color = opaque(color)
+        
+        # position is the bottom-left corner of the text
+        (text_width, text_height), baseline = cv2.getTextSize(text, font, font_scale, thickness)
+        x, y = position
+        return self.paint((x - thickness, y - text_height - thickness,
+                           x + text_width + thickness, y + baseline + thickness),
+                          lambda image, origin: cv2.putText(image, text,
+                                                            shift_point(position, origin), font,
+                                                            font_scale, color, thickness,
+                                                            cv2.LINE_AA),
+                          layer)
     
     def get_copy(self):
-        """Get a copy of the current canvas"""
-        return self.canvas.copy()
\ No newline at end of file
+        """Get a copy of the current viewport image"""
+        return self.get_view().copy()
+    
+    def get_memory_stats(self):
+        """Get how many board tiles are in memory and paged out, in total and per layer"""
+        layers = self.layers.get_stats()
+        return {
+            'resident_tiles': sum(stats['resident_tiles'] for stats in layers.values()),
+            'paged_tiles': sum(stats['paged_tiles'] for stats in layers.values()),
+            'layers': layers,
+        }
+    
+    def close(self):
+        """Release the tile page files"""
+        self.layers.close()
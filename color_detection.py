@@ -2,56 +2,473 @@
 color_detection.py - Color detection and tracking functionality
 """
 
+import math
+import time
 import cv2
 import numpy as np
 import config
-from utils import get_contour_center
+from utils import get_contour_center, union_rect
+
+# Threshold trackbars in the "Color detectors" window, in ThresholdState order
+TRACKBARS = (
+    ("Lower Hue", 180),
+    ("Lower Saturation", 255),
+    ("Lower Value", 255),
+    ("Upper Hue", 180),
+    ("Upper Saturation", 255),
+    ("Upper Value", 255),
+)
+
+class ThresholdState:
+    """HSV thresholds shared by the detector and its caches.
+    
+    The arrays are allocated once and updated in place. Every change bumps
+    version, so anything derived from the thresholds (such as masks) can
+    tell when it needs rebuilding by comparing versions.
+    """
+    def __init__(self, lower_hsv, upper_hsv):
+        self.lower = np.array(lower_hsv, dtype=np.int32)
+        self.upper = np.array(upper_hsv, dtype=np.int32)
+        self.version = 0
+    
+    def get_value(self, index):
+        """Get one threshold by index (0-2 lower H/S/V, 3-5 upper H/S/V)"""
+        if index < 3:
+            return int(self.lower[index])
+        return int(self.upper[index - 3])
+    
+    def set_value(self, index, value):
+        """Set one threshold by index, returning True if it changed"""
+        target = self.lower if index < 3 else self.upper
+        if target[index % 3] == value:
+            return False
+        target[index % 3] = value
+        self.version += 1
+        return True
+    
+    def set(self, lower_hsv, upper_hsv):
+        """Set the full range, returning True if anything changed"""
+        if np.array_equal(self.lower, lower_hsv) and np.array_equal(self.upper, upper_hsv):
+            return False
+        self.lower[:] = lower_hsv
+        self.upper[:] = upper_hsv
+        self.version += 1
+        return True
+
+def hsv_in_range(hsv, lower_hsv, upper_hsv):
+    """Threshold an HSV image, allowing the hue range to wrap around 180"""
+    if lower_hsv[0] <= upper_hsv[0]:
+        return cv2.inRange(hsv, lower_hsv, upper_hsv)
+    
+    # Hue range wraps around 180 (e.g. red), so combine both ends
+    low_end = cv2.inRange(hsv, np.array([0, lower_hsv[1], lower_hsv[2]]), 
+                          np.array(upper_hsv))
+    high_end = cv2.inRange(hsv, np.array(lower_hsv), 
+                           np.array([180, upper_hsv[1], upper_hsv[2]]))
+    return cv2.bitwise_or(low_end, high_end)
+
+def clean_mask(mask, kernel, passes=1):
+    """Remove specks from a binary mask with erosion, opening and dilation"""
+    if passes > 0:
+        mask = cv2.erode(mask, kernel, iterations=passes)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=passes)
+        mask = cv2.dilate(mask, kernel, iterations=passes)
+    return mask
+
+def make_coarse_kernel(scale):
+    """Get the morphology kernel shrunk for an image downscaled by scale, kept odd"""
+    kw = max(1, config.KERNEL_SIZE[0] // scale) | 1
+    kh = max(1, config.KERNEL_SIZE[1] // scale) | 1
+    return np.ones((kh, kw), np.uint8)
+
+def predict_search_window(center, velocity, radius, frame_shape, roi_scale=1.0):
+    """Get the (x1, y1, x2, y2) region to search for a marker last seen at center.
+    
+    The window is centred on the position predicted from the recent
+    velocity and grows with both the speed and the size of the blob.
+    Returns None if it falls outside the frame.
+    """
+    height, width = frame_shape[:2]
+    vx, vy = velocity
+    cx = center[0] + vx
+    cy = center[1] + vy
+    
+    base = max(config.ROI_MIN_HALF_SIZE, radius * config.ROI_RADIUS_SCALE) * roi_scale
+    half_w = int(base + abs(vx) * config.ROI_VELOCITY_SCALE)
+    half_h = int(base + abs(vy) * config.ROI_VELOCITY_SCALE)
+    
+    x1 = max(0, int(cx) - half_w)
+    y1 = max(0, int(cy) - half_h)
+    x2 = min(width, int(cx) + half_w)
+    y2 = min(height, int(cy) + half_h)
+    
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return (x1, y1, x2, y2)
+
+class MotionGate:
+    """Tells from a cheap frame difference whether detection can be skipped.
+    
+    Each frame is shrunk by scale and converted to grayscale, and compared
+    with the signature of the frame detection last ran on. Comparing with
+    that frame rather than the previous one lets slow changes add up until
+    they count as motion.
+    """
+    def __init__(self, scale=config.MOTION_SCALE, pixel_threshold=config.MOTION_PIXEL_THRESHOLD,
+                 min_cells=config.MOTION_MIN_CELLS, max_skip=config.MOTION_MAX_SKIP):
+        self.scale = max(1, scale)
+        self.pixel_threshold = pixel_threshold
+        self.min_cells = min_cells
+        self.max_skip = max_skip
+        
+        # Signatures of the current frame and of the last detected frame
+        self.sampled = None
+        self.small = None
+        self.current = None
+        self.reference = None
+        self.changed = None
+        self.has_reference = False
+        
+        # Counters
+        self.frames = 0
+        self.skipped = 0
+        self.narrowed = 0
+        self.since_detection = 0
+    
+    def update(self, frame):
+        """Compute the signature of a frame and mark the changed cells.
+        
+        Returns False when there is nothing to compare with yet.
+        """
+        height, width = frame.shape[:2]
+        size = (max(1, width // self.scale), max(1, height // self.scale))
+        if self.current is None or self.current.shape != (size[1], size[0]):
+            self.sampled = np.empty((2 * size[1], 2 * size[0], 3), dtype=np.uint8)
+            self.small = np.empty((size[1], size[0], 3), dtype=np.uint8)
+            self.current = np.empty((size[1], size[0]), dtype=np.uint8)
+            self.reference = np.empty_like(self.current)
+            self.changed = np.empty_like(self.current)
+            self.has_reference = False
+        
+        self.frames += 1
+        
+        # Averaging every pixel with INTER_AREA costs more than detection
+        # saves; point-sampling 2x2 pixels per cell first is 10x cheaper
+        cv2.resize(frame, (2 * size[0], 2 * size[1]), dst=self.sampled,
+                   interpolation=cv2.INTER_NEAREST)
+        cv2.resize(self.sampled, size, dst=self.small, interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self.small, cv2.COLOR_BGR2GRAY, dst=self.current)
+        if not self.has_reference:
+            return False
+        
+        cv2.absdiff(self.current, self.reference, dst=self.changed)
+        cv2.threshold(self.changed, self.pixel_threshold, 255, cv2.THRESH_BINARY, dst=self.changed)
+        return True
+    
+    def must_detect(self):
+        """Check if a full detection is due regardless of motion"""
+        return not self.has_reference or self.since_detection >= self.max_skip
+    
+    def is_still(self, rect=None):
+        """Check if too few cells changed, within an (x1, y1, x2, y2) frame rect if given"""
+        changed = self.changed
+        if rect is not None:
+            x1, y1, x2, y2 = rect
+            s = self.scale
+            changed = changed[y1 // s:-(-y2 // s), x1 // s:-(-x2 // s)]
+        return cv2.countNonZero(changed) < self.min_cells
+    
+    def get_changed_rect(self, frame_shape, margin=config.MOTION_MARGIN):
+        """Get the (x1, y1, x2, y2) frame region around all changed cells"""
+        x, y, w, h = cv2.boundingRect(self.changed)
+        if w == 0 or h == 0:
+            return None
+        
+        height, width = frame_shape[:2]
+        s = self.scale
+        return (max(0, x * s - margin), max(0, y * s - margin),
+                min(width, (x + w) * s + margin), min(height, (y + h) * s + margin))
+    
+    def accept(self):
+        """Make the current frame the reference after running detection on it"""
+        self.current, self.reference = self.reference, self.current
+        self.has_reference = True
+        self.since_detection = 0
+    
+    def reset(self):
+        """Forget the reference so the next frame is detected in full"""
+        self.has_reference = False
+    
+    def skip(self):
+        """Count a frame whose detection was skipped"""
+        self.skipped += 1
+        self.since_detection += 1
+    
+    def get_stats(self):
+        """Get the number of frames seen, skipped and searched in a narrowed window"""
+        return {
+            'frames': self.frames,
+            'skipped': self.skipped,
+            'narrowed': self.narrowed,
+        }
+
+class PointerFilter:
+    """Base class for pointer filters.
+    
+    A filter is fed one measurement per frame (None when the marker was not
+    found) and can be asked for the position at any later time, which is how
+    the pipeline latency is compensated. During a dropout the filter coasts
+    on its velocity estimate for a few frames, then holds its position.
+    """
+    def __init__(self, coast_frames=config.FILTER_COAST_FRAMES):
+        self.coast_frames = coast_frames
+        self.missed = 0
+        self.timestamp = None
+    
+    def update(self, measurement, timestamp):
+        """Feed the measurement of a frame captured at timestamp"""
+        if measurement is None:
+            if self.timestamp is not None:
+                self.missed += 1
+                if self.missed > self.coast_frames:
+                    self.stop(timestamp)
+            return
+        
+        self.missed = 0
+        self.correct(measurement, timestamp)
+        self.timestamp = timestamp
+    
+    def predict(self, timestamp):
+        """Get the (x, y) position at timestamp, or None before the first measurement"""
+        if self.timestamp is None:
+            return None
+        return self.extrapolate(max(0.0, timestamp - self.timestamp))
+    
+    def correct(self, measurement, timestamp):
+        """Incorporate a measurement - to be implemented by subclasses"""
+        pass
+    
+    def extrapolate(self, dt):
+        """Get the position dt seconds after the last measurement - to be implemented by subclasses"""
+        return None
+    
+    def stop(self, timestamp):
+        """Stop coasting after a long dropout, holding the position reached"""
+        pass
+    
+    def reset(self):
+        """Forget all state"""
+        self.missed = 0
+        self.timestamp = None
+
+class MovingAverageFilter(PointerFilter):
+    """Average of the last few measurements (no prediction)"""
+    def __init__(self, size=config.SMOOTHING_WINDOW, **kwargs):
+        super().__init__(**kwargs)
+        self.samples = np.zeros((size, 2))
+        self.count = 0
+    
+    def correct(self, measurement, timestamp):
+        """Add a measurement to the ring buffer"""
+        self.samples[self.count % len(self.samples)] = measurement
+        self.count += 1
+    
+    def extrapolate(self, dt):
+        """Get the average of the buffered measurements"""
+        n = min(self.count, len(self.samples))
+        x, y = self.samples[:n].mean(axis=0)
+        return (x, y)
+    
+    def reset(self):
+        """Empty the buffer"""
+        super().reset()
+        self.count = 0
+
+class OneEuroFilter(PointerFilter):
+    """One-Euro filter: smooths heavily when slow, follows closely when fast"""
+    def __init__(self, min_cutoff=config.ONE_EURO_MIN_CUTOFF, beta=config.ONE_EURO_BETA, 
+                 d_cutoff=config.ONE_EURO_D_CUTOFF, **kwargs):
+        super().__init__(**kwargs)
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.position = np.zeros(2)
+        self.velocity = np.zeros(2)
+        self.lag = 0.0
+    
+    @staticmethod
+    def alpha(dt, cutoff):
+        """Smoothing factor of a first-order low-pass filter"""
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+    
+    def correct(self, measurement, timestamp):
+        """Filter a measurement"""
+        if self.timestamp is None:
+            self.position[:] = measurement
+            self.velocity[:] = 0
+            self.lag = 0.0
+            return
+        
+        dt = max(timestamp - self.timestamp, 1e-3)
+        raw_velocity = (np.asarray(measurement, dtype=float) - self.position) / dt
+        self.velocity += self.alpha(dt, self.d_cutoff) * (raw_velocity - self.velocity)
+        
+        cutoff = self.min_cutoff + self.beta * float(np.hypot(*self.velocity))
+        a = self.alpha(dt, cutoff)
+        self.position += a * (np.asarray(measurement, dtype=float) - self.position)
+        
+        # Steady-state delay of the position low-pass at this cutoff
+        self.lag = dt * (1.0 - a) / a
+    
+    def extrapolate(self, dt):
+        """Get the filtered position moved along the filtered velocity,
+        making up for the delay the smoothing added"""
+        x, y = self.position + self.velocity * (dt + self.lag)
+        return (x, y)
+    
+    def stop(self, timestamp):
+        """Hold the position reached when coasting is over"""
+        self.position += self.velocity * (timestamp - self.timestamp + self.lag)
+        self.velocity[:] = 0
+        self.lag = 0.0
+        self.timestamp = timestamp
+
+class KalmanFilter(PointerFilter):
+    """Constant-velocity Kalman filter over the state (x, y, vx, vy)"""
+    def __init__(self, process_noise=config.KALMAN_PROCESS_NOISE, 
+                 measurement_noise=config.KALMAN_MEASUREMENT_NOISE, **kwargs):
+        super().__init__(**kwargs)
+        self.process_noise = process_noise
+        self.state = np.zeros(4)
+        self.covariance = np.eye(4)
+        self.transition = np.eye(4)
+        self.observation = np.eye(2, 4)
+        self.measurement_covariance = np.eye(2) * measurement_noise
+    
+    def advance(self, dt):
+        """Propagate the state dt seconds forward"""
+        self.transition[0, 2] = dt
+        self.transition[1, 3] = dt
+        
+        # White acceleration noise model
+        q = self.process_noise
+        dt2 = dt * dt
+        noise = np.array([
+            [dt2 * dt2 / 4, 0, dt2 * dt / 2, 0],
+            [0, dt2 * dt2 / 4, 0, dt2 * dt / 2],
+            [dt2 * dt / 2, 0, dt2, 0],
+            [0, dt2 * dt / 2, 0, dt2],
+        ]) * q
+        
+        self.state = self.transition @ self.state
+        self.covariance = self.transition @ self.covariance @ self.transition.T + noise
+    
+    def correct(self, measurement, timestamp):
+        """Predict to timestamp and fuse the measurement"""
+        if self.timestamp is None:
+            self.state[:] = (measurement[0], measurement[1], 0, 0)
+            self.covariance = np.diag([1.0, 1.0, 1e4, 1e4])
+            return
+        
+        self.advance(max(timestamp - self.timestamp, 1e-3))
+        
+        innovation = np.asarray(measurement, dtype=float) - self.state[:2]
+        innovation_cov = self.covariance[:2, :2] + self.measurement_covariance
+        gain = self.covariance[:, :2] @ np.linalg.inv(innovation_cov)
+        self.state += gain @ innovation
+        self.covariance -= gain @ self.observation @ self.covariance
+    
+    def extrapolate(self, dt):
+        """Get the position predicted dt seconds ahead"""
+        x = self.state[0] + self.state[2] * dt
+        y = self.state[1] + self.state[3] * dt
+        return (x, y)
+    
+    def stop(self, timestamp):
+        """Hold the position reached when coasting is over"""
+        self.state[:2] += self.state[2:] * (timestamp - self.timestamp)
+        self.state[2:] = 0
+        self.timestamp = timestamp
+
+# Pointer filters selectable through config.POINTER_FILTER
+FILTERS = {
+    'average': MovingAverageFilter,
+    'one_euro': OneEuroFilter,
+    'kalman': KalmanFilter,
+}
+
+def create_filter(name=None):
+    """Create a pointer filter by name"""
+    return FILTERS[name or config.POINTER_FILTER]()
 
 class ColorDetector:
-    def __init__(self):
+    def __init__(self, headless=False):
         """Initialize the color detector"""
         # Create kernel for morphological operations
         self.kernel = np.ones(config.KERNEL_SIZE, np.uint8)
         
-        # Create the color detection window and trackbars
-        cv2.namedWindow("Color detectors", cv2.WINDOW_NORMAL)
-        cv2.createTrackbar("Lower Hue", "Color detectors", 64, 180, self.trackbar_callback)
-        cv2.createTrackbar("Lower Saturation", "Color detectors", 72, 255, self.trackbar_callback)
-        cv2.createTrackbar("Lower Value", "Color detectors", 49, 255, self.trackbar_callback)
-        cv2.createTrackbar("Upper Hue", "Color detectors", 153, 180, self.trackbar_callback)
-        cv2.createTrackbar("Upper Saturation", "Color detectors", 255, 255, self.trackbar_callback)
-        cv2.createTrackbar("Upper Value", "Color detectors", 255, 255, self.trackbar_callback)
+        # Thresholds change only through trackbar events or the setters
+        self.headless = headless
+        self.thresholds = ThresholdState(config.DEFAULT_HSV_LOWER, config.DEFAULT_HSV_UPPER)
+        
+        if not headless:
+            # Create the color detection window and trackbars
+            cv2.namedWindow("Color detectors", cv2.WINDOW_NORMAL)
+            for index, (name, maximum) in enumerate(TRACKBARS):
+                cv2.createTrackbar(name, "Color detectors", self.thresholds.get_value(index), 
+                                   maximum, lambda value, index=index: self.trackbar_callback(index, value))
         
         # Initialize last detected center
         self.last_center = None
         
-        # Buffer for position smoothing
-        self.position_buffer = []
-        self.max_buffer_size = 5
+        # Pointer filter, predicting ahead by the measured pipeline latency
+        self.filter = create_filter()
+        self.frame_timestamp = None
+        self.latency = 0.0
+        self.latency_compensation = config.LATENCY_COMPENSATION
+        
+        # Region-of-interest tracking state
+        self.tracking = config.ROI_TRACKING
+        self.target_locked = False
+        self.velocity = (0, 0)
+        self.last_radius = 0
+        # Reusable full-frame mask for ROI results, and the window last
+        # written into it, the only part that can hold pixels
+        self.full_mask = None
+        self.mask_window = None
+        
+        # Coarse-to-fine detection, center kept with subpixel precision
+        self.set_detection_scale(config.DETECTION_SCALE)
+        self.subpixel_center = None
+        
+        # Cleanup passes per mask and search window size factor, lowered
+        # by the quality controller when frames take too long
+        self.morph_passes = 1
+        self.roi_scale = 1.0
+        
+        # Motion gating, and the last result reused for skipped frames
+        self.motion_gate = MotionGate() if config.MOTION_GATING else None
+        self.gate_version = None
+        self.last_mask = None
+        self.last_contour = None
     
-    def trackbar_callback(self, x):
+    def trackbar_callback(self, index, value):
         """Callback function for trackbars"""
-        pass
+        self.thresholds.set_value(index, value)
     
     def get_hsv_values(self):
-        """Get the current HSV thresholds from trackbars"""
-        l_h = cv2.getTrackbarPos("Lower Hue", "Color detectors")
-        l_s = cv2.getTrackbarPos("Lower Saturation", "Color detectors")
-        l_v = cv2.getTrackbarPos("Lower Value", "Color detectors")
-        u_h = cv2.getTrackbarPos("Upper Hue", "Color detectors")
-        u_s = cv2.getTrackbarPos("Upper Saturation", "Color detectors")
-        u_v = cv2.getTrackbarPos("Upper Value", "Color detectors")
-        
-        return np.array([l_h, l_s, l_v]), np.array([u_h, u_s, u_v])
+        """Get the current HSV thresholds"""
+        return self.thresholds.lower, self.thresholds.upper
     
     def set_hsv_values(self, lower_hsv, upper_hsv):
-        """Set HSV values on the trackbars"""
-        cv2.setTrackbarPos("Lower Hue", "Color detectors", lower_hsv[0])
-        cv2.setTrackbarPos("Lower Saturation", "Color detectors", lower_hsv[1])
-        cv2.setTrackbarPos("Lower Value", "Color detectors", lower_hsv[2])
-        cv2.setTrackbarPos("Upper Hue", "Color detectors", upper_hsv[0])
-        cv2.setTrackbarPos("Upper Saturation", "Color detectors", upper_hsv[1])
-        cv2.setTrackbarPos("Upper Value", "Color detectors", upper_hsv[2])
+        """Set the HSV thresholds and move the trackbars to match"""
+        self.thresholds.set(lower_hsv, upper_hsv)
+        
+        if not self.headless:
+            # The resulting callbacks see unchanged values and are no-ops
+            for index, (name, _) in enumerate(TRACKBARS):
+                cv2.setTrackbarPos(name, "Color detectors", self.thresholds.get_value(index))
     
     def set_color_preset(self, color_name):
         """Set a preset HSV range for a specific color"""
@@ -60,67 +477,598 @@ class ColorDetector:
             upper_hsv = config.COLORS[color_name]['default_hsv_upper']
             self.set_hsv_values(lower_hsv, upper_hsv)
     
-    def detect(self, frame):
-        """Detect the colored object in the frame"""
-        # Convert frame to HSV
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    def segment(self, frame, kernel=None):
+        """Threshold and clean up a frame, returning a binary mask"""
+        if kernel is None:
+            kernel = self.kernel
+        
+        # Create mask
+        mask = self.threshold(frame)
         
+        # Apply morphological operations to clean up the mask
+        return clean_mask(mask, kernel, self.morph_passes)
+    
+    def threshold(self, frame):
+        """Create a binary mask of the pixels inside the current HSV range"""
         # Get current HSV thresholds
         lower_hsv, upper_hsv = self.get_hsv_values()
         
-        # Create mask
-        mask = cv2.inRange(hsv, lower_hsv, upper_hsv)
+        # Convert frame to HSV
+        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
         
-        # Apply morphological operations to clean up the mask
-        mask = cv2.erode(mask, self.kernel, iterations=1)
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self.kernel)
-        mask = cv2.dilate(mask, self.kernel, iterations=1)
+        return hsv_in_range(hsv, lower_hsv, upper_hsv)
+    
+    def find_target(self, mask, min_area=config.MIN_CONTOUR_AREA):
+        """Find the largest blob in a mask.
+        
+        Returns (contour, center, radius); center is None if the largest
+        blob is too small.
+        """
+        # Find contours (findContours no longer modifies its input)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        
+        if not contours:
+            return None, None, 0
+        
+        # Find the largest contour
+        largest_contour = max(contours, key=cv2.contourArea)
+        
+        # Only proceed if the contour is large enough
+        if cv2.contourArea(largest_contour) <= min_area:
+            return largest_contour, None, 0
         
-        # Find contours
-        contours, _ = cv2.findContours(mask.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        # Get enclosing circle
+        (_, radius) = cv2.minEnclosingCircle(largest_contour)
         
+        # Calculate center
+        center = get_contour_center(largest_contour)
+        
+        return largest_contour, center, radius
+    
+    def set_detection_scale(self, scale):
+        """Set the downscale factor used for coarse detection (1 = full resolution)"""
+        self.detection_scale = max(1, int(scale))
+        self.coarse_kernel = make_coarse_kernel(self.detection_scale)
+    
+    def set_quality(self, detection_scale, morph_passes, roi_scale):
+        """Apply the detection settings of a quality profile"""
+        self.set_detection_scale(detection_scale)
+        self.morph_passes = max(0, int(morph_passes))
+        self.roi_scale = roi_scale
+    
+    def locate(self, image):
+        """Find the target in an image, returning (mask, contour, center, radius).
+        
+        With a detection scale above 1 the mask is built on a downscaled copy
+        and the centroid is then refined on a full-resolution patch. All
+        results are in the coordinates of the given image.
+        """
+        if self.detection_scale <= 1:
+            mask = self.segment(image)
+            contour, center, radius = self.find_target(mask)
+            if center is not None:
+                self.subpixel_center = center
+            return mask, contour, center, radius
+        
+        height, width = image.shape[:2]
+        small_size = (max(1, width // self.detection_scale),
+                      max(1, height // self.detection_scale))
+        small = cv2.resize(image, small_size, interpolation=cv2.INTER_AREA)
+        
+        # Coarse pass on the downscaled image
+        small_mask = self.segment(small, self.coarse_kernel)
+        min_area = config.MIN_CONTOUR_AREA / (self.detection_scale ** 2)
+        contour, coarse_center, radius = self.find_target(small_mask, min_area)
+        mask = cv2.resize(small_mask, (width, height), interpolation=cv2.INTER_NEAREST)
+        
+        if coarse_center is None:
+            return mask, contour, None, 0
+        
+        # Map the coarse result back to image coordinates
+        scale_x = width / small_size[0]
+        scale_y = height / small_size[1]
+        contour = (contour * np.array([scale_x, scale_y])).astype(np.int32)
+        radius *= max(scale_x, scale_y)
+        center = self.refine_center(
+            image, (coarse_center[0] * scale_x, coarse_center[1] * scale_y), radius)
+        
+        return mask, contour, center, radius
+    
+    def refine_center(self, image, coarse_center, radius):
+        """Refine a coarse center with moments on a full-resolution patch"""
+        height, width = image.shape[:2]
+        margin = int(radius) + config.REFINE_MARGIN
+        x1 = max(0, int(coarse_center[0]) - margin)
+        y1 = max(0, int(coarse_center[1]) - margin)
+        x2 = min(width, int(coarse_center[0]) + margin)
+        y2 = min(height, int(coarse_center[1]) + margin)
+        
+        patch_mask = self.segment(image[y1:y2, x1:x2])
+        M = cv2.moments(patch_mask, binaryImage=True)
+        if M["m00"] == 0:
+            self.subpixel_center = coarse_center
+        else:
+            self.subpixel_center = (x1 + M["m10"] / M["m00"], y1 + M["m01"] / M["m00"])
+        
+        return (int(round(self.subpixel_center[0])), int(round(self.subpixel_center[1])))
+    
+    def get_search_window(self, frame_shape):
+        """Get the (x1, y1, x2, y2) region to search around the last center"""
+        return predict_search_window(self.last_center, self.velocity, self.last_radius,
+                                     frame_shape, self.roi_scale)
+    
+    def detect(self, frame, timestamp=None):
+        """Detect the colored object in the frame captured at timestamp"""
+        if timestamp is None:
+            timestamp = time.monotonic()
+        self.frame_timestamp = timestamp
+        
+        contour = None
         center = None
-        largest_contour = None
+        radius = 0
+        window = None
+        fallback = True
         
-        # Process contours if any found
-        if contours and len(contours) > 0:
-            # Find the largest contour
-            largest_contour = max(contours, key=cv2.contourArea)
-            
-            # Only proceed if the contour is large enough
-            if cv2.contourArea(largest_contour) > 100:
-                # Get enclosing circle
-                ((x, y), radius) = cv2.minEnclosingCircle(largest_contour)
-                
-                # Calculate center
-                center = get_contour_center(largest_contour)
+        # Skip detection while nothing moved where it matters, or search
+        # only where something changed when no marker is in view
+        if self.motion_gate is not None:
+            gate = self.motion_gate
+            if gate.update(frame) and not gate.must_detect() and \
+                    self.gate_version == self.thresholds.version:
+                if self.target_locked:
+                    still = gate.is_still(self.get_search_window(frame.shape))
+                else:
+                    still = gate.is_still()
+                    if not still:
+                        window = gate.get_changed_rect(frame.shape)
+                        fallback = False
+                        gate.narrowed += 1
                 
-                if center:
-                    # Draw the circle and center point
-                    cv2.circle(frame, center, int(radius), (0, 255, 255), 2)
-                    cv2.circle(frame, center, 5, (0, 0, 255), -1)
-                    
-                    # Add to buffer for smoothing
-                    self.position_buffer.append(center)
-                    if len(self.position_buffer) > self.max_buffer_size:
-                        self.position_buffer.pop(0)
-                    
-                    # Update last center
-                    self.last_center = center
-        
-        return frame, mask, center, largest_contour
+                if still:
+                    gate.skip()
+                    return self.reuse_detection(frame, timestamp)
+            
+            gate.accept()
+            self.gate_version = self.thresholds.version
+        
+        # Search only around the last known position while tracking
+        if self.tracking and self.target_locked:
+            window = self.get_search_window(frame.shape)
+        
+        if window is not None:
+            x1, y1, x2, y2 = window
+            roi_mask, contour, center, radius = self.locate(frame[y1:y2, x1:x2])
+            
+            if center is not None:
+                # Shift the result back into full-frame coordinates
+                contour = contour + np.array([x1, y1], dtype=contour.dtype)
+                center = (center[0] + x1, center[1] + y1)
+                self.subpixel_center = (self.subpixel_center[0] + x1,
+                                        self.subpixel_center[1] + y1)
+                mask = self.get_full_mask(frame.shape, roi_mask, window)
+            elif fallback:
+                # Target lost, fall back to a full-frame search
+                window = None
+            else:
+                # Nothing in the changed area, the rest of the frame is as before
+                mask = self.get_full_mask(frame.shape, roi_mask, window)
+        
+        if window is None:
+            mask, contour, center, radius = self.locate(frame)
+        
+        if center:
+            # Draw the circle and center point
+            cv2.circle(frame, center, int(radius), (0, 255, 255), 2)
+            cv2.circle(frame, center, 5, (0, 0, 255), -1)
+            
+            # Update motion estimate used to place the next search window
+            if self.target_locked and self.last_center is not None:
+                self.velocity = (center[0] - self.last_center[0],
+                                 center[1] - self.last_center[1])
+            else:
+                self.velocity = (0, 0)
+            self.last_radius = radius
+            self.target_locked = True
+            
+            # Update last center
+            self.last_center = center
+        else:
+            self.target_locked = False
+            self.velocity = (0, 0)
+        
+        # Feed the filter the subpixel center where available
+        self.filter.update(self.subpixel_center if center else None, timestamp)
+        
+        self.last_mask = mask
+        self.last_contour = contour
+        return frame, mask, center, contour
+    
+    def reuse_detection(self, frame, timestamp):
+        """Return the previous detection for a frame where nothing moved"""
+        center = self.last_center if self.target_locked else None
+        if center:
+            cv2.circle(frame, center, int(self.last_radius), (0, 255, 255), 2)
+            cv2.circle(frame, center, 5, (0, 0, 255), -1)
+        
+        self.velocity = (0, 0)
+        self.filter.update(self.subpixel_center if center else None, timestamp)
+        return frame, self.last_mask, center, self.last_contour if center else None
+    
+    def get_gate_stats(self):
+        """Get motion gating counters, or None if gating is off"""
+        if self.motion_gate is None:
+            return None
+        return self.motion_gate.get_stats()
+    
+    def get_full_mask(self, frame_shape, roi_mask, window):
+        """Place an ROI mask into a reusable full-frame mask"""
+        height, width = frame_shape[:2]
+        if self.full_mask is None or self.full_mask.shape != (height, width):
+            self.full_mask = np.zeros((height, width), dtype=np.uint8)
+        elif self.mask_window is not None:
+            # Only the previous window can contain stale pixels
+            px1, py1, px2, py2 = self.mask_window
+            self.full_mask[py1:py2, px1:px2] = 0
+        
+        x1, y1, x2, y2 = window
+        self.full_mask[y1:y2, x1:x2] = roi_mask
+        self.mask_window = window
+        return self.full_mask
+    
+    def record_latency(self, latency):
+        """Update the running estimate of capture-to-display latency in seconds"""
+        self.latency += config.LATENCY_SMOOTHING * (latency - self.latency)
     
     def get_smoothed_position(self):
-        """Get the smoothed position from buffer"""
-        if not self.position_buffer:
+        """Get the filtered position, predicted to when it will be displayed"""
+        if self.frame_timestamp is None:
+            return None
+        
+        target = self.frame_timestamp
+        if self.latency_compensation:
+            target += self.latency
+        
+        position = self.filter.predict(target)
+        if position is None:
+            return None
+        
+        return (int(round(position[0])), int(round(position[1])))
+    
+    def reset_buffer(self):
+        """Reset the pointer filter"""
+        self.filter.reset()
+        self.last_center = None
+        self.target_locked = False
+        self.velocity = (0, 0)
+        if self.motion_gate is not None:
+            self.motion_gate.reset()
+
+class Marker:
+    """Tracking state of one colored marker"""
+    def __init__(self, color_name):
+        self.color_name = color_name
+        preset = config.COLORS[color_name]
+        self.thresholds = ThresholdState(preset['default_hsv_lower'], preset['default_hsv_upper'])
+        self.center = None
+        self.subpixel_center = None
+        self.radius = 0
+        self.velocity = (0, 0)
+        self.filter = create_filter()
+    
+    def update(self, center, radius, timestamp):
+        """Record the subpixel center found in a frame, None if not found"""
+        if center is None:
+            self.center = None
+            self.velocity = (0, 0)
+        else:
+            point = (int(round(center[0])), int(round(center[1])))
+            if self.center is not None:
+                self.velocity = (point[0] - self.center[0], point[1] - self.center[1])
+            else:
+                self.velocity = (0, 0)
+            self.center = point
+            self.subpixel_center = center
+            self.radius = radius
+        self.filter.update(center, timestamp)
+    
+    def hold(self, timestamp):
+        """Repeat the last detection for a frame where nothing moved"""
+        self.velocity = (0, 0)
+        self.filter.update(self.subpixel_center if self.center else None, timestamp)
+    
+    def get_search_window(self, frame_shape, roi_scale=1.0):
+        """Get the region to search around the last center"""
+        return predict_search_window(self.center, self.velocity, self.radius, frame_shape,
+                                     roi_scale)
+    
+    def get_smoothed_position(self, timestamp):
+        """Get the filtered position at timestamp"""
+        position = self.filter.predict(timestamp)
+        if position is None:
             return None
+        return (int(round(position[0])), int(round(position[1])))
+    
+    def reset_buffer(self):
+        """Reset the pointer filter"""
+        self.filter.reset()
+        self.center = None
+        self.velocity = (0, 0)
+
+class MultiColorDetector:
+    """Tracks several markers of different colors in a single pass.
+    
+    The frame is converted to HSV once. Every color range writes its marker
+    index into a shared label map and the union of all ranges is cleaned up
+    with one set of morphology passes. Each marker's pixels are then
+    labelled on their own with connected components and stats, so markers
+    that touch stay apart. Detection scale, search windows and motion
+    gating work as in ColorDetector; overlapping search windows are merged
+    so no pixel is converted twice.
+    """
+    def __init__(self, color_names, headless=False):
+        """Initialize the detector for the given config.COLORS names"""
+        self.kernel = np.ones(config.KERNEL_SIZE, np.uint8)
+        self.markers = [Marker(name) for name in color_names]
+        self.headless = headless
+        
+        # Latency compensation, as in ColorDetector
+        self.frame_timestamp = None
+        self.latency = 0.0
+        self.latency_compensation = config.LATENCY_COMPENSATION
         
-        x_avg = sum(p[0] for p in self.position_buffer) // len(self.position_buffer)
-        y_avg = sum(p[1] for p in self.position_buffer) // len(self.position_buffer)
+        # Quality settings, as in ColorDetector
+        self.tracking = config.ROI_TRACKING
+        self.detection_scale = 1
+        self.coarse_kernel = self.kernel
+        self.morph_passes = 1
+        self.roi_scale = 1.0
+        self.set_quality(config.DETECTION_SCALE, 1, 1.0)
         
-        return (x_avg, y_avg)
+        # Motion gating, and the combined mask reused for skipped frames
+        self.motion_gate = MotionGate() if config.MOTION_GATING else None
+        self.gate_versions = None
+        self.full_mask = None
+        
+        if not headless:
+            # Keep the controls window other components attach trackbars to
+            cv2.namedWindow("Color detectors", cv2.WINDOW_NORMAL)
+    
+    def set_quality(self, detection_scale, morph_passes, roi_scale):
+        """Apply the detection settings of a quality profile"""
+        self.detection_scale = max(1, int(detection_scale))
+        self.coarse_kernel = make_coarse_kernel(self.detection_scale)
+        self.morph_passes = max(0, int(morph_passes))
+        self.roi_scale = roi_scale
+    
+    def get_marker(self, color_name):
+        """Get the marker tracking a color"""
+        for marker in self.markers:
+            if marker.color_name == color_name:
+                return marker
+        return None
+    
+    def get_search_windows(self, frame_shape):
+        """Get the regions to search as [window, marker indices] pairs.
+        
+        Overlapping search windows are merged into one. Returns None
+        unless every marker is tracked.
+        """
+        windows = []
+        for index, marker in enumerate(self.markers, 1):
+            if marker.center is None:
+                return None
+            window = marker.get_search_window(frame_shape, self.roi_scale)
+            if window is None:
+                return None
+            windows.append([window, [index]])
+        
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(windows)):
+                for j in range(i + 1, len(windows)):
+                    (ax1, ay1, ax2, ay2), (bx1, by1, bx2, by2) = windows[i][0], windows[j][0]
+                    if ax1 < bx2 and bx1 < ax2 and ay1 < by2 and by1 < ay2:
+                        window, indices = windows.pop(j)
+                        windows[i][0] = union_rect(windows[i][0], window)
+                        windows[i][1].extend(indices)
+                        merged = True
+                        break
+                if merged:
+                    break
+        return windows
+    
+    def locate(self, image, indices=None):
+        """Find the markers with the given 1-based indices (all by default) in an image.
+        
+        Returns the cleaned combined mask and {marker index: (subpixel
+        center, radius)} for the markers found, in image coordinates.
+        """
+        if indices is None:
+            indices = range(1, len(self.markers) + 1)
+        height, width = image.shape[:2]
+        scale = self.detection_scale
+        kernel = self.kernel
+        small = image
+        if scale > 1:
+            small = cv2.resize(image, (max(1, width // scale), max(1, height // scale)),
+                               interpolation=cv2.INTER_AREA)
+            kernel = self.coarse_kernel
+        hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+        
+        # Label every pixel with the (1-based) index of the range it falls in
+        id_map = np.zeros(hsv.shape[:2], dtype=np.uint8)
+        for index in indices:
+            marker = self.markers[index - 1]
+            mask = hsv_in_range(hsv, marker.thresholds.lower, marker.thresholds.upper)
+            cv2.min(mask, index, dst=mask)
+            cv2.max(id_map, mask, dst=id_map)
+        
+        # Clean up the union of all ranges once
+        _, mask = cv2.threshold(id_map, 0, 255, cv2.THRESH_BINARY)
+        mask = clean_mask(mask, kernel, self.morph_passes)
+        
+        # Label each marker's pixels separately; 16-bit labels are plenty
+        # for a webcam frame and label much faster
+        scale_x = width / small.shape[1]
+        scale_y = height / small.shape[0]
+        min_area = config.MIN_CONTOUR_AREA / (scale_x * scale_y)
+        marker_mask = np.empty_like(mask)
+        found = {}
+        for index in indices:
+            marker = self.markers[index - 1]
+            cv2.compare(id_map, index, cv2.CMP_EQ, dst=marker_mask)
+            cv2.bitwise_and(marker_mask, mask, dst=marker_mask)
+            
+            # Labelling costs more than finding the marker's extent first
+            bx, by, bw, bh = cv2.boundingRect(marker_mask)
+            if bw == 0 or bh == 0:
+                continue
+            count, _, stats, centroids = cv2.connectedComponentsWithStats(
+                marker_mask[by:by + bh, bx:bx + bw], connectivity=8, ltype=cv2.CV_16U)
+            
+            label = 1 + int(np.argmax(stats[1:, cv2.CC_STAT_AREA]))
+            if stats[label, cv2.CC_STAT_AREA] <= min_area:
+                continue
+            
+            radius = max(stats[label, cv2.CC_STAT_WIDTH], stats[label, cv2.CC_STAT_HEIGHT]) / 2
+            center = ((bx + centroids[label][0]) * scale_x, (by + centroids[label][1]) * scale_y)
+            if scale > 1:
+                radius *= max(scale_x, scale_y)
+                center = self.refine_center(image, marker, center, radius)
+            found[index] = (center, radius)
+        
+        if scale > 1:
+            mask = cv2.resize(mask, (width, height), interpolation=cv2.INTER_NEAREST)
+        return mask, found
+    
+    def refine_center(self, image, marker, coarse_center, radius):
+        """Refine a coarse center with moments on a full-resolution patch"""
+        height, width = image.shape[:2]
+        margin = int(radius) + config.REFINE_MARGIN
+        x1 = max(0, int(coarse_center[0]) - margin)
+        y1 = max(0, int(coarse_center[1]) - margin)
+        x2 = min(width, int(coarse_center[0]) + margin)
+        y2 = min(height, int(coarse_center[1]) + margin)
+        
+        hsv = cv2.cvtColor(image[y1:y2, x1:x2], cv2.COLOR_BGR2HSV)
+        patch_mask = clean_mask(hsv_in_range(hsv, marker.thresholds.lower, marker.thresholds.upper),
+                                self.kernel, self.morph_passes)
+        M = cv2.moments(patch_mask, binaryImage=True)
+        if M["m00"] == 0:
+            return coarse_center
+        return (x1 + M["m10"] / M["m00"], y1 + M["m01"] / M["m00"])
+    
+    def search(self, frame, windows, fallback=True):
+        """Find markers in [window, marker indices] regions of a frame.
+        
+        Returns the combined full-frame mask and what locate() found in
+        frame coordinates, or None if a marker was lost and fallback is set.
+        """
+        height, width = frame.shape[:2]
+        full_mask = np.zeros((height, width), dtype=np.uint8)
+        found = {}
+        for (x1, y1, x2, y2), indices in windows:
+            mask, window_found = self.locate(frame[y1:y2, x1:x2], indices)
+            if fallback and len(window_found) < len(indices):
+                return None
+            
+            full_mask[y1:y2, x1:x2] = mask
+            for index, (center, radius) in window_found.items():
+                found[index] = ((center[0] + x1, center[1] + y1), radius)
+        return full_mask, found
+    
+    def detect(self, frame, timestamp=None):
+        """Detect all markers in the frame captured at timestamp.
+        
+        Returns the annotated frame, the combined mask and a dict of the
+        center found for each marker color (None when not found).
+        """
+        if timestamp is None:
+            timestamp = time.monotonic()
+        self.frame_timestamp = timestamp
+        
+        windows = None
+        fallback = True
+        skip = False
+        
+        # Skip detection while nothing moved around the tracked markers (or
+        # anywhere, unless all are tracked), or search only where something
+        # changed when no marker is in view
+        if self.motion_gate is not None:
+            gate = self.motion_gate
+            versions = tuple(marker.thresholds.version for marker in self.markers)
+            if gate.update(frame) and not gate.must_detect() and self.gate_versions == versions:
+                tracked = self.get_search_windows(frame.shape)
+                if tracked is not None:
+                    skip = all(gate.is_still(window) for window, _ in tracked)
+                else:
+                    skip = gate.is_still()
+                if not skip and all(marker.center is None for marker in self.markers):
+                    window = gate.get_changed_rect(frame.shape)
+                    if window is not None:
+                        windows = [(window, None)]
+                        fallback = False
+                        gate.narrowed += 1
+            
+            if skip:
+                gate.skip()
+                for marker in self.markers:
+                    marker.hold(timestamp)
+            else:
+                gate.accept()
+                self.gate_versions = versions
+        
+        if not skip:
+            # Search only around the markers while all of them are tracked
+            if windows is None and self.tracking:
+                windows = self.get_search_windows(frame.shape)
+            
+            # A lost marker falls back to a full-frame search
+            result = None if windows is None else self.search(frame, windows, fallback)
+            if result is None:
+                result = self.locate(frame)
+            self.full_mask, found = result
+            
+            for index, marker in enumerate(self.markers, 1):
+                center, radius = found.get(index, (None, 0))
+                marker.update(center, radius, timestamp)
+        
+        centers = {}
+        for marker in self.markers:
+            if marker.center is not None:
+                # Draw the circle in the marker's color and the center point
+                cv2.circle(frame, marker.center, int(marker.radius),
+                           config.COLORS[marker.color_name]['bgr'], 2)
+                cv2.circle(frame, marker.center, 5, (0, 0, 255), -1)
+            centers[marker.color_name] = marker.center
+        
+        return frame, self.full_mask, centers
+    
+    def record_latency(self, latency):
+        """Update the running estimate of capture-to-display latency in seconds"""
+        self.latency += config.LATENCY_SMOOTHING * (latency - self.latency)
+    
+    def get_smoothed_position(self, color_name):
+        """Get the filtered position of one marker, predicted to display time"""
+        marker = self.get_marker(color_name)
+        if marker is None or self.frame_timestamp is None:
+            return None
+        
+        target = self.frame_timestamp
+        if self.latency_compensation:
+            target += self.latency
+        return marker.get_smoothed_position(target)
     
     def reset_buffer(self):
-        """Reset position buffer"""
-        self.position_buffer = []
-        self.last_center = None
\ No newline at end of file
+        """Reset all position buffers"""
+        for marker in self.markers:
+            marker.reset_buffer()
+        if self.motion_gate is not None:
+            self.motion_gate.reset()
+    
+    def get_gate_stats(self):
+        """Get motion gating counters, or None if gating is off"""
+        if self.motion_gate is None:
+            return None
+        return self.motion_gate.get_stats()
@@ -0,0 +1,110 @@
+"""
+compositor.py - Preallocated display buffers for the Air Canvas application
+"""
+
+import queue
+import cv2
+import numpy as np
+import config
+
+class CompositeBuffer:
+    """One Air Canvas image with views of its UI strip and camera frame.
+
+    paint holds a copy of the Paint image for frames that carry one across
+    threads; it is allocated on first use.
+    """
+    __slots__ = ('image', 'ui_view', 'frame_view', 'paint')
+
+    def __init__(self, width, frame_height, ui_height):
+        self.image = np.zeros((ui_height + frame_height, width, 3), dtype=np.uint8)
+        self.ui_view = self.image[:ui_height]
+        self.frame_view = self.image[ui_height:]
+        self.paint = None
+
+class Compositor:
+    """Owns the output images of the Air Canvas and Paint windows.
+
+    The Air Canvas image is allocated once with the UI strip on top of the
+    camera frame; both are written straight into views of it, so no new
+    composite is built per frame. The Paint window is only pushed to
+    imshow when the canvas or a shape preview actually changed.
+
+    A pipelined main loop has several frames in flight, so num_buffers
+    images can be preallocated and handed out with acquire() and release().
+    The first one is also available as air_canvas, ui_view and frame_view.
+    """
+    def __init__(self, width=config.WINDOW_WIDTH, frame_height=config.WINDOW_HEIGHT,
+                 ui_height=config.UI_HEIGHT, num_buffers=1):
+        self.width = width
+        self.frame_height = frame_height
+        self.ui_height = ui_height
+
+        # Air Canvas window: UI strip above the camera frame
+        self.buffers = [CompositeBuffer(width, frame_height, ui_height)
+                        for _ in range(max(1, num_buffers))]
+        self.free_buffers = queue.Queue()
+        for buffer in self.buffers:
+            self.free_buffers.put(buffer)
+
+        self.air_canvas = self.buffers[0].image
+        self.ui_view = self.buffers[0].ui_view
+        self.frame_view = self.buffers[0].frame_view
+
+        # Scratch buffer for camera frames of a different size
+        self.resize_buffer = None
+
+        # What the Paint window currently shows
+        self.paint_key = None
+        self.paint_updates = 0
+
+    def acquire(self, timeout=None):
+        """Take a free buffer, or None if none is freed within timeout"""
+        try:
+            return self.free_buffers.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def release(self, buffer):
+        """Return a buffer taken with acquire()"""
+        self.free_buffers.put(buffer)
+
+    def copy_paint(self, image, buffer):
+        """Copy a Paint image into a buffer's own paint image and return that"""
+        if buffer.paint is None or buffer.paint.shape != image.shape:
+            buffer.paint = np.empty_like(image)
+        np.copyto(buffer.paint, image)
+        return buffer.paint
+
+    def load_frame(self, frame, flip=True, buffer=None):
+        """Copy a camera frame into the frame view, mirrored if flip is set"""
+        frame_view = self.frame_view if buffer is None else buffer.frame_view
+        if frame.shape[:2] != frame_view.shape[:2]:
+            if self.resize_buffer is None:
+                self.resize_buffer = np.empty_like(frame_view)
+            cv2.resize(frame, (self.width, self.frame_height), dst=self.resize_buffer)
+            frame = self.resize_buffer
+
+        if flip:
+            cv2.flip(frame, 1, dst=frame_view)
+        else:
+            np.copyto(frame_view, frame)
+        return frame_view
+
+    def show_air_canvas(self, window="Air Canvas", buffer=None):
+        """Display the UI strip and camera frame"""
+        cv2.imshow(window, self.air_canvas if buffer is None else buffer.image)
+
+    def show_paint(self, image, version=None, window="Paint"):
+        """Display the canvas or a preview if it changed.
+
+        version identifies the image contents (e.g. Canvas.version); None
+        means the contents are transient, such as a moving shape preview,
+        and are always shown. Returns True if the window was updated.
+        """
+        if version is not None and version == self.paint_key:
+            return False
+
+        cv2.imshow(window, image)
+        self.paint_key = version
+        self.paint_updates += 1
+        return True
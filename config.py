@@ -7,14 +7,20 @@ WINDOW_WIDTH = 1280
 WINDOW_HEIGHT = 720
 UI_HEIGHT = 80  # Height of the UI section
 
-# Colors dictionary with name, BGR values, HSV default range
+# Camera capture
+CAMERA_INDEX = 0
+FRAME_BUFFER_SIZE = 3  # Slots in the capture ring buffer
+REPLAY_FPS = 30  # Frame rate assumed for recordings in headless replays
+
+# Colors dictionary with name, BGR values, HSV default range. A lower hue
+# above the upper hue selects a range wrapping around 180
 COLORS = {
     'blue': {'bgr': (255, 0, 0), 'text_color': (255, 255, 255), 
              'default_hsv_lower': (100, 150, 100), 'default_hsv_upper': (140, 255, 255)},
     'green': {'bgr': (0, 255, 0), 'text_color': (255, 255, 255), 
               'default_hsv_lower': (40, 100, 100), 'default_hsv_upper': (80, 255, 255)},
     'red': {'bgr': (0, 0, 255), 'text_color': (255, 255, 255), 
-            'default_hsv_lower': (0, 150, 100), 'default_hsv_upper': (10, 255, 255)},
+            'default_hsv_lower': (170, 150, 100), 'default_hsv_upper': (10, 255, 255)},
     'yellow': {'bgr': (0, 255, 255), 'text_color': (50, 50, 50), 
                'default_hsv_lower': (20, 100, 100), 'default_hsv_upper': (40, 255, 255)},
     'purple': {'bgr': (255, 0, 255), 'text_color': (255, 255, 255), 
@@ -27,6 +33,15 @@ COLORS = {
               'default_hsv_lower': (0, 0, 200), 'default_hsv_upper': (180, 30, 255)},
 }
 
+# Initial HSV range of the color detector trackbars
+DEFAULT_HSV_LOWER = (64, 72, 49)
+DEFAULT_HSV_UPPER = (153, 255, 255)
+
+# Marker colors tracked at the same time, one per person, each drawing in
+# its own color, e.g. ['blue', 'red']. Empty tracks a single marker using
+# the HSV trackbars.
+MARKER_COLORS = []
+
 # Tool options
 TOOLS = {
     'brush': {'icon': None, 'text': 'BRUSH'},
@@ -42,23 +57,172 @@ DEFAULT_COLOR = 'blue'
 DEFAULT_TOOL = 'brush'
 DEFAULT_BRUSH_THICKNESS = 5
 
-# Canvas state configuration
-MAX_STATES = 10  # Maximum number of states to save for undo
+# Board: the canvas is larger than the Paint window, which shows a
+# pannable and zoomable viewport of it. Board pixels are stored in
+# TILE_SIZE square tiles allocated when first drawn on; beyond
+# TILE_RESIDENT_LIMIT tiles the least recently used are paged out to a
+# memory-mapped file per layer (TILE_PAGE_FILE with the layer name
+# appended, or a temporary file when None)
+BOARD_WIDTH = 8192
+BOARD_HEIGHT = 8192
+TILE_SIZE = 256
+# Per surface and again for the pre-change copies kept for undo: up to
+# 2 x 64 MB per BGRA layer and 48 MB for the composite, 560 MB in all
+TILE_RESIDENT_LIMIT = 256
+TILE_PAGE_FILE = None
+VIEW_PAN_STEP = 0.25  # Fraction of the viewport moved per pan key press
+VIEW_ZOOM_STEP = 1.25  # Zoom factor per zoom key press
+VIEW_MAX_ZOOM = 8.0
 
-# Deque configuration
-MAX_POINTS = 1024  # Maximum points in deque for each color
+# Layers of the board, bottom first, blended over white. Strokes, shapes
+# and text each go to their own layer and the eraser and CLEAR only affect
+# ERASER_LAYERS
+LAYERS = ('background', 'strokes', 'shapes', 'text')
+ERASER_LAYERS = ('strokes', 'shapes', 'text')
+
+# Canvas history configuration: only the changed region of each operation
+# is kept, and the oldest operations are dropped beyond the byte budget
+HISTORY_BUDGET_BYTES = 64 * 1024 * 1024
+HISTORY_COMPRESSION_LEVEL = 1  # zlib level for stored regions, 0 to disable
 
 # Morphological kernel size
 KERNEL_SIZE = (5, 5)
 
+# Minimum contour area for a detection
+MIN_CONTOUR_AREA = 100
+
+# Region-of-interest tracking: search only a window around the last center
+ROI_TRACKING = True
+ROI_MIN_HALF_SIZE = 48  # Smallest half-width of the search window in pixels
+ROI_RADIUS_SCALE = 3.0  # Window half-width as a multiple of the blob radius
+ROI_VELOCITY_SCALE = 2.0  # Extra margin per pixel/frame of motion
+
+# Coarse-to-fine detection: threshold on a frame downscaled by this factor
+# (1 = full resolution, 2 = half, 4 = quarter) and refine the centroid on a
+# full-resolution patch REFINE_MARGIN pixels larger than the blob
+DETECTION_SCALE = 1
+REFINE_MARGIN = 8
+
+# Motion gating: detection is skipped while a downsampled grayscale copy of
+# the frame has not changed near the tracked marker (or anywhere, when no
+# marker is in view), and narrowed to the changed area when it appears
+MOTION_GATING = True
+MOTION_SCALE = 8  # Downsampling factor of the motion signature
+MOTION_PIXEL_THRESHOLD = 12  # Gray-level change that counts as motion
+MOTION_MIN_CELLS = 2  # Changed signature pixels needed to run detection
+MOTION_MARGIN = 48  # Pixels added around changed areas before searching
+MOTION_MAX_SKIP = 15  # Frames after which a full detection is forced
+
+# Adaptive quality: the time each frame takes is measured and the
+# detector steps through QUALITY_PROFILES, best first, to stay within the
+# frame budget of QUALITY_TARGET_FPS. A profile is left for a cheaper one
+# after QUALITY_DOWNGRADE_FRAMES frames over budget, and for a better one
+# only after QUALITY_UPGRADE_FRAMES frames with plenty of time to spare
+ADAPTIVE_QUALITY = True
+QUALITY_TARGET_FPS = 30
+QUALITY_PROFILES = [
+    # detection_scale: coarse detection downscale (see DETECTION_SCALE)
+    # morph_passes: erode/open/dilate iterations per mask, 0 skips cleanup
+    # roi_scale: size of the tracking search window relative to ROI_*
+    # preview_interval: shape previews are redrawn every this many frames
+    {'name': 'high', 'detection_scale': 1, 'morph_passes': 1, 'roi_scale': 1.0,
+     'preview_interval': 1},
+    {'name': 'balanced', 'detection_scale': 2, 'morph_passes': 1, 'roi_scale': 1.0,
+     'preview_interval': 1},
+    {'name': 'fast', 'detection_scale': 2, 'morph_passes': 1, 'roi_scale': 0.75,
+     'preview_interval': 2},
+    {'name': 'minimal', 'detection_scale': 4, 'morph_passes': 0, 'roi_scale': 0.5,
+     'preview_interval': 3},
+]
+QUALITY_START_PROFILE = 'high'
+QUALITY_DOWNGRADE_RATIO = 0.9  # Average frame time over this share of the budget is too slow
+QUALITY_UPGRADE_RATIO = 0.5  # Under this share there is room for a better profile
+QUALITY_DOWNGRADE_FRAMES = 15
+QUALITY_UPGRADE_FRAMES = 90  # Doubled each time an upgrade has to be undone
+QUALITY_SMOOTHING = 0.1  # Weight of the newest frame in the average frame time
+
+# Pointer filter: 'average' (mean of the last SMOOTHING_WINDOW centers),
+# 'one_euro' or 'kalman' (constant velocity)
+POINTER_FILTER = 'one_euro'
+SMOOTHING_WINDOW = 5
+ONE_EURO_MIN_CUTOFF = 1.0  # Hz, smoothing when the marker is still
+ONE_EURO_BETA = 0.05  # Cutoff increase per pixel/second of speed
+ONE_EURO_D_CUTOFF = 4.0  # Hz, smoothing of the velocity estimate
+KALMAN_PROCESS_NOISE = 5e5  # Acceleration variance (pixels^2/s^4)
+KALMAN_MEASUREMENT_NOISE = 4.0  # Measurement variance (pixels^2)
+FILTER_COAST_FRAMES = 3  # Frames to keep moving on velocity after losing the marker
+
+# Predict the pointer forward by the measured capture-to-display latency
+LATENCY_COMPENSATION = True
+LATENCY_SMOOTHING = 0.1  # Weight of each new latency sample
+
 # Save directory
 SAVE_DIR = 'saved_drawings'
+DOCUMENT_EXTENSION = 'acdoc'  # Vector documents saved alongside images
+
+# Main loop: capture, detection, drawing and display run as pipeline
+# stages on their own threads; False runs them one after another, which
+# is slower but reproducible
+PIPELINE_THREADED = True
+PIPELINE_QUEUE_SIZE = 2  # Frames waiting in front of each stage
+PIPELINE_DROP_POLICY = 'drop_oldest'  # 'drop_oldest' keeps latency low, 'block' keeps every frame
+
+# Profiling: per-stage timing over a rolling window of frames, shown on
+# an optional HUD (toggle with 'h'), dumped to METRICS_EXPORT_PATH
+# (.json or .csv) and/or served at http://127.0.0.1:METRICS_PORT/metrics
+PROFILING = False
+PROFILE_WINDOW = 300
+PROFILE_HUD = False
+METRICS_EXPORT_PATH = None
+METRICS_EXPORT_INTERVAL = 5.0  # Seconds between dumps
+METRICS_PORT = None
+
+# Benchmarks (benchmarks.py): stored baseline and allowed slowdown
+BENCHMARK_BASELINE = 'benchmark_baseline.json'
+BENCHMARK_REGRESSION_PCT = 25.0
+BENCHMARK_MIN_DELTA_MS = 0.05  # Smaller slowdowns are treated as noise
+
+# Session recording: pointer, key and UI events appended to a binary file
+# in SAVE_DIR that session.py can replay without running detection
+SESSION_RECORDING = False
+SESSION_EXTENSION = 'acses'
+SESSION_FLUSH_RECORDS = 256  # Records buffered between writes
+
+# Time-lapse video of the Paint view, encoded on a background thread. A
+# frame is sampled every TIMELAPSE_INTERVAL seconds, or after each
+# finished stroke, shape, text, undo or redo when it is None; frames where
+# the canvas has not changed are skipped
+TIMELAPSE_RECORDING = False
+TIMELAPSE_INTERVAL = 1.0
+TIMELAPSE_FPS = 15
+TIMELAPSE_CODEC = 'mp4v'
+TIMELAPSE_EXTENSION = 'mp4'
+TIMELAPSE_CAMERA = False  # Show the camera view beside the canvas
+TIMELAPSE_MAX_PENDING = 8  # Frames queued beyond this are dropped
+
+# Image saving: format ('png', 'jpg' or 'webp') and encoder settings
+SAVE_FORMAT = 'png'
+PNG_COMPRESSION = 3  # 0-9, higher is smaller but slower
+JPEG_QUALITY = 95  # 0-100
+WEBP_QUALITY = 95  # 1-100, above 100 is lossless
+
+# Background image writer
+WRITER_THREADS = 2
+WRITER_MAX_PENDING = 4  # Saves queued beyond this are refused
 
 # Button dimensions for UI
 BUTTON_WIDTH = 80
 BUTTON_HEIGHT = 60
 BUTTON_SPACING = 10
 
+# Dwell-to-activate: seconds the pointer must rest on a button before it
+# fires, per button group, and a pause after each activation
+DWELL_TIME = 0.6
+DWELL_TIMES = {'clear': 1.2, 'save': 1.0}
+DWELL_REFRACTORY = 0.5
+DWELL_RING_COLOR = (0, 160, 0)
+DWELL_RING_THICKNESS = 4
+
 # Font settings
 FONT = 0  # cv2.FONT_HERSHEY_SIMPLEX
 FONT_SCALE = 0.5
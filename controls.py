@@ -0,0 +1,82 @@
+"""
+controls.py - Pointer and keyboard handling for the Air Canvas application
+
+Shared by the live loop in main.py and by session replay, so a replayed
+session drives the canvas through exactly the same paths.
+"""
+
+import config
+
+def handle_pointer(smoothed_position, ui, tool_manager, canvas, now=None):
+    """Route a pointer position to the UI or to the active drawing tool"""
+    # Check for UI interaction first
+    if ui.handle_click(smoothed_position, tool_manager, canvas, now):
+        return
+    
+    # If not interacting with UI, handle drawing
+    # Adjust y coordinate to account for UI height
+    drawing_position = (smoothed_position[0], 
+                      smoothed_position[1] - config.UI_HEIGHT)
+    
+    # Only draw if position is within canvas
+    if 0 <= drawing_position[1] < canvas.height:
+        tool_manager.handle_drawing(drawing_position)
+
+# Viewport keys: pan by (x, y) steps or zoom by a factor
+PAN_KEYS = {ord('j'): (-1, 0), ord('l'): (1, 0), ord('i'): (0, -1), ord('k'): (0, 1)}
+ZOOM_KEYS = {ord('+'): config.VIEW_ZOOM_STEP, ord('='): config.VIEW_ZOOM_STEP,
+             ord('-'): 1 / config.VIEW_ZOOM_STEP}
+
+def handle_view_key(key, canvas):
+    """Pan or zoom the Paint viewport, returning False for other keys"""
+    if key in PAN_KEYS:
+        dx, dy = PAN_KEYS[key]
+        canvas.pan(dx * canvas.width * config.VIEW_PAN_STEP,
+                   dy * canvas.height * config.VIEW_PAN_STEP)
+    elif key in ZOOM_KEYS:
+        canvas.zoom_by(ZOOM_KEYS[key])
+    elif key == ord('0'):
+        canvas.reset_view()
+    else:
+        return False
+    return True
+
+def handle_key(key, canvas, tool_manager, toggle_hud=None):
+    """Apply a key press other than quit.
+    
+    toggle_hud is called for 'h', when given, to show or hide the
+    profiling HUD.
+    """
+    # Letters go to the text tool while typing, not to the viewport, HUD,
+    # document save or redo
+    tool = tool_manager.get_current_tool()
+    typing = hasattr(tool, 'is_waiting_for_text') and tool.is_waiting_for_text()
+    if not typing:
+        if handle_view_key(key, canvas):
+            return
+        if key == ord('h') and toggle_hud is not None:
+            toggle_hud()
+            return
+    
+    if key == ord('s'):
+        filename = canvas.save()
+        if filename:
+            print(f"Saving canvas as {filename}")
+    elif key == ord('d') and not typing:
+        canvas.save_document()
+    elif key == ord('c'):
+        tool_manager.clear_all()
+        print("Canvas cleared")
+    elif key == ord('z'):
+        if canvas.undo():
+            print("Undo successful")
+        else:
+            print("Nothing to undo")
+    elif key == ord('y') and not typing:
+        if canvas.redo():
+            print("Redo successful")
+        else:
+            print("Nothing to redo")
+    else:
+        # Let tool manager handle other keys (for text input, etc.)
+        tool_manager.handle_key(key)
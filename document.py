@@ -0,0 +1,363 @@
+"""
+document.py - Vector document model for the Air Canvas application
+
+Every brush stroke, eraser stroke, shape, text, clear and background image
+is recorded as a compact Operation, so a drawing can be re-rasterized at
+any resolution, saved to a small binary file and replayed.
+"""
+
+import struct
+import zlib
+import cv2
+import numpy as np
+import config
+from layers import composite_over
+from utils import calculate_distance, points_rect, clip_rect, union_rect
+
+# Tool ids stored in each operation
+TOOL_BRUSH = 0
+TOOL_ERASER = 1
+TOOL_RECTANGLE = 2
+TOOL_CIRCLE = 3
+TOOL_LINE = 4
+TOOL_TEXT = 5
+TOOL_CLEAR = 6
+TOOL_BACKGROUND = 7
+
+# Layer each tool draws on, as on the canvas; erasing and clearing act on
+# config.ERASER_LAYERS
+TOOL_LAYERS = {
+    TOOL_BRUSH: 'strokes',
+    TOOL_RECTANGLE: 'shapes',
+    TOOL_CIRCLE: 'shapes',
+    TOOL_LINE: 'shapes',
+    TOOL_TEXT: 'text',
+    TOOL_BACKGROUND: 'background',
+}
+
+# Binary file layout
+FILE_MAGIC = b'ACDOC'
+FILE_VERSION = 2  # Version 2 added background images
+HEADER = struct.Struct('<5sBHHI')  # magic, version, width, height, operation count
+RECORD = struct.Struct('<B3BHfIH')  # tool, b, g, r, thickness, font scale, points, text bytes
+IMAGE_SIZE = struct.Struct('<I')  # PNG bytes following a background record
+
+class Operation:
+    """One drawing operation with its points in a growable int32 array"""
+    __slots__ = ('tool', 'color', 'thickness', 'font_scale', 'points', 'count', 'text', 'image')
+
+    def __init__(self, tool, color=(0, 0, 0), thickness=1, font_scale=0.0, text='', capacity=16,
+                 image=None):
+        self.tool = tool
+        self.color = tuple(int(c) for c in color)
+        self.thickness = int(thickness)
+        self.font_scale = float(font_scale)
+        self.points = np.empty((capacity, 2), dtype=np.int32)
+        self.count = 0
+        self.text = text
+        self.image = image
+
+    def add_point(self, point):
+        """Append a point, growing the array when full"""
+        if self.count == len(self.points):
+            grown = np.empty((max(16, 2 * len(self.points)), 2), dtype=np.int32)
+            grown[:self.count] = self.points[:self.count]
+            self.points = grown
+
+        self.points[self.count] = point
+        self.count += 1
+
+    def get_points(self):
+        """Get the recorded points as an (N, 2) array"""
+        return self.points[:self.count]
+
+    def matches(self, tool, color, thickness):
+        """Check if a stroke point with these settings can extend this operation"""
+        return (self.tool == tool and self.thickness == int(thickness) and
+                self.color == tuple(int(c) for c in color))
+
+    def get_layers(self):
+        """Get the names of the canvas layers the operation changes"""
+        if self.tool in (TOOL_ERASER, TOOL_CLEAR):
+            return config.ERASER_LAYERS
+        return (TOOL_LAYERS[self.tool],)
+
+    def scale_points(self, scale):
+        """Get the points and thickness scaled by scale"""
+        points = self.get_points()
+        if scale != 1.0:
+            points = np.round(points * scale).astype(np.int32)
+        pts = [tuple(int(v) for v in p) for p in points]
+        return pts, max(1, int(round(self.thickness * scale)))
+
+    def get_rect(self, scale=1.0):
+        """Get the scaled area the operation can draw on, or None for a clear"""
+        pts, thickness = self.scale_points(scale)
+        if self.tool == TOOL_CLEAR or not pts:
+            return None
+        if self.tool == TOOL_CIRCLE:
+            radius = int(calculate_distance(pts[0], pts[1]))
+            return points_rect(pts[:1], radius + thickness)
+        if self.tool == TOOL_TEXT:
+            (width, height), baseline = cv2.getTextSize(self.text, cv2.FONT_HERSHEY_SIMPLEX,
+                                                        self.font_scale * scale, thickness)
+            x, y = pts[0]
+            return (x - thickness, y - height - thickness,
+                    x + width + thickness, y + baseline + thickness)
+        if self.tool == TOOL_BACKGROUND:
+            width, height = self.get_image_size(scale)
+            x, y = pts[0]
+            return (x, y, x + width, y + height)
+        return points_rect(pts, thickness + 1)
+
+    def get_image_size(self, scale):
+        """Get the (width, height) of the operation's image scaled by scale"""
+        height, width = self.image.shape[:2]
+        if scale == 1.0:
+            return width, height
+        return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+    def render(self, layer, scale=1.0, origin=(0, 0)):
+        """Rasterize the operation onto a BGRA layer image.
+
+        origin is the scaled document position of the layer's top-left
+        corner. Drawing is opaque and erasing makes the layer transparent,
+        as on the canvas.
+        """
+        pts, thickness = self.scale_points(scale)
+        pts = [(x - origin[0], y - origin[1]) for x, y in pts]
+        color = self.color + (255,)
+
+        if self.tool == TOOL_BRUSH:
+            for start, end in zip(pts, pts[1:]):
+                cv2.line(layer, start, end, color, thickness)
+        elif self.tool == TOOL_ERASER:
+            for center in pts:
+                cv2.circle(layer, center, thickness, (0, 0, 0, 0), -1)
+        elif self.tool == TOOL_RECTANGLE:
+            cv2.rectangle(layer, pts[0], pts[1], color, thickness)
+        elif self.tool == TOOL_CIRCLE:
+            radius = int(calculate_distance(pts[0], pts[1]))
+            if radius > 0:
+                cv2.circle(layer, pts[0], radius, color, thickness)
+        elif self.tool == TOOL_LINE:
+            cv2.line(layer, pts[0], pts[1], color, thickness)
+        elif self.tool == TOOL_TEXT:
+            cv2.putText(layer, self.text, pts[0], cv2.FONT_HERSHEY_SIMPLEX,
+                        self.font_scale * scale, color, thickness, cv2.LINE_AA)
+        elif self.tool == TOOL_CLEAR:
+            layer.fill(0)
+        elif self.tool == TOOL_BACKGROUND:
+            self.render_image(layer, pts[0], scale)
+
+    def render_image(self, layer, position, scale):
+        """Paste the operation's image, opaque, at a position of a layer"""
+        pixels = self.image
+        if scale != 1.0:
+            pixels = cv2.resize(pixels, self.get_image_size(scale), interpolation=cv2.INTER_AREA)
+
+        x, y = position
+        x1, y1 = max(x, 0), max(y, 0)
+        x2 = min(x + pixels.shape[1], layer.shape[1])
+        y2 = min(y + pixels.shape[0], layer.shape[0])
+        if x1 < x2 and y1 < y2:
+            layer[y1:y2, x1:x2] = cv2.cvtColor(pixels[y1 - y:y2 - y, x1 - x:x2 - x],
+                                               cv2.COLOR_BGR2BGRA)
+
+class Document:
+    """Ordered list of drawing operations, with undo checkpoints"""
+    def __init__(self, width=config.WINDOW_WIDTH, height=config.WINDOW_HEIGHT - config.UI_HEIGHT):
+        self.width = width
+        self.height = height
+        self.operations = []
+
+        # Strokes still being drawn, keyed by the tool drawing them
+        self.open_strokes = {}
+
+        # Operation counts at each saved canvas state, mirroring canvas undo
+        self.checkpoints = [0]
+        self.redo_stack = []
+
+    def add_stroke_point(self, owner, tool, color, thickness, position, previous=None):
+        """Extend owner's open stroke, starting a new one if settings changed.
+
+        previous seeds a new stroke with the point the tool drew from.
+        """
+        stroke = self.open_strokes.get(owner)
+        if stroke is None or not stroke.matches(tool, color, thickness):
+            stroke = Operation(tool, color, thickness)
+            if previous is not None:
+                stroke.add_point(previous)
+            self.operations.append(stroke)
+            self.open_strokes[owner] = stroke
+
+        stroke.add_point(position)
+
+    def end_stroke(self, owner):
+        """Close owner's open stroke"""
+        self.open_strokes.pop(owner, None)
+
+    def get_finished_count(self):
+        """Get the number of operations no longer being drawn"""
+        return len(self.operations) - len(self.open_strokes)
+
+    def add_shape(self, tool, start_point, end_point, color, thickness):
+        """Record a rectangle, circle or line"""
+        operation = Operation(tool, color, thickness, capacity=2)
+        operation.add_point(start_point)
+        operation.add_point(end_point)
+        self.operations.append(operation)
+
+    def add_text(self, text, position, color, font_scale, thickness):
+        """Record a piece of text"""
+        operation = Operation(TOOL_TEXT, color, thickness, font_scale, text, capacity=1)
+        operation.add_point(position)
+        self.operations.append(operation)
+
+    def add_clear(self):
+        """Record clearing the canvas"""
+        self.open_strokes.clear()
+        self.operations.append(Operation(TOOL_CLEAR, capacity=0))
+
+    def add_background(self, image, origin):
+        """Record a BGR image placed on the background at a board position"""
+        operation = Operation(TOOL_BACKGROUND, capacity=1, image=image.copy())
+        operation.add_point(origin)
+        self.operations.append(operation)
+
+    def checkpoint(self):
+        """Mark the current operations as a saved state"""
+        self.checkpoints.append(len(self.operations))
+        self.redo_stack = []
+
+    def discard_changes(self):
+        """Drop the operations added since the last saved state"""
+        self.open_strokes.clear()
+        del self.operations[self.checkpoints[-1]:]
+
+    def undo(self):
+        """Drop unsaved operations and those of the last saved state"""
+        if len(self.checkpoints) < 2:
+            return False
+
+        self.open_strokes.clear()
+        end = self.checkpoints.pop()
+        start = self.checkpoints[-1]
+        self.redo_stack.append(self.operations[start:end])
+        del self.operations[start:]
+        return True
+
+    def redo(self):
+        """Reapply the operations of the last undone state"""
+        if not self.redo_stack:
+            return False
+
+        self.open_strokes.clear()
+        del self.operations[self.checkpoints[-1]:]
+        self.operations.extend(self.redo_stack.pop())
+        self.checkpoints.append(len(self.operations))
+        return True
+
+    def render(self, image, scale=1.0):
+        """Draw every operation onto a BGR image the way the canvas stacks them.
+
+        Operations are replayed in order onto one transparent image per
+        layer, so erasing only uncovers what lies below ERASER_LAYERS, and
+        the layers are then blended over image in config.LAYERS order.
+        Only the area the operations cover is rendered.
+        """
+        rect = None
+        for operation in self.operations:
+            rect = union_rect(rect, operation.get_rect(scale))
+        rect = clip_rect(rect, image.shape[1], image.shape[0])
+        if rect is None:
+            return image
+
+        x1, y1, x2, y2 = rect
+        layers = {}
+        for operation in self.operations:
+            for name in operation.get_layers():
+                layer = layers.get(name)
+                if layer is None:
+                    # Nothing to erase on a layer not drawn on yet
+                    if operation.tool in (TOOL_ERASER, TOOL_CLEAR):
+                        continue
+                    layer = layers[name] = np.zeros((y2 - y1, x2 - x1, 4), dtype=np.uint8)
+                operation.render(layer, scale, (x1, y1))
+
+        region = image[y1:y2, x1:x2].copy()
+        for name in config.LAYERS:
+            if name in layers:
+                composite_over(region, layers[name])
+        image[y1:y2, x1:x2] = region
+        return image
+
+    def rasterize(self, scale=1.0):
+        """Render the document onto a new white image, scaled by scale"""
+        width = max(1, int(round(self.width * scale)))
+        height = max(1, int(round(self.height * scale)))
+        image = np.full((height, width, 3), 255, dtype=np.uint8)
+        return self.render(image, scale)
+
+    def to_bytes(self):
+        """Serialize the document into a compressed binary blob"""
+        chunks = [HEADER.pack(FILE_MAGIC, FILE_VERSION, self.width, self.height,
+                              len(self.operations))]
+        for operation in self.operations:
+            text = operation.text.encode('utf-8')
+            b, g, r = operation.color
+            chunks.append(RECORD.pack(operation.tool, b, g, r, operation.thickness,
+                                      operation.font_scale, operation.count, len(text)))
+            chunks.append(operation.get_points().astype('<i4').tobytes())
+            chunks.append(text)
+            if operation.tool == TOOL_BACKGROUND:
+                png = cv2.imencode('.png', operation.image)[1].tobytes()
+                chunks.append(IMAGE_SIZE.pack(len(png)))
+                chunks.append(png)
+        return zlib.compress(b''.join(chunks))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Load a document serialized with to_bytes"""
+        data = zlib.decompress(data)
+        magic, version, width, height, count = HEADER.unpack_from(data, 0)
+        if magic != FILE_MAGIC or not 1 <= version <= FILE_VERSION:
+            raise ValueError("Not an Air Canvas document")
+
+        document = cls(width, height)
+        offset = HEADER.size
+        for _ in range(count):
+            tool, b, g, r, thickness, font_scale, npoints, ntext = RECORD.unpack_from(data, offset)
+            offset += RECORD.size
+
+            operation = Operation(tool, (b, g, r), thickness, font_scale, capacity=npoints)
+            operation.points[:] = np.frombuffer(data, dtype='<i4', count=npoints * 2,
+                                                offset=offset).reshape(npoints, 2)
+            operation.count = npoints
+            offset += npoints * 8
+
+            operation.text = data[offset:offset + ntext].decode('utf-8')
+            offset += ntext
+
+            if tool == TOOL_BACKGROUND:
+                size, = IMAGE_SIZE.unpack_from(data, offset)
+                offset += IMAGE_SIZE.size
+                png = np.frombuffer(data, dtype=np.uint8, count=size, offset=offset)
+                operation.image = cv2.imdecode(png, cv2.IMREAD_COLOR)
+                offset += size
+            document.operations.append(operation)
+
+        document.checkpoints = [len(document.operations)]
+        return document
+
+    def save(self, path):
+        """Save the document to a binary file"""
+        with open(path, 'wb') as f:
+            f.write(self.to_bytes())
+        return path
+
+    @classmethod
+    def load(cls, path):
+        """Load a document from a binary file"""
+        with open(path, 'rb') as f:
+            return cls.from_bytes(f.read())
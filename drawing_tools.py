@@ -5,8 +5,9 @@ drawing_tools.py - Implementation of drawing tools
 import cv2
 import numpy as np
 import config
-from collections import deque
-from utils import calculate_distance
+from utils import calculate_distance, points_rect, clip_rect
+from document import (TOOL_BRUSH, TOOL_ERASER, TOOL_RECTANGLE, TOOL_CIRCLE, 
+                      TOOL_LINE)
 
 class Tool:
     """Base class for drawing tools"""
@@ -36,14 +37,6 @@ class BrushTool(Tool):
     """Brush tool for freehand drawing"""
     def __init__(self, canvas):
         super().__init__(canvas)
-        self.points = {}
-        self.indices = {}
-        
-        # Initialize points for each color
-        for color in config.COLORS:
-            self.points[color] = [deque(maxlen=config.MAX_POINTS)]
-            self.indices[color] = 0
-        
         self.current_color_name = config.DEFAULT_COLOR
         self.last_position = None
     
@@ -55,14 +48,15 @@ class BrushTool(Tool):
     def handle_drawing(self, position):
         """Handle drawing at the given position"""
         if position is None:
-            # If no position, create a new point collection
-            self.points[self.current_color_name].append(deque(maxlen=config.MAX_POINTS))
-            self.indices[self.current_color_name] += 1
-            self.last_position = None
+            # If no position, end the current stroke
+            self.reset()
             return
         
-        # Add the point to the deque
-        self.points[self.current_color_name][self.indices[self.current_color_name]].appendleft(position)
+        # Record the point in the document, in board coordinates
+        self.canvas.document.add_stroke_point(self, TOOL_BRUSH, self.color,
+                                              self.canvas.to_board_length(self.thickness),
+                                              self.canvas.to_board(position),
+                                              self.canvas.to_board(self.last_position))
         
         # Draw the line on the canvas if there's a previous point
         if self.last_position:
@@ -72,14 +66,12 @@ class BrushTool(Tool):
     
     def reset(self):
         """Reset brush state"""
+        self.canvas.document.end_stroke(self)
         self.last_position = None
         
     def clear(self):
         """Clear all points"""
-        for color in config.COLORS:
-            self.points[color] = [deque(maxlen=config.MAX_POINTS)]
-            self.indices[color] = 0
-        self.last_position = None
+        self.reset()
 
 class EraserTool(Tool):
     """Eraser tool for removing drawn content"""
@@ -90,45 +82,69 @@ class EraserTool(Tool):
     def handle_drawing(self, position):
         """Handle erasing at the given position"""
         if position is None:
-            self.last_position = None
+            self.reset()
             return
         
         # Erase around the position
         erase_radius = self.thickness * 2
+        self.canvas.document.add_stroke_point(self, TOOL_ERASER, (255, 255, 255), 
+                                              self.canvas.to_board_length(erase_radius),
+                                              self.canvas.to_board(position))
         self.canvas.erase(position, erase_radius)
         
         self.last_position = position
     
     def reset(self):
         """Reset eraser state"""
+        self.canvas.document.end_stroke(self)
         self.last_position = None
 
 class ShapeTool(Tool):
     """Base class for shape drawing tools"""
+    tool_id = None
+    
     def __init__(self, canvas):
         super().__init__(canvas)
         self.start_point = None
         self.drawing = False
-        self.temp_canvas = None
+        
+        # Reusable preview buffer; only the region covered by the previous
+        # preview is restored each frame, unless the canvas itself changed
+        self.preview_buffer = None
+        self.preview_rect = None
+        self.preview_version = None
     
     def start_shape(self, position):
         """Start drawing a shape"""
         self.start_point = position
         self.drawing = True
-        self.temp_canvas = self.canvas.get_copy()
     
     def preview_shape(self, position):
-        """Preview the shape during drawing"""
+        """Preview the shape during drawing.
+        
+        The returned image is reused by the next call.
+        """
         if not self.drawing or not self.start_point:
             return self.canvas.get_copy()
         
-        # Create a copy of the temp canvas for preview
-        preview = self.temp_canvas.copy()
+        source = self.canvas.canvas
+        if self.preview_buffer is None or self.preview_buffer.shape != source.shape:
+            self.preview_buffer = source.copy()
+            self.preview_version = self.canvas.version
+        elif self.preview_version != self.canvas.version:
+            # The canvas changed underneath, resync everything
+            np.copyto(self.preview_buffer, source)
+            self.preview_version = self.canvas.version
+        elif self.preview_rect is not None:
+            # Erase the previous preview by restoring its region
+            x1, y1, x2, y2 = self.preview_rect
+            self.preview_buffer[y1:y2, x1:x2] = source[y1:y2, x1:x2]
         
         # Draw preview shape on it
-        self.draw_preview(preview, position)
+        rect = self.draw_preview(self.preview_buffer, position)
+        self.preview_rect = clip_rect(rect, source.shape[1], source.shape[0])
         
-        return preview
+        return self.preview_buffer
     
     def finish_shape(self, position):
         """Complete the shape drawing"""
@@ -137,17 +153,19 @@ class ShapeTool(Tool):
         
         # Draw the final shape on the actual canvas
         self.draw_final_shape(position)
+        self.canvas.document.add_shape(self.tool_id, self.canvas.to_board(self.start_point),
+                                       self.canvas.to_board(position), self.color,
+                                       self.canvas.to_board_length(self.thickness))
         
         # Reset state
         self.drawing = False
         self.start_point = None
-        self.temp_canvas = None
         
         return True
     
     def draw_preview(self, preview_canvas, position):
-        """Draw shape preview - to be implemented by subclasses"""
-        pass
+        """Draw shape preview and return its bounding rectangle - to be implemented by subclasses"""
+        return None
     
     def draw_final_shape(self, position):
         """Draw final shape - to be implemented by subclasses"""
@@ -168,13 +186,15 @@ class ShapeTool(Tool):
         """Reset shape tool state"""
         self.drawing = False
         self.start_point = None
-        self.temp_canvas = None
 
 class RectangleTool(ShapeTool):
     """Tool for drawing rectangles"""
+    tool_id = TOOL_RECTANGLE
+    
     def draw_preview(self, preview_canvas, position):
         """Draw rectangle preview"""
         cv2.rectangle(preview_canvas, self.start_point, position, self.color, self.thickness)
+        return points_rect((self.start_point, position), self.thickness)
     
     def draw_final_shape(self, position):
         """Draw final rectangle"""
@@ -182,10 +202,13 @@ class RectangleTool(ShapeTool):
 
 class CircleTool(ShapeTool):
     """Tool for drawing circles"""
+    tool_id = TOOL_CIRCLE
+    
     def draw_preview(self, preview_canvas, position):
         """Draw circle preview"""
         radius = int(calculate_distance(self.start_point, position))
         cv2.circle(preview_canvas, self.start_point, radius, self.color, self.thickness)
+        return points_rect((self.start_point,), radius + self.thickness)
     
     def draw_final_shape(self, position):
         """Draw final circle"""
@@ -194,13 +217,16 @@ class CircleTool(ShapeTool):
 
 class LineTool(ShapeTool):
     """Tool for drawing straight lines"""
+    tool_id = TOOL_LINE
+    
     def draw_preview(self, preview_canvas, position):
         """Draw line preview"""
         cv2.line(preview_canvas, self.start_point, position, self.color, self.thickness)
+        return points_rect((self.start_point, position), self.thickness)
     
     def draw_final_shape(self, position):
         """Draw final line"""
-        self.canvas.draw_line(self.start_point, position, self.color, self.thickness)
+        self.canvas.draw_line(self.start_point, position, self.color, self.thickness, 'shapes')
 
 class TextTool(Tool):
     """Tool for adding text"""
@@ -235,6 +261,10 @@ class TextTool(Tool):
             font_scale = self.thickness / self.font_scale_ratio
             self.canvas.draw_text(self.current_text, self.text_position, 
                                 self.color, font_scale, self.thickness)
+            self.canvas.document.add_text(self.current_text,
+                                          self.canvas.to_board(self.text_position), self.color,
+                                          font_scale / self.canvas.zoom,
+                                          self.canvas.to_board_length(self.thickness))
             self.canvas.save_state()
             self.reset()
             return True
@@ -269,6 +299,10 @@ class ToolManager:
         self.current_tool_name = config.DEFAULT_TOOL
         self.current_color_name = config.DEFAULT_COLOR
         self.current_thickness = config.DEFAULT_BRUSH_THICKNESS
+        
+        # Incremented whenever state shown in the UI changes (tool, color,
+        # thickness, text being typed) so the UI can cache its panel
+        self.version = 0
     
     def get_current_tool(self):
         """Get the current active tool"""
@@ -288,6 +322,7 @@ class ToolManager:
             tool.set_color(self.current_color_name)
             tool.set_thickness(self.current_thickness)
             
+            self.version += 1
             return True
         return False
     
@@ -300,6 +335,7 @@ class ToolManager:
             for tool in self.tools.values():
                 tool.set_color(color_name)
             
+            self.version += 1
             return True
         return False
     
@@ -312,11 +348,21 @@ class ToolManager:
         for tool in self.tools.values():
             tool.set_thickness(thickness)
         
+        self.version += 1
         return True
     
     def handle_drawing(self, position):
         """Handle drawing with the current tool"""
-        return self.get_current_tool().handle_drawing(position)
+        tool = self.get_current_tool()
+        if isinstance(tool, TextTool):
+            # Placing text shows the input status in the UI
+            self.version += 1
+        return tool.handle_drawing(position)
+    
+    def has_preview(self):
+        """Check if the current tool has a shape preview in progress"""
+        tool = self.get_current_tool()
+        return isinstance(tool, ShapeTool) and tool.drawing
     
     def get_preview(self, position=None):
         """Get preview image if the tool supports it"""
@@ -336,12 +382,15 @@ class ToolManager:
         if isinstance(tool, TextTool) and tool.is_waiting_for_text():
             if key == 8:  # Backspace
                 tool.remove_character()
+                self.version += 1
                 return True
             elif key == 13:  # Enter
                 tool.confirm_text()
+                self.version += 1
                 return True
             elif 32 <= key <= 126:  # Printable ASCII
                 tool.add_character(chr(key))
+                self.version += 1
                 return True
         
         return False
@@ -357,4 +406,5 @@ class ToolManager:
                 tool.clear()
         
         # Clear canvas
-        self.canvas.clear()
\ No newline at end of file
+        self.canvas.clear()
+        self.version += 1
\ No newline at end of file
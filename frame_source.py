@@ -0,0 +1,275 @@
+"""
+frame_source.py - Threaded frame sources for the Air Canvas application
+"""
+
+import os
+import threading
+import time
+import cv2
+import numpy as np
+import config
+
+class FrameSource:
+    """Base class for frame sources captured on a background thread.
+
+    Frames are written into a small preallocated ring buffer. In the default
+    latest-frame mode, read() always returns the newest frame and skips any
+    frames the consumer was too slow to pick up, counting them as dropped.
+    With drop_stale=False every frame is delivered in order instead, which is
+    what offline replays need.
+    """
+    def __init__(self, buffer_size=config.FRAME_BUFFER_SIZE, drop_stale=True):
+        # Two slots is the minimum: one being read, one being written
+        self.buffer_size = max(2, buffer_size)
+        self.drop_stale = drop_stale
+
+        # Ring buffer, allocated once the frame shape is known
+        self.buffer = None
+        self.output = None
+
+        # Capture time of each slot and of the frame last returned by read()
+        self.timestamps = np.zeros(self.buffer_size)
+        self.frame_timestamp = None
+
+        # Sequence counters
+        self.frames_captured = 0
+        self.frames_read = 0
+        self.dropped_frames = 0
+
+        self.condition = threading.Condition()
+        self.thread = None
+        self.running = False
+        self.finished = False
+
+    def open(self):
+        """Open the underlying device - to be implemented by subclasses"""
+        return True
+
+    def grab(self, out=None):
+        """Grab the next frame, into out if given - to be implemented by subclasses"""
+        return False, None
+
+    def close(self):
+        """Close the underlying device - to be implemented by subclasses"""
+        pass
+
+    def start(self):
+        """Open the source and start the capture thread"""
+        if self.running:
+            return True
+
+        if not self.open():
+            return False
+
+        self.running = True
+        self.finished = False
+        self.thread = threading.Thread(target=self._capture_loop, daemon=True)
+        self.thread.start()
+        return True
+
+    def _capture_loop(self):
+        """Capture frames into the ring buffer until stopped or exhausted"""
+        while self.running:
+            # Writing happens outside the lock; the slot after the newest
+            # published frame is never the one a reader is copying from
+            slot = self.frames_captured % self.buffer_size
+
+            if not self.drop_stale:
+                with self.condition:
+                    while (self.running and
+                           self.frames_captured - self.frames_read >= self.buffer_size - 1):
+                        self.condition.wait()
+                if not self.running:
+                    break
+
+            if self.buffer is None:
+                ret, frame = self.grab()
+                if ret:
+                    self.buffer = np.empty((self.buffer_size,) + frame.shape, dtype=frame.dtype)
+                    self.output = np.empty(frame.shape, dtype=frame.dtype)
+                    self.buffer[slot] = frame
+            else:
+                target = self.buffer[slot]
+                ret, frame = self.grab(target)
+                if ret and frame is not target:
+                    # Backend allocated its own array or changed size
+                    if frame is None or frame.shape != target.shape:
+                        ret = False
+                    else:
+                        np.copyto(target, frame)
+
+            with self.condition:
+                if ret:
+                    self.timestamps[slot] = time.monotonic()
+                    self.frames_captured += 1
+                else:
+                    self.finished = True
+                    self.running = False
+                self.condition.notify_all()
+
+    def read(self, timeout=1.0):
+        """Return (ret, frame) for the next frame to process.
+
+        The returned array is reused by the next call to read().
+        """
+        with self.condition:
+            while self.frames_captured <= self.frames_read and not self.finished:
+                if not self.condition.wait(timeout):
+                    return False, None
+
+            if self.frames_captured <= self.frames_read:
+                return False, None
+
+            if self.drop_stale:
+                # Skip straight to the newest frame
+                sequence = self.frames_captured - 1
+                self.dropped_frames += sequence - self.frames_read
+            else:
+                sequence = self.frames_read
+
+            np.copyto(self.output, self.buffer[sequence % self.buffer_size])
+            self.frame_timestamp = float(self.timestamps[sequence % self.buffer_size])
+            self.frames_read = sequence + 1
+            self.condition.notify_all()
+
+        return True, self.output
+
+    def stop(self):
+        """Stop the capture thread and release the source"""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        self.close()
+
+    def get_stats(self):
+        """Get capture statistics"""
+        return {
+            'captured': self.frames_captured,
+            'read': self.frames_read - self.dropped_frames,
+            'dropped': self.dropped_frames,
+        }
+
+class CameraSource(FrameSource):
+    """Frame source reading from a webcam"""
+    def __init__(self, index=config.CAMERA_INDEX, width=config.WINDOW_WIDTH,
+                 height=config.WINDOW_HEIGHT, **kwargs):
+        super().__init__(**kwargs)
+        self.index = index
+        self.width = width
+        self.height = height
+        self.cap = None
+
+    def open(self):
+        """Open the webcam"""
+        self.cap = cv2.VideoCapture(self.index)
+        if not self.cap.isOpened():
+            return False
+
+        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+
+        # Keep the driver queue short so we never read old frames
+        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        return True
+
+    def grab(self, out=None):
+        """Read a frame from the webcam"""
+        if out is None:
+            return self.cap.read()
+        return self.cap.read(out)
+
+    def close(self):
+        """Release the webcam"""
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+class VideoFileSource(CameraSource):
+    """Frame source reading from a recorded video file"""
+    def __init__(self, path, drop_stale=False, **kwargs):
+        super().__init__(index=path, drop_stale=drop_stale, **kwargs)
+        self.path = path
+
+    def open(self):
+        """Open the video file"""
+        if not os.path.isfile(self.path):
+            print(f"Video file not found: {self.path}")
+            return False
+
+        self.cap = cv2.VideoCapture(self.path)
+        return self.cap.isOpened()
+
+class MemorySource(FrameSource):
+    """Frame source replaying a sequence of in-memory frames"""
+    def __init__(self, frames, loop=False, drop_stale=False, **kwargs):
+        super().__init__(drop_stale=drop_stale, **kwargs)
+        self.frames = frames
+        self.loop = loop
+        self.position = 0
+
+    def open(self):
+        """Rewind to the first frame"""
+        self.position = 0
+        return len(self.frames) > 0
+
+    def grab(self, out=None):
+        """Return the next frame in the sequence"""
+        if self.position >= len(self.frames):
+            if not self.loop:
+                return False, None
+            self.position = 0
+
+        frame = self.frames[self.position]
+        self.position += 1
+
+        if out is None:
+            return True, frame
+        if frame.shape != out.shape:
+            return False, None
+        np.copyto(out, frame)
+        return True, out
+
+class ImageFolderSource(FrameSource):
+    """Frame source reading a directory of numbered image files"""
+    EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+    def __init__(self, directory, drop_stale=False, **kwargs):
+        super().__init__(drop_stale=drop_stale, **kwargs)
+        self.directory = directory
+        self.files = []
+        self.position = 0
+
+    def open(self):
+        """List the image files in name order"""
+        if not os.path.isdir(self.directory):
+            print(f"Frame directory not found: {self.directory}")
+            return False
+
+        self.files = sorted(
+            os.path.join(self.directory, name) for name in os.listdir(self.directory)
+            if name.lower().endswith(self.EXTENSIONS))
+        self.position = 0
+        return len(self.files) > 0
+
+    def grab(self, out=None):
+        """Load the next image file"""
+        if self.position >= len(self.files):
+            return False, None
+
+        frame = cv2.imread(self.files[self.position])
+        self.position += 1
+        if frame is None:
+            return False, None
+
+        return True, frame
+
+def open_source(path, **kwargs):
+    """Create a frame source for a video file or a directory of frames"""
+    if os.path.isdir(path):
+        return ImageFolderSource(path, **kwargs)
+    return VideoFileSource(path, **kwargs)
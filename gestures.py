@@ -0,0 +1,67 @@
+"""
+gestures.py - Dwell-to-activate gesture handling for UI buttons
+"""
+
+import config
+
+class DwellActivator:
+    """Turns a pointer hovering over buttons into single activations.
+    
+    A button fires once the pointer has rested on it for its dwell time.
+    It fires only once per hover (edge-triggered): the pointer has to leave
+    and come back to fire it again. After any activation a refractory
+    period passes before another dwell starts counting.
+    """
+    def __init__(self, dwell_time=config.DWELL_TIME, dwell_times=config.DWELL_TIMES, 
+                 refractory=config.DWELL_REFRACTORY):
+        self.dwell_time = dwell_time
+        self.dwell_times = dwell_times
+        self.refractory = refractory
+        
+        self.target = None
+        self.hover_start = 0.0
+        self.fired = False
+        self.refractory_until = 0.0
+        self.last_time = 0.0
+    
+    def get_dwell_time(self, target):
+        """Get the dwell time of a (group, name) button"""
+        return self.dwell_times.get(target[0], self.dwell_time)
+    
+    def update(self, target, now):
+        """Update with the button under the pointer (None if none).
+        
+        Returns True exactly once per hover, when the dwell completes.
+        """
+        self.last_time = now
+        if target != self.target:
+            self.target = target
+            self.hover_start = now
+            self.fired = False
+        
+        if target is None or self.fired:
+            return False
+        
+        # Dwell only counts once the refractory period is over
+        start = max(self.hover_start, self.refractory_until)
+        if now - start < self.get_dwell_time(target):
+            return False
+        
+        self.fired = True
+        self.refractory_until = now + self.refractory
+        return True
+    
+    def get_progress(self, now=None):
+        """Get how far the current dwell is, from 0 to 1 (0 once fired)"""
+        if self.target is None or self.fired:
+            return 0.0
+        if now is None:
+            now = self.last_time
+        
+        start = max(self.hover_start, self.refractory_until)
+        return min(1.0, max(0.0, (now - start) / self.get_dwell_time(self.target)))
+    
+    def reset(self):
+        """Forget the current hover"""
+        self.target = None
+        self.fired = False
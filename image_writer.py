@@ -0,0 +1,97 @@
+"""
+image_writer.py - Background image saving for the Air Canvas application
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+import config
+from utils import get_save_path, get_encode_params
+
+class ImageWriter:
+    """Encodes and writes images on a small thread pool.
+    
+    submit() copies the image and returns at once, so a save never stalls
+    the main loop on PNG encoding (cv2.imwrite releases the GIL). At most
+    max_pending saves are queued or running; further saves are refused
+    rather than piling up snapshots in memory.
+    """
+    def __init__(self, threads=config.WRITER_THREADS, max_pending=config.WRITER_MAX_PENDING,
+                 image_format=config.SAVE_FORMAT, on_complete=None):
+        self.image_format = image_format
+        self.on_complete = on_complete
+        self.executor = ThreadPoolExecutor(max_workers=max(1, threads),
+                                           thread_name_prefix="image-writer")
+        self.slots = threading.BoundedSemaphore(max(1, max_pending))
+        
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.written = 0
+        self.failed = 0
+        self.refused = 0
+        self.closed = False
+    
+    def submit(self, image, prefix="drawing", image_format=None, on_complete=None):
+        """Queue a snapshot of image to be saved.
+        
+        on_complete(path, ok) is called from a writer thread when done,
+        falling back to the writer's own callback. Returns the path the
+        image will be written to, or None if the writer is full or closed.
+        """
+        if self.closed or not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.refused += 1
+            print("Image writer busy, save skipped")
+            return None
+        
+        image_format = image_format or self.image_format
+        path = get_save_path(prefix, image_format)
+        snapshot = np.array(image, copy=True)
+        
+        with self.lock:
+            self.pending += 1
+        self.executor.submit(self._write, snapshot, path, image_format,
+                             on_complete or self.on_complete)
+        return path
+    
+    def _write(self, image, path, image_format, on_complete):
+        """Encode and write one image, then report the result"""
+        try:
+            ok = bool(cv2.imwrite(path, image, get_encode_params(image_format)))
+        except cv2.error as e:
+            print(f"Failed to save {path}: {e}")
+            ok = False
+        
+        with self.lock:
+            self.pending -= 1
+            if ok:
+                self.written += 1
+            else:
+                self.failed += 1
+        self.slots.release()
+        
+        if on_complete is not None:
+            on_complete(path, ok)
+    
+    def get_stats(self):
+        """Get counts of pending, written, failed and refused saves"""
+        with self.lock:
+            return {
+                'pending': self.pending,
+                'written': self.written,
+                'failed': self.failed,
+                'refused': self.refused,
+            }
+    
+    def shutdown(self, wait=True):
+        """Stop accepting saves, finishing queued ones if wait is set"""
+        self.closed = True
+        self.executor.shutdown(wait=wait)
+
+def report_saved(path, ok):
+    """Completion callback that prints the outcome of a save"""
+    if ok:
+        print(f"Image saved as {path}")
+    else:
+        print(f"Failed to save {path}")
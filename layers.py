@@ -0,0 +1,171 @@
+"""
+layers.py - Layer stack and cached composite of the Air Canvas board
+"""
+
+import cv2
+import numpy as np
+import config
+from tiles import TiledSurface
+from utils import union_rect
+
+def get_page_path(name, page_path=config.TILE_PAGE_FILE):
+    """Get the page file of one surface of the stack, or None for a temporary file.
+
+    Every surface pages into a file of its own; sharing one would have
+    each surface truncate and overwrite the others' pages.
+    """
+    if page_path is None:
+        return None
+    return f"{page_path}.{name}"
+
+class Layer:
+    """One tiled BGRA layer of the board.
+
+    Colors are stored premultiplied by alpha, which is what OpenCV's
+    antialiased drawing produces on a transparent image, so layers blend
+    with a single multiply-add.
+    """
+    def __init__(self, name, width, height, opacity=1.0, visible=True):
+        self.name = name
+        self.surface = TiledSurface(width, height, channels=4, fill=0,
+                                    page_path=get_page_path(name))
+        self.opacity = opacity
+        self.visible = visible
+
+def composite_over(image, layer_pixels, opacity=1.0):
+    """Blend premultiplied BGRA pixels over a BGR image in place"""
+    color = cv2.cvtColor(layer_pixels, cv2.COLOR_BGRA2BGR)
+    alpha = cv2.extractChannel(layer_pixels, 3)
+    if opacity < 1.0:
+        color = cv2.convertScaleAbs(color, alpha=opacity)
+        alpha = cv2.convertScaleAbs(alpha, alpha=opacity)
+
+    inverse = cv2.merge((255 - alpha,) * 3)
+    cv2.multiply(image, inverse, dst=image, scale=1.0 / 255)
+    cv2.add(image, color, dst=image)
+    return image
+
+class LayerStack:
+    """Ordered layers, bottom first, flattened into a cached BGR composite.
+
+    The composite is itself a TiledSurface over a white page. Changes to a
+    layer only mark the area they cover as stale; stale areas are
+    re-blended tile by tile when the composite is next read, so the
+    display reads finished pixels instead of blending every layer on
+    every frame.
+    """
+    def __init__(self, width, height, names=config.LAYERS):
+        self.width = width
+        self.height = height
+        self.layers = [Layer(name, width, height) for name in names]
+        self.by_name = {layer.name: layer for layer in self.layers}
+
+        # Flattened composite, and its stale areas: tile key -> rect in the tile
+        self.composite = TiledSurface(width, height, page_path=get_page_path('composite'))
+        self.stale = {}
+
+    def get_layer(self, name):
+        """Get a layer by name"""
+        return self.by_name[name]
+
+    def get_index(self, name):
+        """Get the position of a layer in the stack"""
+        return self.layers.index(self.by_name[name])
+
+    def invalidate(self, rect):
+        """Mark a board rect as needing re-blending"""
+        for key, tile_rect, _ in self.composite.get_overlaps(rect):
+            self.stale[key] = union_rect(self.stale.get(key), tile_rect)
+
+    def invalidate_layer(self, layer):
+        """Mark everything a layer covers as needing re-blending"""
+        for rect in layer.surface.get_tile_rects():
+            self.invalidate(rect)
+
+    def blend(self, rect):
+        """Blend the visible layers over white for a board rect"""
+        x1, y1, x2, y2 = rect
+        image = np.full((y2 - y1, x2 - x1, 3), 255, dtype=np.uint8)
+        for layer in self.layers:
+            if layer.visible and layer.opacity > 0 and layer.surface.has_tiles(rect):
+                composite_over(image, layer.surface.read_region(rect), layer.opacity)
+        return image
+
+    def read(self, rect, out=None):
+        """Read the flattened board, re-blending the stale parts of rect first"""
+        size = self.composite.tile_size
+        for key, _, _ in self.composite.get_overlaps(rect):
+            stale = self.stale.pop(key, None)
+            if stale is None:
+                continue
+            ox, oy = key[0] * size, key[1] * size
+            board_rect = (ox + stale[0], oy + stale[1], ox + stale[2], oy + stale[3])
+            self.composite.write_region(board_rect, self.blend(board_rect), track=False)
+        return self.composite.read_region(rect, out=out)
+
+    def set_visible(self, name, visible):
+        """Show or hide a layer"""
+        layer = self.by_name[name]
+        if layer.visible != visible:
+            layer.visible = visible
+            self.invalidate_layer(layer)
+
+    def set_opacity(self, name, opacity):
+        """Set a layer's opacity between 0 and 1"""
+        layer = self.by_name[name]
+        opacity = min(max(opacity, 0.0), 1.0)
+        if layer.opacity != opacity:
+            layer.opacity = opacity
+            self.invalidate_layer(layer)
+
+    def clear(self, names):
+        """Clear layers as a tracked change, returning the rects cleared"""
+        rects = []
+        for name in names:
+            rects.extend(self.by_name[name].surface.clear())
+        for rect in rects:
+            self.invalidate(rect)
+        return rects
+
+    def commit(self):
+        """Accept the changes of every layer, as (layer index, rect, before, after) regions"""
+        regions = []
+        for index, layer in enumerate(self.layers):
+            regions.extend((index, rect, before, after)
+                           for rect, before, after in layer.surface.commit())
+        return regions
+
+    def revert(self):
+        """Undo the uncommitted changes of every layer, returning the rects restored"""
+        rects = []
+        for layer in self.layers:
+            rects.extend(layer.surface.revert())
+        for rect in rects:
+            self.invalidate(rect)
+        return rects
+
+    def restore(self, index, rect, pixels):
+        """Write a region of a layer as part of the saved state"""
+        self.layers[index].surface.write_region(rect, pixels, track=False)
+        self.invalidate(rect)
+
+    def get_content_rect(self):
+        """Get the bounding rect of everything drawn on the visible layers, or None"""
+        rect = None
+        for layer in self.layers:
+            if not layer.visible:
+                continue
+            rect = union_rect(rect, layer.surface.get_content_rect())
+        return rect
+
+    def get_stats(self):
+        """Get tile counts per layer and for the composite"""
+        stats = {layer.name: layer.surface.get_stats() for layer in self.layers}
+        stats['composite'] = self.composite.get_stats()
+        return stats
+
+    def close(self):
+        """Release every page file"""
+        for layer in self.layers:
+            layer.surface.close()
+        self.composite.close()
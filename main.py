@@ -2,15 +2,24 @@
 main.py - Main entry point for the Air Canvas application
 """
 
-import cv2
-import numpy as np
+import queue
 import time
-from color_detection import ColorDetector
+import cv2
+from color_detection import ColorDetector, MultiColorDetector
 from canvas import Canvas
 from drawing_tools import ToolManager
 from ui import UserInterface
+from frame_source import CameraSource
+from compositor import Compositor
+from pipeline import Pipeline, FramePacket
+from profiling import Profiler, MetricsServer
+from quality import QualityController
+from session import SessionRecorder
+from timelapse import Timelapse, TimelapseWriter
+from image_writer import ImageWriter, report_saved
+from controls import handle_pointer, handle_key
 import config
-from utils import create_directories, nothing
+from utils import create_directories, get_save_path
 
 def main():
     """Main function to run the application"""
@@ -20,20 +29,254 @@ def main():
     # Create required directories
     create_directories()
     
-    # Initialize components
-    canvas = Canvas()
-    color_detector = ColorDetector()
-    tool_manager = ToolManager(canvas)
+    # Initialize components; saves are encoded off the main loop
+    writer = ImageWriter(on_complete=report_saved)
+    canvas = Canvas(writer)
     ui = UserInterface(config.WINDOW_WIDTH, config.WINDOW_HEIGHT)
     
+    # Each tracked marker drives its own tool manager: (marker color, manager)
+    multi_marker = bool(config.MARKER_COLORS)
+    if multi_marker:
+        color_detector = MultiColorDetector(config.MARKER_COLORS)
+        pointers = []
+        for color_name in config.MARKER_COLORS:
+            manager = ToolManager(canvas)
+            manager.set_color(color_name)
+            pointers.append((color_name, manager))
+    else:
+        color_detector = ColorDetector()
+        pointers = [(None, ToolManager(canvas))]
+    
+    # The first marker's tools are shown in the UI and receive key presses
+    tool_manager = pointers[0][1]
+    
+    # Per-stage timing; near free unless profiling, the HUD or an export is on
+    profiler = Profiler(enabled=(config.PROFILING or config.PROFILE_HUD or
+                                 config.METRICS_EXPORT_PATH is not None or
+                                 config.METRICS_PORT is not None))
+    hud = {'visible': config.PROFILE_HUD}
+    if config.METRICS_EXPORT_PATH is not None:
+        profiler.set_export(config.METRICS_EXPORT_PATH)
+    metrics_server = None
+    if config.METRICS_PORT is not None:
+        metrics_server = MetricsServer(profiler)
+        port = metrics_server.start()
+        print(f"Serving metrics at http://127.0.0.1:{port}/metrics")
+    
+    # Detection settings and preview rate adapt to hold the target frame rate
+    quality = QualityController() if config.ADAPTIVE_QUALITY else None
+    quality_state = {'version': None, 'frames': 0}
+    if quality is not None:
+        print(f"Quality profile: {quality.get_profile()['name']}, "
+              f"target {config.QUALITY_TARGET_FPS} fps")
+    
+    # Optional recording of everything that changes the canvas
+    recorder = None
+    pointer_index = {id(manager): i for i, (_, manager) in enumerate(pointers)}
+    if config.SESSION_RECORDING:
+        recorder = SessionRecorder(get_save_path("session", config.SESSION_EXTENSION),
+                                   pointer_colors=[color_name for color_name, _ in pointers])
+        ui.on_action = lambda manager, button: recorder.ui_action(pointer_index[id(manager)],
+                                                                  button)
+        print(f"Recording session to {recorder.path}")
+    
+    # Optional time-lapse video, encoded off the main loop
+    timelapse = None
+    if config.TIMELAPSE_RECORDING:
+        path = get_save_path("timelapse", config.TIMELAPSE_EXTENSION)
+        timelapse = Timelapse(TimelapseWriter(path, (canvas.width, canvas.height)))
+        print(f"Recording time-lapse to {timelapse.writer.path}")
+    
+    # Canvas and tools are only changed by the update stage; key presses
+    # and trackbar changes from the display thread are queued for it as
+    # ('key', code) and ('thickness', value)
+    commands = queue.Queue()
+    
+    def toggle_hud():
+        """Show or hide the profiling HUD, timing from now on if needed"""
+        hud['visible'] = not hud['visible']
+        profiler.enabled = profiler.enabled or hud['visible']
+    
+    def set_thickness(thickness):
+        """Apply the brush size to every marker's tools"""
+        for _, manager in pointers:
+            manager.set_thickness(thickness)
+    
     # Create trackbar for brush thickness
     cv2.createTrackbar("Brush Size", "Color detectors", 
-                     config.DEFAULT_BRUSH_THICKNESS, 25, lambda x: tool_manager.set_thickness(x))
+                     config.DEFAULT_BRUSH_THICKNESS, 25,
+                     lambda thickness: commands.put(('thickness', thickness)))
+    
+    # Initialize webcam on its own capture thread
+    source = CameraSource()
+    if not source.start():
+        print("Failed to open webcam")
+        writer.shutdown()
+        cv2.destroyAllWindows()
+        return
+    
+    def capture():
+        """Read the newest frame into a free Air Canvas buffer"""
+        with profiler.time('capture'):
+            ret, frame = source.read()
+        if not ret:
+            print("Failed to grab frame from webcam")
+            return None
+        
+        with profiler.time('buffer'):
+            buffer = compositor.acquire()
+        
+        # Flip frame horizontally for more intuitive interaction,
+        # straight into the Air Canvas output image
+        with profiler.time('flip'):
+            compositor.load_frame(frame, buffer=buffer)
+        return FramePacket(buffer, source.frame_timestamp)
+    
+    def detect(packet):
+        """Detect the marker(s) and filter their positions"""
+        start = time.perf_counter()
+        if quality is not None and quality_state['version'] != quality.version:
+            quality.apply(color_detector)
+            quality_state['version'] = quality.version
+        
+        with profiler.time('detect'):
+            color_detector.detect(packet.buffer.frame_view, packet.timestamp)
+        
+        with profiler.time('smooth'):
+            for color_name, manager in pointers:
+                if multi_marker:
+                    smoothed_position = color_detector.get_smoothed_position(color_name)
+                else:
+                    smoothed_position = color_detector.get_smoothed_position()
+                
+                # If we have a valid position
+                if smoothed_position:
+                    packet.positions.append((manager, smoothed_position))
+        packet.work.append(time.perf_counter() - start)
+        return packet
+    
+    # Canvas version sent to the display and the packet carrying the newest
+    # Paint image, so it can be sent again if that packet is dropped
+    paint_state = {'version': None, 'packet': None}
+    
+    def attach_paint(packet, image, version=None):
+        """Send a Paint image with a packet; the threaded pipeline gets a copy
+        in the packet's buffer as drawing goes on meanwhile"""
+        if pipeline.threaded:
+            image = compositor.copy_paint(image, packet.buffer)
+        packet.paint = image
+        packet.paint_version = version
+        paint_state['packet'] = packet
+    
+    def release(packet):
+        """Return a dropped packet's buffer, resending its Paint image if it was the newest"""
+        if packet is paint_state['packet']:
+            paint_state['version'] = None
+            paint_state['packet'] = None
+        compositor.release(packet.buffer)
+    
+    def update(packet):
+        """Apply queued input, move the tools and draw the UI panel"""
+        start = time.perf_counter()
+        while not commands.empty():
+            kind, value = commands.get()
+            if kind == 'key':
+                if recorder is not None:
+                    recorder.key(value, packet.timestamp)
+                handle_key(value, canvas, tool_manager, toggle_hud)
+            else:
+                if recorder is not None:
+                    recorder.thickness(value, packet.timestamp)
+                set_thickness(value)
+        
+        # Create UI panel above the frame
+        with profiler.time('ui'):
+            ui.create_ui(tool_manager, packet.buffer.ui_view)
+        
+        # Shape previews may be redrawn only every few frames
+        preview_due = quality is None or quality.is_preview_due(quality_state['frames'])
+        quality_state['frames'] += 1
+        preview_canvas = None
+        preview_skipped = False
+        for manager, smoothed_position in packet.positions:
+            if recorder is not None:
+                recorder.pointer(pointer_index[id(manager)], smoothed_position, packet.timestamp)
+            with profiler.time('draw'):
+                handle_pointer(smoothed_position, ui, manager, canvas, packet.timestamp)
+            
+            # Get preview (for shape tools)
+            if preview_canvas is None and manager.has_preview():
+                if not preview_due:
+                    preview_skipped = True
+                    continue
+                drawing_position = (smoothed_position[0], 
+                                  smoothed_position[1] - config.UI_HEIGHT)
+                with profiler.time('preview'):
+                    preview_canvas = manager.get_preview(drawing_position)
+        
+        # The Paint image only travels with the packet when it changed
+        with profiler.time('paint'):
+            if preview_canvas is not None:
+                attach_paint(packet, preview_canvas)
+                paint_state['version'] = None
+            elif preview_skipped:
+                # Keep showing the last preview rather than the bare canvas
+                pass
+            elif canvas.version != paint_state['version']:
+                attach_paint(packet, canvas.canvas, canvas.version)
+                paint_state['version'] = canvas.version
+        
+        if timelapse is not None:
+            with profiler.time('timelapse'):
+                timelapse.sample(canvas, packet.timestamp, packet.buffer.frame_view)
+        packet.work.append(time.perf_counter() - start)
+        return packet
     
-    # Initialize webcam
-    cap = cv2.VideoCapture(0)
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, config.WINDOW_WIDTH)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, config.WINDOW_HEIGHT)
+    def display(packet):
+        """Show the windows and handle key presses"""
+        start = time.perf_counter()
+        if hud['visible']:
+            with profiler.time('hud'):
+                profiler.draw_hud(packet.buffer.frame_view)
+        
+        with profiler.time('imshow'):
+            compositor.show_air_canvas(buffer=packet.buffer)
+            if packet.paint is not None:
+                compositor.show_paint(packet.paint, packet.paint_version)
+        compositor.release(packet.buffer)
+        packet.work.append(time.perf_counter() - start)
+        
+        # Step the quality profile on the time the frame took
+        if quality is not None:
+            quality.update(packet.get_frame_time(pipeline.threaded))
+        
+        # Measure how long a frame takes from capture to display
+        now = time.monotonic()
+        color_detector.record_latency(now - packet.timestamp)
+        if profiler.enabled:
+            profiler.record('latency', now - packet.timestamp)
+            profiler.tick(now)
+            for stage, depth in pipeline.get_queue_depths().items():
+                profiler.set_gauge(f"queue_{stage}", depth)
+            profiler.set_gauge('dropped_frames', source.dropped_frames)
+            if quality is not None:
+                profiler.set_gauge('quality', quality.index)
+            profiler.maybe_export(now)
+        
+        # Handle key presses
+        with profiler.time('waitkey'):
+            key = cv2.waitKey(1) & 0xFF
+        if key == ord('q'):
+            return False
+        if key != 0xFF:
+            commands.put(('key', key))
+        return True
+    
+    pipeline = Pipeline(capture, [('detect', detect), ('update', update)], display,
+                        release=release)
+    
+    # Preallocated output images of the windows, one per frame in flight
+    compositor = Compositor(num_buffers=pipeline.get_buffer_count())
     
     # Create windows
     cv2.namedWindow("Air Canvas", cv2.WINDOW_NORMAL)
@@ -45,83 +288,53 @@ def main():
     print("Application initialized successfully!")
     print("\nInstructions:")
     print("- Use the trackbars to adjust HSV values for object detection")
-    print("- Use the UI to select tools and colors")
+    print("- Use the UI to select tools and colors: hold the pointer on a button until its ring fills")
     print("- Press 'q' to quit")
     print("- Press 's' to save the canvas")
+    print("- Press 'd' to save the drawing as a vector document")
     print("- Press 'c' to clear the canvas")
     print("- Press 'z' to undo")
+    print("- Press 'y' to redo")
+    print("- Press 'h' to show or hide the profiling HUD")
+    print("- Press 'i', 'j', 'k', 'l' to pan the Paint view, '+' and '-' to zoom, '0' to reset it")
     print("- For text tool: Click where you want to place text, type, and press Enter")
     
-    # Main loop
-    while True:
-        # Capture frame from webcam
-        ret, frame = cap.read()
-        if not ret:
-            print("Failed to grab frame from webcam")
-            break
-        
-        # Flip frame horizontally for more intuitive interaction
-        frame = cv2.flip(frame, 1)
-        
-        # Detect object
-        frame, mask, center, _ = color_detector.detect(frame)
-        
-        # Get smoothed position
-        smoothed_position = color_detector.get_smoothed_position()
-        
-        # Create UI panel
-        ui_panel = ui.create_ui(tool_manager)
-        
-        # If we have a valid position
-        if smoothed_position:
-            # Check for UI interaction first
-            if not ui.handle_click(smoothed_position, tool_manager, canvas):
-                # If not interacting with UI, handle drawing
-                # Adjust y coordinate to account for UI height
-                drawing_position = (smoothed_position[0], 
-                                  smoothed_position[1] - config.UI_HEIGHT)
-                
-                # Only draw if position is within canvas
-                if 0 <= drawing_position[1] < canvas.height:
-                    tool_manager.handle_drawing(drawing_position)
-        
-        # Get preview (for shape tools)
-        if smoothed_position:
-            drawing_position = (smoothed_position[0], 
-                              smoothed_position[1] - config.UI_HEIGHT)
-            preview_canvas = tool_manager.get_preview(drawing_position)
-        else:
-            preview_canvas = canvas.get_copy()
-        
-        # Combine UI and frame
-        frame_with_ui = np.vstack((ui_panel, frame))
-        
-        # Show windows
-        cv2.imshow("Air Canvas", frame_with_ui)
-        cv2.imshow("Paint", preview_canvas)
-        
-        # Handle key presses
-        key = cv2.waitKey(1) & 0xFF
-        
-        if key == ord('q'):
-            break
-        elif key == ord('s'):
-            filename = canvas.save()
-            print(f"Canvas saved as {filename}")
-        elif key == ord('c'):
-            tool_manager.clear_all()
-            print("Canvas cleared")
-        elif key == ord('z'):
-            if canvas.undo():
-                print("Undo successful")
-            else:
-                print("Nothing to undo")
-        else:
-            # Let tool manager handle other keys (for text input, etc.)
-            tool_manager.handle_key(key)
+    # Main loop: the display stage runs here, the others on their own
+    # threads unless config.PIPELINE_THREADED is off
+    pipeline.run()
     
-    # Clean up
-    cap.release()
+    # Clean up, letting queued saves finish
+    source.stop()
+    writer.shutdown()
+    memory = canvas.get_memory_stats()
+    print(f"Board tiles in memory: {memory['resident_tiles']}, paged out: {memory['paged_tiles']}")
+    canvas.close()
+    if recorder is not None:
+        print(f"Session recorded to {recorder.close()}")
+    if timelapse is not None:
+        path = timelapse.close()
+        timelapse_stats = timelapse.get_stats()
+        print(f"Time-lapse of {timelapse_stats['written']} frame(s) written to {path}, "
+              f"{timelapse_stats['dropped']} dropped")
+    if metrics_server is not None:
+        metrics_server.stop()
+    if config.METRICS_EXPORT_PATH is not None:
+        print(f"Metrics written to {profiler.export()}")
+    stats = source.get_stats()
+    print(f"Frames captured: {stats['captured']}, processed: {stats['read']}, "
+          f"dropped: {stats['dropped']}")
+    gate_stats = color_detector.get_gate_stats()
+    if gate_stats:
+        print(f"Detection skipped on {gate_stats['skipped']} of {gate_stats['frames']} frames "
+              f"without motion, narrowed on {gate_stats['narrowed']}")
+    if quality is not None:
+        quality_stats = quality.get_stats()
+        print(f"Quality profile: {quality_stats['profile']} after "
+              f"{len(quality_stats['changes'])} change(s), "
+              f"{quality_stats['average_ms']:.1f} ms per frame")
+    for stage, queue_stats in pipeline.get_stats().items():
+        print(f"Queue before {stage}: peak depth {queue_stats['max_depth']}, "
+              f"dropped {queue_stats['dropped']}")
     cv2.destroyAllWindows()
     print("Application closed")
 
@@ -0,0 +1,260 @@
+"""
+pipeline.py - Staged frame pipeline for the Air Canvas application
+"""
+
+import threading
+from collections import deque
+import config
+
+# What a full queue does with a new item
+DROP_OLDEST = 'drop_oldest'  # Discard the oldest queued item, favouring latency
+BLOCK = 'block'  # Wait for the next stage, so every frame is processed
+
+class StageQueue:
+    """Bounded queue between two pipeline stages"""
+    def __init__(self, name, maxsize=config.PIPELINE_QUEUE_SIZE,
+                 drop_policy=config.PIPELINE_DROP_POLICY):
+        if drop_policy not in (DROP_OLDEST, BLOCK):
+            raise ValueError(f"Unknown drop policy: {drop_policy}")
+
+        self.name = name
+        self.maxsize = max(1, maxsize)
+        self.drop_policy = drop_policy
+        self.items = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+
+        self.dropped = 0
+        self.max_depth = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def put(self, item):
+        """Queue an item, returning the item dropped to make room, if any"""
+        dropped = None
+        with self.condition:
+            if self.drop_policy == BLOCK:
+                while len(self.items) >= self.maxsize and not self.closed:
+                    self.condition.wait()
+            elif len(self.items) >= self.maxsize:
+                dropped = self.items.popleft()
+                self.dropped += 1
+
+            if self.closed:
+                return item
+
+            self.items.append(item)
+            self.max_depth = max(self.max_depth, len(self.items))
+            self.condition.notify_all()
+        return dropped
+
+    def get(self, timeout=None):
+        """Take the oldest item, or None once the queue is closed and empty"""
+        with self.condition:
+            while not self.items and not self.closed:
+                if not self.condition.wait(timeout):
+                    return None
+            if not self.items:
+                return None
+
+            item = self.items.popleft()
+            self.condition.notify_all()
+            return item
+
+    def close(self):
+        """Wake up all waiting stages and refuse further items"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def drain(self):
+        """Remove and return all queued items"""
+        with self.condition:
+            items = list(self.items)
+            self.items.clear()
+            self.condition.notify_all()
+        return items
+
+class Pipeline:
+    """Runs a frame source, a chain of stages and a sink.
+
+    source() returns the next item, or None when there are no more.
+    Each stage is a (name, function) pair; the function takes an item and
+    returns it (or a new one) for the next stage, or None to drop it.
+    sink(item) consumes the result and returns False to stop.
+
+    In threaded mode the source and every stage run on their own thread,
+    connected by bounded StageQueues, so stages that spend their time in
+    OpenCV calls releasing the GIL overlap with each other. The sink runs
+    on the thread calling run(), as display and key handling must stay on
+    the main thread. In serial mode each item goes through all stages
+    before the next is read, which gives reproducible results.
+
+    release(item) is called for items dropped by a full queue or left over
+    when the pipeline stops, so their buffers can be reused.
+    """
+    def __init__(self, source, stages, sink, threaded=config.PIPELINE_THREADED,
+                 queue_size=config.PIPELINE_QUEUE_SIZE, drop_policy=config.PIPELINE_DROP_POLICY,
+                 release=None):
+        self.source = source
+        self.stages = list(stages)
+        self.sink = sink
+        self.threaded = threaded
+        self.release = release
+
+        # queues[0] feeds the first stage, queues[-1] feeds the sink
+        names = [name for name, _ in self.stages] + ['display']
+        self.queues = [StageQueue(name, queue_size, drop_policy) for name in names]
+
+        self.threads = []
+        self.running = False
+        self.frames = 0
+
+    def get_buffer_count(self):
+        """Get how many items can be alive at once in threaded mode.
+
+        Every queue can be full while the source, each stage and the sink
+        hold one item each.
+        """
+        if not self.threaded:
+            return 1
+        return sum(queue.maxsize for queue in self.queues) + len(self.stages) + 2
+
+    def _discard(self, item):
+        """Hand an item that will not reach the sink back to its owner"""
+        if item is not None and self.release is not None:
+            self.release(item)
+
+    def _source_loop(self):
+        """Read items from the source into the first queue"""
+        output = self.queues[0]
+        while self.running:
+            item = self.source()
+            if item is None:
+                break
+            self._discard(output.put(item))
+        output.close()
+
+    def _stage_loop(self, function, input_queue, output_queue):
+        """Run one stage on every item of its input queue"""
+        while self.running:
+            item = input_queue.get()
+            if item is None:
+                break
+
+            result = function(item)
+            if result is None:
+                self._discard(item)
+                continue
+            self._discard(output_queue.put(result))
+        output_queue.close()
+
+    def run(self):
+        """Run until the source is exhausted or the sink returns False"""
+        self.running = True
+        try:
+            if self.threaded:
+                self._run_threaded()
+            else:
+                self._run_serial()
+        finally:
+            self.stop()
+
+    def _run_serial(self):
+        """Process one item at a time on the calling thread"""
+        while self.running:
+            item = self.source()
+            if item is None:
+                return
+
+            for _, function in self.stages:
+                result = function(item)
+                if result is None:
+                    break
+                item = result
+            else:
+                self.frames += 1
+                if not self.sink(item):
+                    return
+                continue
+
+            self._discard(item)
+
+    def _run_threaded(self):
+        """Start a thread per stage and run the sink on the calling thread"""
+        self.threads = [threading.Thread(target=self._source_loop, name="pipeline-source",
+                                         daemon=True)]
+        for i, (name, function) in enumerate(self.stages):
+            self.threads.append(threading.Thread(
+                target=self._stage_loop, args=(function, self.queues[i], self.queues[i + 1]),
+                name=f"pipeline-{name}", daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+        output = self.queues[-1]
+        while self.running:
+            item = output.get()
+            if item is None:
+                return
+
+            self.frames += 1
+            if not self.sink(item):
+                return
+
+    def stop(self):
+        """Stop all stages and release any items still queued"""
+        self.running = False
+        for queue in self.queues:
+            queue.close()
+
+        # Release queued items first, as the source may be waiting for a
+        # free buffer, then whatever the stages put back while finishing
+        self._drain()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+        self._drain()
+
+    def _drain(self):
+        """Release every item left in the queues"""
+        for queue in self.queues:
+            for item in queue.drain():
+                self._discard(item)
+
+    def get_queue_depths(self):
+        """Get the number of items waiting in front of each stage"""
+        return {queue.name: len(queue) for queue in self.queues}
+
+    def get_stats(self):
+        """Get per-queue depth, peak depth and dropped items"""
+        return {
+            queue.name: {
+                'depth': len(queue),
+                'max_depth': queue.max_depth,
+                'dropped': queue.dropped,
+            }
+            for queue in self.queues
+        }
+
+class FramePacket:
+    """One camera frame and what the stages worked out for it"""
+    __slots__ = ('buffer', 'timestamp', 'positions', 'paint', 'paint_version', 'work')
+
+    def __init__(self, buffer, timestamp):
+        self.buffer = buffer
+        self.timestamp = timestamp
+        self.positions = []
+        self.paint = None
+        self.paint_version = None
+        self.work = []  # Seconds each stage spent on the frame
+
+    def get_frame_time(self, threaded):
+        """Get how long the frame held up the pipeline.
+
+        Threaded stages overlap, so the slowest one sets the frame rate;
+        serial stages add up.
+        """
+        if not self.work:
+            return 0.0
+        return max(self.work) if threaded else sum(self.work)
@@ -0,0 +1,294 @@
+"""
+profiling.py - Per-stage timing, HUD and metrics export for the Air Canvas application
+"""
+
+import csv
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import cv2
+import numpy as np
+import config
+
+class RollingHistogram:
+    """Fixed-size ring of the most recent samples of one measurement"""
+    def __init__(self, size=config.PROFILE_WINDOW):
+        self.samples = np.zeros(max(1, size))
+        self.count = 0
+        self.total = 0
+
+    def add(self, value):
+        """Record a sample, overwriting the oldest once full"""
+        self.samples[self.total % len(self.samples)] = value
+        self.total += 1
+        self.count = min(self.count + 1, len(self.samples))
+
+    def get_values(self):
+        """Get a copy of the samples currently held"""
+        return self.samples[:self.count].copy()
+
+    def summary(self):
+        """Get the count, mean, p50/p95/p99 and max of the samples"""
+        values = self.get_values()
+        if len(values) == 0:
+            return None
+
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        return {
+            'count': self.total,
+            'mean': float(values.mean()),
+            'p50': float(p50),
+            'p95': float(p95),
+            'p99': float(p99),
+            'max': float(values.max()),
+        }
+
+class _StageTimer:
+    """Context manager timing one stage into a profiler"""
+    __slots__ = ('profiler', 'stage', 'start')
+
+    def __init__(self, profiler, stage):
+        self.profiler = profiler
+        self.stage = stage
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.stage, time.perf_counter() - self.start)
+        return False
+
+class _NullTimer:
+    """Context manager doing nothing, used while profiling is off"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_TIMER = _NullTimer()
+
+class Profiler:
+    """Collects per-stage latencies, frame rate and gauges.
+
+    Stages are timed with `with profiler.time('detect'):`. While the
+    profiler is disabled this returns a shared no-op context, so the
+    instrumentation left in the main loop costs next to nothing. Each
+    stage keeps a RollingHistogram of its latest window of samples in
+    seconds, written only by the thread running that stage.
+    """
+    def __init__(self, enabled=config.PROFILING, window=config.PROFILE_WINDOW):
+        self.enabled = enabled
+        self.window = window
+        self.stages = {}
+        self.gauges = {}
+
+        # Intervals between displayed frames, for the frame rate
+        self.frame_intervals = RollingHistogram(window)
+        self.last_frame = None
+
+        # Periodic export
+        self.export_path = None
+        self.export_format = None
+        self.export_interval = config.METRICS_EXPORT_INTERVAL
+        self.last_export = time.monotonic()
+
+    def time(self, stage):
+        """Get a context manager timing a stage"""
+        if not self.enabled:
+            return NULL_TIMER
+        return _StageTimer(self, stage)
+
+    def record(self, stage, seconds):
+        """Record a stage latency in seconds"""
+        if not self.enabled:
+            return
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = RollingHistogram(self.window)
+        histogram.add(seconds)
+
+    def set_gauge(self, name, value):
+        """Record the current value of a gauge such as a queue depth"""
+        if self.enabled:
+            self.gauges[name] = value
+
+    def tick(self, now=None):
+        """Mark a frame as displayed"""
+        if not self.enabled:
+            return
+        if now is None:
+            now = time.monotonic()
+        if self.last_frame is not None:
+            self.frame_intervals.add(now - self.last_frame)
+        self.last_frame = now
+
+    def get_fps(self):
+        """Get the frame rate over the rolling window"""
+        values = self.frame_intervals.get_values()
+        if len(values) == 0 or values.sum() <= 0:
+            return 0.0
+        return len(values) / float(values.sum())
+
+    def summary(self):
+        """Get frame rate, gauges and per-stage latencies in milliseconds"""
+        stages = {}
+        for stage, histogram in list(self.stages.items()):
+            stats = histogram.summary()
+            if stats is None:
+                continue
+            for key in ('mean', 'p50', 'p95', 'p99', 'max'):
+                stats[key] *= 1000.0
+            stages[stage] = stats
+
+        return {
+            'timestamp': time.time(),
+            'fps': self.get_fps(),
+            'gauges': dict(self.gauges),
+            'stages': stages,
+        }
+
+    def draw_hud(self, image, position=(10, 20)):
+        """Draw the frame rate and stage latencies onto an image"""
+        summary = self.summary()
+        lines = [f"FPS {summary['fps']:5.1f}"]
+        for stage, stats in summary['stages'].items():
+            lines.append(f"{stage:<9}{stats['p50']:6.2f}{stats['p95']:7.2f} ms")
+        if summary['gauges']:
+            lines.append(" ".join(f"{name}:{value}" for name, value in summary['gauges'].items()))
+
+        x, y = position
+        line_height = 16
+        width = 10 + 9 * max(len(line) for line in lines)
+
+        # Darken the area behind the text so it stays readable on any frame
+        region = image[max(0, y - 14):y - 14 + line_height * len(lines) + 6,
+                       max(0, x - 5):x - 5 + width]
+        region //= 3
+
+        for i, line in enumerate(lines):
+            cv2.putText(image, line, (x, y + i * line_height), cv2.FONT_HERSHEY_PLAIN,
+                        1.0, (255, 255, 255), 1, cv2.LINE_AA)
+        return image
+
+    def export_json(self, path):
+        """Write the current summary as JSON"""
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+        return path
+
+    def export_csv(self, path):
+        """Write the current stage latencies as CSV, one row per stage"""
+        summary = self.summary()
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['stage', 'count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms'])
+            for stage, stats in summary['stages'].items():
+                writer.writerow([stage, stats['count'], f"{stats['mean']:.3f}",
+                                 f"{stats['p50']:.3f}", f"{stats['p95']:.3f}",
+                                 f"{stats['p99']:.3f}", f"{stats['max']:.3f}"])
+            writer.writerow(['fps', '', f"{summary['fps']:.2f}", '', '', '', ''])
+        return path
+
+    def set_export(self, path, export_format=None, interval=config.METRICS_EXPORT_INTERVAL):
+        """Dump metrics to path every interval seconds from maybe_export().
+
+        The format is taken from the extension unless given: 'json' or 'csv'.
+        """
+        if export_format is None:
+            export_format = 'csv' if path.lower().endswith('.csv') else 'json'
+        if export_format not in ('json', 'csv'):
+            raise ValueError(f"Unknown metrics format: {export_format}")
+
+        self.export_path = path
+        self.export_format = export_format
+        self.export_interval = interval
+
+    def maybe_export(self, now=None):
+        """Write the metrics file if the export interval has passed"""
+        if not self.enabled or self.export_path is None:
+            return False
+        if now is None:
+            now = time.monotonic()
+        if now - self.last_export < self.export_interval:
+            return False
+
+        self.last_export = now
+        self.export()
+        return True
+
+    def export(self):
+        """Write the metrics file set with set_export() now"""
+        if self.export_format == 'csv':
+            return self.export_csv(self.export_path)
+        return self.export_json(self.export_path)
+
+    def to_prometheus(self):
+        """Format the metrics in the Prometheus text exposition format"""
+        summary = self.summary()
+        lines = [
+            "# HELP aircanvas_fps Displayed frames per second",
+            "# TYPE aircanvas_fps gauge",
+            f"aircanvas_fps {summary['fps']:.3f}",
+            "# HELP aircanvas_stage_latency_ms Stage latency over the rolling window",
+            "# TYPE aircanvas_stage_latency_ms summary",
+        ]
+        for stage, stats in summary['stages'].items():
+            for quantile, key in (('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99')):
+                lines.append(f'aircanvas_stage_latency_ms{{stage="{stage}",quantile="{quantile}"}} '
+                             f"{stats[key]:.4f}")
+            lines.append(f'aircanvas_stage_latency_ms_count{{stage="{stage}"}} {stats["count"]}')
+
+        if summary['gauges']:
+            lines.append("# TYPE aircanvas_gauge gauge")
+        for name, value in summary['gauges'].items():
+            lines.append(f'aircanvas_gauge{{name="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+class MetricsServer:
+    """Serves a profiler's metrics at http://host:port/metrics on a background thread"""
+    def __init__(self, profiler, port=config.METRICS_PORT, host='127.0.0.1'):
+        self.profiler = profiler
+        self.host = host
+        self.port = port
+        self.server = None
+        self.thread = None
+
+    def start(self):
+        """Start serving"""
+        profiler = self.profiler
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+
+                body = profiler.to_prometheus().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self.port
+
+    def stop(self):
+        """Stop serving"""
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            self.thread = None
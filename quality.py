@@ -0,0 +1,130 @@
+"""
+quality.py - Adaptive quality control for the Air Canvas application
+"""
+
+import config
+
+class QualityController:
+    """Steps through performance profiles to hold a target frame rate.
+
+    Every frame reports how long it took. The average frame time is an
+    exponential moving average compared with the frame budget: a run of
+    downgrade_frames frames over downgrade_ratio of the budget moves to the
+    next cheaper profile, a run of upgrade_frames frames under
+    upgrade_ratio moves back to a better one. The gap between the two
+    ratios and the run lengths keep it from oscillating; an upgrade that
+    has to be undone before the next one could happen doubles the run
+    needed for later upgrades.
+
+    Settings change only on update(), called from the display thread;
+    stages compare version with the last one they applied and call
+    apply() when it moved, so detection never sees half a profile.
+    """
+    def __init__(self, profiles=config.QUALITY_PROFILES, target_fps=config.QUALITY_TARGET_FPS,
+                 start=config.QUALITY_START_PROFILE,
+                 downgrade_ratio=config.QUALITY_DOWNGRADE_RATIO,
+                 upgrade_ratio=config.QUALITY_UPGRADE_RATIO,
+                 downgrade_frames=config.QUALITY_DOWNGRADE_FRAMES,
+                 upgrade_frames=config.QUALITY_UPGRADE_FRAMES,
+                 smoothing=config.QUALITY_SMOOTHING, verbose=True):
+        if not profiles:
+            raise ValueError("At least one quality profile is needed")
+        if upgrade_ratio >= downgrade_ratio:
+            raise ValueError("The upgrade ratio must be below the downgrade ratio")
+
+        self.profiles = list(profiles)
+        self.budget = 1.0 / target_fps
+        self.downgrade_time = self.budget * downgrade_ratio
+        self.upgrade_time = self.budget * upgrade_ratio
+        self.downgrade_frames = max(1, downgrade_frames)
+        self.base_upgrade_frames = max(1, upgrade_frames)
+        self.upgrade_frames = self.base_upgrade_frames
+        self.smoothing = smoothing
+        self.verbose = verbose
+
+        self.index = self.get_index(start)
+        self.version = 0
+        self.average = None
+        self.over = 0
+        self.under = 0
+
+        # Frames since the last change and whether it was an upgrade
+        self.frames = 0
+        self.since_change = 0
+        self.last_upgrade = False
+        self.changes = []
+
+    def get_index(self, name):
+        """Get the position of a profile by name"""
+        for index, profile in enumerate(self.profiles):
+            if profile['name'] == name:
+                return index
+        raise ValueError(f"Unknown quality profile: {name}")
+
+    def get_profile(self):
+        """Get the current profile"""
+        return self.profiles[self.index]
+
+    def update(self, frame_time):
+        """Record how long a frame took in seconds, returning True if the profile changed"""
+        self.frames += 1
+        self.since_change += 1
+        if self.average is None:
+            self.average = frame_time
+        else:
+            self.average += self.smoothing * (frame_time - self.average)
+
+        if self.average > self.downgrade_time:
+            self.over += 1
+            self.under = 0
+        elif self.average < self.upgrade_time:
+            self.under += 1
+            self.over = 0
+        else:
+            self.over = 0
+            self.under = 0
+
+        if self.over >= self.downgrade_frames and self.index < len(self.profiles) - 1:
+            # Back off further before the next upgrade if this one failed
+            if self.last_upgrade and self.since_change < self.upgrade_frames:
+                self.upgrade_frames = min(self.upgrade_frames * 2, self.base_upgrade_frames * 8)
+            self.set_index(self.index + 1, upgrade=False)
+            return True
+
+        if self.under >= self.upgrade_frames and self.index > 0:
+            self.set_index(self.index - 1, upgrade=True)
+            return True
+        return False
+
+    def set_index(self, index, upgrade):
+        """Switch to the profile at index and log it"""
+        self.index = index
+        self.version += 1
+        self.over = 0
+        self.under = 0
+        self.since_change = 0
+        self.last_upgrade = upgrade
+        self.changes.append((self.frames, self.get_profile()['name']))
+
+        if self.verbose:
+            print(f"Quality profile: {self.get_profile()['name']} "
+                  f"({self.average * 1000:.1f} ms per frame, budget {self.budget * 1000:.1f} ms)")
+
+    def apply(self, detector):
+        """Apply the current profile's detection settings to a detector"""
+        profile = self.get_profile()
+        detector.set_quality(profile['detection_scale'], profile['morph_passes'],
+                             profile['roi_scale'])
+
+    def is_preview_due(self, frame_index):
+        """Check whether shape previews are redrawn on a frame"""
+        return frame_index % max(1, self.get_profile()['preview_interval']) == 0
+
+    def get_stats(self):
+        """Get the current profile, average frame time and the changes so far"""
+        return {
+            'profile': self.get_profile()['name'],
+            'average_ms': (self.average or 0.0) * 1000,
+            'budget_ms': self.budget * 1000,
+            'changes': list(self.changes),
+        }
@@ -0,0 +1,178 @@
+"""
+replay.py - Headless replay benchmark for the Air Canvas application
+
+Feeds a recorded video or a directory of frames through the same detection,
+UI and drawing path as main.py, without creating any windows, and reports
+throughput and per-stage latency.
+
+Usage:
+    python replay.py recording.mp4 --output replay_canvas.png
+"""
+
+import argparse
+import hashlib
+import time
+import cv2
+import numpy as np
+import config
+from canvas import Canvas
+from color_detection import ColorDetector
+from controls import handle_pointer
+from drawing_tools import ToolManager
+from frame_source import open_source
+from image_writer import ImageWriter, report_saved
+from ui import UserInterface
+from utils import create_directories
+
+# Stages timed for every frame, in pipeline order
+STAGES = ('capture', 'detect', 'smooth', 'ui', 'draw', 'preview', 'total')
+
+class StageTimer:
+    """Collects per-stage latencies for a replay run"""
+    def __init__(self, stages=STAGES):
+        self.samples = {stage: [] for stage in stages}
+
+    def record(self, stage, start):
+        """Record the time elapsed since start for a stage"""
+        elapsed = time.perf_counter() - start
+        self.samples[stage].append(elapsed)
+        return elapsed
+
+    def summary(self):
+        """Get mean and p50/p95/p99 latency in milliseconds for each stage"""
+        results = {}
+        for stage, samples in self.samples.items():
+            if not samples:
+                continue
+            values = np.array(samples) * 1000.0
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            results[stage] = {
+                'mean': float(values.mean()),
+                'p50': float(p50),
+                'p95': float(p95),
+                'p99': float(p99),
+            }
+        return results
+
+def run_replay(source, color=None, flip=True, max_frames=None):
+    """Run every frame of source through the drawing pipeline.
+
+    Returns the canvas, the stage timer, the number of frames processed,
+    the wall-clock time of the run and the motion gating counters.
+    """
+    # Set up the canvas as main.py does, so saves go through the writer
+    create_directories()
+    writer = ImageWriter(on_complete=report_saved)
+    canvas = Canvas(writer)
+    color_detector = ColorDetector(headless=True)
+    tool_manager = ToolManager(canvas)
+    ui = UserInterface(config.WINDOW_WIDTH, config.WINDOW_HEIGHT)
+    timer = StageTimer()
+
+    if color is not None:
+        color_detector.set_color_preset(color)
+
+    # Replays use frame-index timestamps so results do not depend on speed
+    color_detector.latency_compensation = False
+
+    if not source.start():
+        raise RuntimeError("Failed to open frame source")
+
+    frames = 0
+    run_start = time.perf_counter()
+
+    try:
+        while max_frames is None or frames < max_frames:
+            frame_start = time.perf_counter()
+
+            # Capture
+            ret, frame = source.read()
+            if not ret:
+                break
+            if flip:
+                frame = cv2.flip(frame, 1)
+            if frame.shape[1] != config.WINDOW_WIDTH or frame.shape[0] != config.WINDOW_HEIGHT:
+                frame = cv2.resize(frame, (config.WINDOW_WIDTH, config.WINDOW_HEIGHT))
+            timer.record('capture', frame_start)
+
+            # Detect
+            start = time.perf_counter()
+            timestamp = frames / config.REPLAY_FPS
+            frame, mask, center, _ = color_detector.detect(frame, timestamp)
+            timer.record('detect', start)
+
+            # Smooth
+            start = time.perf_counter()
+            smoothed_position = color_detector.get_smoothed_position()
+            timer.record('smooth', start)
+
+            # UI panel
+            start = time.perf_counter()
+            ui.create_ui(tool_manager)
+            timer.record('ui', start)
+
+            # UI hit testing and drawing, through the same path as main.py
+            start = time.perf_counter()
+            if smoothed_position:
+                handle_pointer(smoothed_position, ui, tool_manager, canvas, timestamp)
+            timer.record('draw', start)
+
+            # Preview, as it would be shown in the Paint window
+            start = time.perf_counter()
+            if smoothed_position and tool_manager.has_preview():
+                drawing_position = (smoothed_position[0],
+                                    smoothed_position[1] - config.UI_HEIGHT)
+                tool_manager.get_preview(drawing_position)
+            timer.record('preview', start)
+
+            timer.record('total', frame_start)
+            frames += 1
+    finally:
+        source.stop()
+        writer.shutdown()
+
+    return (canvas, timer, frames, time.perf_counter() - run_start,
+            color_detector.get_gate_stats())
+
+def print_report(timer, frames, elapsed):
+    """Print throughput and per-stage latency"""
+    fps = frames / elapsed if elapsed > 0 else 0.0
+    print(f"Frames: {frames}  Time: {elapsed:.2f}s  FPS: {fps:.1f}")
+    print(f"{'stage':<10}{'mean':>10}{'p50':>10}{'p95':>10}{'p99':>10}  (ms)")
+    for stage, stats in timer.summary().items():
+        print(f"{stage:<10}{stats['mean']:>10.3f}{stats['p50']:>10.3f}"
+              f"{stats['p95']:>10.3f}{stats['p99']:>10.3f}")
+
+def canvas_checksum(canvas):
+    """Get a short checksum of the canvas pixels for comparing runs"""
+    return hashlib.sha1(canvas.canvas.tobytes()).hexdigest()[:16]
+
+def main():
+    """Parse arguments and run a headless replay"""
+    parser = argparse.ArgumentParser(description="Headless Air Canvas replay benchmark")
+    parser.add_argument("input", help="Video file or directory of frames")
+    parser.add_argument("--output", default="replay_canvas.png",
+                        help="Where to write the final canvas")
+    parser.add_argument("--color", choices=list(config.COLORS),
+                        help="HSV preset to detect")
+    parser.add_argument("--max-frames", type=int, default=None,
+                        help="Stop after this many frames")
+    parser.add_argument("--no-flip", action="store_true",
+                        help="Do not mirror frames horizontally")
+    args = parser.parse_args()
+
+    source = open_source(args.input)
+    canvas, timer, frames, elapsed, gate_stats = run_replay(
+        source, color=args.color, flip=not args.no_flip, max_frames=args.max_frames)
+
+    print_report(timer, frames, elapsed)
+    if gate_stats:
+        print(f"Motion gating skipped {gate_stats['skipped']} and narrowed "
+              f"{gate_stats['narrowed']} of {gate_stats['frames']} detections")
+
+    cv2.imwrite(args.output, canvas.canvas)
+    print(f"Final canvas written to {args.output} (checksum {canvas_checksum(canvas)})")
+    canvas.close()
+
+if __name__ == "__main__":
+    main()
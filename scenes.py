@@ -0,0 +1,413 @@
+"""
+scenes.py - Synthetic camera scenes with ground truth for the Air Canvas application
+
+Renders reproducible frame sequences of colored markers moving along
+scripted paths over a textured background, with optional sensor noise,
+motion blur, lighting drift, occluders and distractor objects. Every frame
+comes with the true marker centers, so detection accuracy and latency can
+be measured without a camera.
+
+Usage:
+    python scenes.py scene_frames --frames 300 --markers blue red
+    python replay.py scene_frames --color blue
+"""
+
+import argparse
+import csv
+import os
+import time
+import cv2
+import numpy as np
+import config
+
+def line_path(start, end, period=4.0):
+    """Path going back and forth between two points every period seconds"""
+    start = np.array(start, dtype=np.float64)
+    end = np.array(end, dtype=np.float64)
+
+    def position(t):
+        phase = (t / period) % 1.0
+        weight = 2 * phase if phase < 0.5 else 2 - 2 * phase
+        return tuple(start + (end - start) * weight)
+    return position
+
+def circle_path(center, radius, period=3.0, phase=0.0):
+    """Path around a circle once every period seconds"""
+    def position(t):
+        angle = 2 * np.pi * t / period + phase
+        return (center[0] + radius * np.cos(angle), center[1] + radius * np.sin(angle))
+    return position
+
+def lissajous_path(center, amplitude, frequency=(0.3, 0.4), phase=np.pi / 2):
+    """Figure-of-eight style path, frequency in cycles per second per axis"""
+    def position(t):
+        return (center[0] + amplitude[0] * np.sin(2 * np.pi * frequency[0] * t + phase),
+                center[1] + amplitude[1] * np.sin(2 * np.pi * frequency[1] * t))
+    return position
+
+def waypoint_path(points, speed=300.0, loop=True):
+    """Path through a list of points at speed pixels per second"""
+    points = np.array(points, dtype=np.float64)
+    if loop:
+        points = np.vstack([points, points[:1]])
+    lengths = np.linalg.norm(np.diff(points, axis=0), axis=1)
+    distances = np.concatenate([[0.0], np.cumsum(lengths)])
+    total = distances[-1]
+
+    def position(t):
+        distance = t * speed
+        distance = distance % total if loop and total > 0 else min(distance, total)
+        i = min(int(np.searchsorted(distances, distance, side='right')) - 1, len(lengths) - 1)
+        weight = (distance - distances[i]) / lengths[i] if lengths[i] > 0 else 0.0
+        return tuple(points[i] + (points[i + 1] - points[i]) * weight)
+    return position
+
+def marker_bgr(color_name):
+    """Get a BGR color in the middle of a preset's HSV detection range"""
+    preset = config.COLORS[color_name]
+    lower = np.array(preset['default_hsv_lower'], dtype=np.float64)
+    upper = np.array(preset['default_hsv_upper'], dtype=np.float64)
+
+    # A hue range with lower > upper wraps around 180
+    if lower[0] > upper[0]:
+        hue = ((lower[0] + upper[0] + 180) / 2) % 180
+    else:
+        hue = (lower[0] + upper[0]) / 2
+    saturation = max(lower[1] + 0.75 * (upper[1] - lower[1]), 200)
+    value = max(lower[2] + 0.75 * (upper[2] - lower[2]), 200)
+
+    hsv = np.uint8([[[round(hue), min(255, round(saturation)), min(255, round(value))]]])
+    return tuple(int(c) for c in cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR)[0, 0])
+
+class SceneMarker:
+    """A marker blob moving along a path"""
+    def __init__(self, color_name, path, radius=25, bgr=None):
+        self.color_name = color_name
+        self.path = path
+        self.radius = radius
+        self.bgr = bgr if bgr is not None else marker_bgr(color_name)
+
+class SceneObject:
+    """A non-marker object: a distractor blob or an occluding rectangle"""
+    def __init__(self, path, size, bgr, shape='circle'):
+        self.path = path
+        self.size = size
+        self.bgr = bgr
+        self.shape = shape
+
+    def get_rect(self, t):
+        """Get the (x1, y1, x2, y2) bounds of the object at time t"""
+        x, y = self.path(t)
+        if self.shape == 'circle':
+            half_w = half_h = self.size
+        else:
+            half_w, half_h = self.size[0] / 2, self.size[1] / 2
+        return (x - half_w, y - half_h, x + half_w, y + half_h)
+
+    def covers(self, point, t):
+        """Check if the object hides a point at time t"""
+        x1, y1, x2, y2 = self.get_rect(t)
+        return x1 <= point[0] <= x2 and y1 <= point[1] <= y2
+
+    def draw(self, image, t):
+        """Draw the object at time t"""
+        if self.shape == 'circle':
+            x, y = self.path(t)
+            cv2.circle(image, (int(round(x)), int(round(y))), int(self.size), self.bgr, -1,
+                       cv2.LINE_AA)
+        else:
+            x1, y1, x2, y2 = (int(round(v)) for v in self.get_rect(t))
+            cv2.rectangle(image, (x1, y1), (x2, y2), self.bgr, -1)
+
+class SceneGenerator:
+    """Renders frames of a scene with the true marker centers.
+
+    Frame index i shows the scene at time i / fps. All randomness is
+    seeded by the scene seed and the frame index, so any frame can be
+    rendered again on its own and is identical every time.
+
+    noise is the standard deviation of Gaussian sensor noise in gray
+    levels; motion_blur the fraction of the frame interval the shutter is
+    open, rendered with blur_samples sub-frame positions; lighting_drift
+    the relative amplitude of a slow brightness change over
+    lighting_period seconds.
+    """
+    def __init__(self, markers, width=config.WINDOW_WIDTH, height=config.WINDOW_HEIGHT,
+                 fps=config.REPLAY_FPS, seed=0, noise=0.0, motion_blur=0.0, blur_samples=5,
+                 lighting_drift=0.0, lighting_period=10.0, occluders=(), distractors=()):
+        self.markers = list(markers)
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.seed = seed
+        self.noise = noise
+        self.motion_blur = motion_blur
+        self.blur_samples = max(1, blur_samples)
+        self.lighting_drift = lighting_drift
+        self.lighting_period = lighting_period
+        self.occluders = list(occluders)
+        self.distractors = list(distractors)
+
+        self.background = self.make_background()
+
+        # Scratch buffers reused for every frame
+        self.layer = np.empty((height, width), dtype=np.float32)
+        self.coverage = np.empty((height, width), dtype=np.float32)
+
+    def make_background(self):
+        """Create a textured background: blurred noise over a soft gradient"""
+        rng = np.random.default_rng(self.seed)
+        texture = rng.integers(60, 200, (self.height // 8 + 1, self.width // 8 + 1, 3),
+                               dtype=np.uint8)
+        texture = cv2.resize(texture, (self.width, self.height), interpolation=cv2.INTER_CUBIC)
+        texture = cv2.GaussianBlur(texture, (0, 0), 3)
+
+        # Desaturate so the texture does not look like a marker itself
+        gray = cv2.cvtColor(texture, cv2.COLOR_BGR2GRAY)
+        background = cv2.addWeighted(texture, 0.3, cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR), 0.7, 0)
+
+        gradient = np.linspace(0.8, 1.1, self.width, dtype=np.float32)[None, :, None]
+        return np.clip(background * gradient, 0, 255).astype(np.uint8)
+
+    def get_time(self, index):
+        """Get the scene time of a frame"""
+        return index / self.fps
+
+    def get_truth(self, index):
+        """Get {color name: (x, y) or None} for a frame; None when hidden"""
+        t = self.get_time(index)
+        truth = {}
+        for marker in self.markers:
+            x, y = marker.path(t)
+            visible = (0 <= x < self.width and 0 <= y < self.height and
+                       not any(occluder.covers((x, y), t) for occluder in self.occluders))
+            truth[marker.color_name] = (float(x), float(y)) if visible else None
+        return truth
+
+    def draw_marker(self, frame, marker, t):
+        """Blend a marker into the frame, smeared over the shutter time"""
+        shutter = self.motion_blur / self.fps
+        samples = self.blur_samples if shutter > 0 else 1
+        centers = [marker.path(t - shutter * (1 - (k + 0.5) / samples) if shutter > 0 else t)
+                   for k in range(samples)]
+
+        # Only the area the marker sweeps over is touched
+        xs = [x for x, _ in centers]
+        ys = [y for _, y in centers]
+        margin = marker.radius + 2
+        x1 = max(0, int(min(xs) - margin))
+        y1 = max(0, int(min(ys) - margin))
+        x2 = min(self.width, int(max(xs) + margin) + 1)
+        y2 = min(self.height, int(max(ys) + margin) + 1)
+        if x2 <= x1 or y2 <= y1:
+            return
+
+        layer = self.layer[y1:y2, x1:x2]
+        coverage = self.coverage[y1:y2, x1:x2]
+        coverage.fill(0)
+        for x, y in centers:
+            layer.fill(0)
+            # Draw at 1/16 pixel precision so slow motion stays smooth
+            cv2.circle(layer, (int(round((x - x1) * 16)), int(round((y - y1) * 16))),
+                       marker.radius * 16, 1.0, -1, cv2.LINE_AA, 4)
+            coverage += layer
+        if samples > 1:
+            coverage /= samples
+
+        region = frame[y1:y2, x1:x2]
+        color = np.array(marker.bgr, dtype=np.float32)
+        region += coverage[..., None] * (color - region)
+
+    def render(self, index, out=None):
+        """Render a frame, returning it and its ground truth"""
+        t = self.get_time(index)
+        frame = self.background.astype(np.float32)
+
+        for distractor in self.distractors:
+            distractor.draw(frame, t)
+        for marker in self.markers:
+            self.draw_marker(frame, marker, t)
+        for occluder in self.occluders:
+            occluder.draw(frame, t)
+
+        if self.lighting_drift:
+            frame *= 1.0 + self.lighting_drift * np.sin(2 * np.pi * t / self.lighting_period)
+        if self.noise:
+            rng = np.random.default_rng((self.seed, index))
+            frame += rng.standard_normal(frame.shape, dtype=np.float32) * np.float32(self.noise)
+
+        if out is None:
+            out = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        np.clip(frame, 0, 255, out=frame)
+        out[:] = frame
+        return out, self.get_truth(index)
+
+    def render_frames(self, count):
+        """Render the first count frames, returning (frames, truths) lists"""
+        frames, truths = [], []
+        for index in range(count):
+            frame, truth = self.render(index)
+            frames.append(frame)
+            truths.append(truth)
+        return frames, truths
+
+    def write(self, directory, count):
+        """Write frames as numbered PNGs plus ground_truth.csv to a directory"""
+        os.makedirs(directory, exist_ok=True)
+        color_names = [marker.color_name for marker in self.markers]
+
+        with open(os.path.join(directory, 'ground_truth.csv'), 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['frame', 'time'] + [f"{name}_{axis}" for name in color_names
+                                                 for axis in ('x', 'y')])
+            frame = None
+            for index in range(count):
+                frame, truth = self.render(index, frame)
+                cv2.imwrite(os.path.join(directory, f"{index:06d}.png"), frame)
+
+                row = [index, f"{self.get_time(index):.6f}"]
+                for name in color_names:
+                    center = truth[name]
+                    row += ['', ''] if center is None else [f"{center[0]:.2f}", f"{center[1]:.2f}"]
+                writer.writerow(row)
+        return directory
+
+def load_truth(path):
+    """Read a ground_truth.csv written by SceneGenerator.write"""
+    truths = []
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        color_names = sorted({column[:-2] for column in reader.fieldnames
+                              if column.endswith(('_x', '_y'))})
+        for row in reader:
+            truths.append({name: (float(row[f"{name}_x"]), float(row[f"{name}_y"]))
+                           if row[f"{name}_x"] else None for name in color_names})
+    return truths
+
+def make_scene(color_names=('blue',), width=config.WINDOW_WIDTH, height=config.WINDOW_HEIGHT,
+               seed=0, difficulty=1.0, **kwargs):
+    """Create a standard scene: markers on Lissajous paths, plus hazards.
+
+    difficulty scales noise, blur, lighting drift and how many occluders
+    and distractors there are; 0 gives a clean scene.
+    """
+    rng = np.random.default_rng(seed)
+    center = (width / 2, height / 2)
+    markers = []
+    for i, color_name in enumerate(color_names):
+        path = lissajous_path(center, (width * 0.35, height * 0.3),
+                              frequency=(0.25 + 0.05 * i, 0.35 + 0.03 * i), phase=i + np.pi / 2)
+        markers.append(SceneMarker(color_name, path))
+
+    occluders = []
+    distractors = []
+    if difficulty > 0:
+        # A gray bar sweeping across now and then hides the markers
+        occluders.append(SceneObject(line_path((-width * 0.2, height / 2), (width * 1.2, height / 2),
+                                               period=8.0 / difficulty),
+                                     (60, height * 1.5), (90, 90, 90), shape='rectangle'))
+
+        # Small blobs in other preset colors, some below the detection area
+        others = [name for name in config.COLORS if name not in color_names]
+        for _ in range(int(round(3 * difficulty))):
+            bgr = marker_bgr(others[rng.integers(len(others))]) if others else (0, 0, 0)
+            start = (rng.uniform(0, width), rng.uniform(0, height))
+            end = (rng.uniform(0, width), rng.uniform(0, height))
+            distractors.append(SceneObject(line_path(start, end, rng.uniform(4, 10)),
+                                           rng.uniform(4, 15), bgr))
+
+    settings = dict(noise=4.0 * difficulty, motion_blur=0.5 * difficulty,
+                    lighting_drift=0.1 * difficulty, occluders=occluders, distractors=distractors)
+    settings.update(kwargs)
+    return SceneGenerator(markers, width, height, seed=seed, **settings)
+
+def measure_tracking(generator, count, color_name=None, detector=None):
+    """Run a ColorDetector over a scene and compare with the ground truth.
+
+    Returns detection rate, false positives, raw and filtered position
+    error in pixels, and detection latency in milliseconds.
+    """
+    from color_detection import ColorDetector
+
+    color_name = color_name or generator.markers[0].color_name
+    if detector is None:
+        detector = ColorDetector(headless=True)
+        detector.set_color_preset(color_name)
+    detector.latency_compensation = False
+
+    raw_errors, filtered_errors, latencies = [], [], []
+    visible = detected = false_positives = 0
+    frame = None
+    for index in range(count):
+        frame, truth = generator.render(index, frame)
+        expected = truth[color_name]
+
+        start = time.perf_counter()
+        _, _, center, _ = detector.detect(frame, generator.get_time(index))
+        smoothed = detector.get_smoothed_position()
+        latencies.append(time.perf_counter() - start)
+
+        if expected is None:
+            false_positives += center is not None
+            continue
+
+        visible += 1
+        if center is not None:
+            detected += 1
+            raw = detector.subpixel_center or center
+            raw_errors.append(np.hypot(raw[0] - expected[0], raw[1] - expected[1]))
+        if smoothed is not None:
+            filtered_errors.append(np.hypot(smoothed[0] - expected[0], smoothed[1] - expected[1]))
+
+    def stats(values):
+        if not values:
+            return {'mean': float('nan'), 'p95': float('nan'), 'max': float('nan')}
+        values = np.array(values)
+        return {'mean': float(values.mean()), 'p95': float(np.percentile(values, 95)),
+                'max': float(values.max())}
+
+    latency = stats([value * 1000.0 for value in latencies])
+    return {
+        'frames': count,
+        'visible': visible,
+        'detection_rate': detected / visible if visible else float('nan'),
+        'false_positives': false_positives,
+        'raw_error': stats(raw_errors),
+        'filtered_error': stats(filtered_errors),
+        'latency_ms': latency,
+    }
+
+def main():
+    """Write a synthetic scene to a directory, or measure tracking on it"""
+    parser = argparse.ArgumentParser(description="Synthetic Air Canvas scenes")
+    parser.add_argument("output", nargs='?', help="Directory to write frames and ground truth to")
+    parser.add_argument("--frames", type=int, default=300, help="Number of frames")
+    parser.add_argument("--markers", nargs='+', default=['blue'], choices=list(config.COLORS),
+                        help="Marker colors")
+    parser.add_argument("--difficulty", type=float, default=1.0,
+                        help="Scale of noise, blur, lighting drift and clutter (0 is clean)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument("--measure", action="store_true",
+                        help="Report detection accuracy and latency for the first marker")
+    args = parser.parse_args()
+
+    generator = make_scene(args.markers, seed=args.seed, difficulty=args.difficulty)
+
+    if args.output:
+        generator.write(args.output, args.frames)
+        print(f"Wrote {args.frames} frames and ground truth to {args.output}")
+
+    if args.measure or not args.output:
+        results = measure_tracking(generator, args.frames)
+        print(f"Detection rate: {results['detection_rate'] * 100:.1f}% of "
+              f"{results['visible']} visible frames, false positives: {results['false_positives']}")
+        for name in ('raw_error', 'filtered_error'):
+            stats = results[name]
+            print(f"{name:<15} mean {stats['mean']:6.2f}  p95 {stats['p95']:6.2f}  "
+                  f"max {stats['max']:6.2f} px")
+        stats = results['latency_ms']
+        print(f"{'latency':<15} mean {stats['mean']:6.2f}  p95 {stats['p95']:6.2f}  "
+              f"max {stats['max']:6.2f} ms")
+
+if __name__ == "__main__":
+    main()
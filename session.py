@@ -0,0 +1,244 @@
+"""
+session.py - Binary session recording and replay for the Air Canvas application
+
+A session is stored as the inputs that drive the canvas rather than as
+video: the smoothed pointer positions, key presses, brush size changes and
+the UI buttons they fired, each as a fixed-width timestamped record
+appended to a file. Replaying a session rebuilds the canvas through the
+same UI and tool code without running detection, much faster than real
+time.
+
+Usage:
+    python session.py saved_drawings/session_20250101_120000.acses --output replay.png
+    python session.py saved_drawings/session_20250101_120000.acses --timelapse replay.mp4
+"""
+
+import argparse
+import struct
+import time
+import numpy as np
+import config
+from canvas import Canvas
+from drawing_tools import ToolManager
+from ui import UserInterface
+from timelapse import Timelapse, TimelapseWriter
+from controls import handle_pointer, handle_key
+
+# Session file layout: header, one color byte per pointer, then records
+FILE_MAGIC = b'ACSES'
+FILE_VERSION = 1
+HEADER = struct.Struct('<5sBHHB')  # magic, version, width, height, pointer count
+RECORD = np.dtype([
+    ('time', '<f8'),  # Frame timestamp in seconds (monotonic clock)
+    ('event', 'u1'),
+    ('pointer', 'u1'),  # Index of the marker / tool manager
+    ('x', '<i4'),
+    ('y', '<i4'),
+    ('value', '<i4'),
+])
+
+# Event types
+EVENT_POINTER = 0  # Smoothed position routed to the UI or the tools
+EVENT_KEY = 1  # Key press, value is the key code
+EVENT_THICKNESS = 2  # Brush size trackbar, value is the thickness
+EVENT_UI_ACTION = 3  # Button fired, value is its UI layout index
+
+# Pointer color byte for a tool manager left at the default color
+DEFAULT_COLOR = 255
+
+COLOR_NAMES = list(config.COLORS)
+
+class SessionRecorder:
+    """Appends session events to a file.
+
+    Records are buffered and written in batches of flush_every, so a
+    crash loses at most the last batch and leaves a readable file.
+    """
+    def __init__(self, path, width=config.WINDOW_WIDTH, height=config.WINDOW_HEIGHT,
+                 pointer_colors=(None,), flush_every=config.SESSION_FLUSH_RECORDS):
+        self.path = path
+        self.flush_every = max(1, flush_every)
+        self.buffer = np.zeros(self.flush_every, dtype=RECORD)
+        self.count = 0
+        self.total = 0
+        self.last_time = 0.0
+
+        self.file = open(path, 'wb')
+        self.file.write(HEADER.pack(FILE_MAGIC, FILE_VERSION, width, height, len(pointer_colors)))
+        self.file.write(bytes(DEFAULT_COLOR if color is None else COLOR_NAMES.index(color)
+                              for color in pointer_colors))
+        self.file.flush()
+
+    def record(self, event, timestamp, pointer=0, x=0, y=0, value=0):
+        """Append one event"""
+        self.buffer[self.count] = (timestamp, event, pointer, x, y, value)
+        self.last_time = timestamp
+        self.count += 1
+        self.total += 1
+        if self.count == self.flush_every:
+            self.flush()
+
+    def pointer(self, index, position, timestamp):
+        """Record a smoothed pointer position"""
+        self.record(EVENT_POINTER, timestamp, index, position[0], position[1])
+
+    def key(self, key, timestamp):
+        """Record a key press"""
+        self.record(EVENT_KEY, timestamp, value=key)
+
+    def thickness(self, thickness, timestamp):
+        """Record a brush size change"""
+        self.record(EVENT_THICKNESS, timestamp, value=thickness)
+
+    def ui_action(self, index, button, timestamp=None):
+        """Record a UI button firing for pointer index, by default at the last event's time"""
+        if timestamp is None:
+            timestamp = self.last_time
+        self.record(EVENT_UI_ACTION, timestamp, index, value=button)
+
+    def flush(self):
+        """Write buffered records to the file"""
+        if self.count:
+            self.file.write(self.buffer[:self.count].tobytes())
+            self.file.flush()
+            self.count = 0
+
+    def close(self):
+        """Write the remaining records and close the file"""
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+            self.file = None
+        return self.path
+
+class Session:
+    """A recorded session loaded into memory"""
+    def __init__(self, width, height, pointer_colors, records):
+        self.width = width
+        self.height = height
+        self.pointer_colors = pointer_colors
+        self.records = records
+
+    @classmethod
+    def load(cls, path):
+        """Load a session file, ignoring a partly written last record"""
+        with open(path, 'rb') as f:
+            data = f.read()
+
+        magic, version, width, height, pointers = HEADER.unpack_from(data, 0)
+        if magic != FILE_MAGIC or version != FILE_VERSION:
+            raise ValueError("Not an Air Canvas session")
+
+        offset = HEADER.size
+        pointer_colors = [None if color == DEFAULT_COLOR else COLOR_NAMES[color]
+                          for color in data[offset:offset + pointers]]
+        offset += pointers
+
+        count = (len(data) - offset) // RECORD.itemsize
+        records = np.frombuffer(data, dtype=RECORD, count=count, offset=offset)
+        return cls(width, height, pointer_colors, records)
+
+    def get_duration(self):
+        """Get the time between the first and last record in seconds"""
+        if len(self.records) == 0:
+            return 0.0
+        return float(self.records['time'][-1] - self.records['time'][0])
+
+class _DiscardWriter:
+    """Image writer for replays: saves are counted, never written"""
+    def __init__(self):
+        self.saves = 0
+
+    def submit(self, image, prefix="drawing", image_format=None, on_complete=None):
+        self.saves += 1
+        return None
+
+def replay_session(session, canvas=None, timelapse=None):
+    """Rebuild a session's canvas by feeding its events through the UI and tools.
+
+    When given, timelapse is sampled at each record's timestamp. Returns
+    the canvas and replay statistics, including how many UI actions fired
+    differently from the recording.
+    """
+    canvas = canvas or Canvas(_DiscardWriter())
+    ui = UserInterface(session.width, session.height)
+
+    managers = []
+    for color_name in session.pointer_colors:
+        manager = ToolManager(canvas)
+        if color_name is not None:
+            manager.set_color(color_name)
+        managers.append(manager)
+    manager_index = {id(manager): i for i, manager in enumerate(managers)}
+
+    fired = []
+    ui.on_action = lambda manager, button: fired.append((manager_index[id(manager)], button))
+
+    recorded = []
+    for timestamp, event, pointer, x, y, value in session.records.tolist():
+        if event == EVENT_POINTER:
+            handle_pointer((x, y), ui, managers[pointer], canvas, timestamp)
+        elif event == EVENT_KEY:
+            # Image saves go to the discarding writer; documents are skipped
+            if value != ord('d'):
+                handle_key(value, canvas, managers[0])
+        elif event == EVENT_THICKNESS:
+            for manager in managers:
+                manager.set_thickness(value)
+        elif event == EVENT_UI_ACTION:
+            recorded.append((pointer, value))
+        if timelapse is not None:
+            timelapse.sample(canvas, timestamp)
+
+    mismatches = sum(a != b for a, b in zip(fired, recorded)) + abs(len(fired) - len(recorded))
+    stats = {
+        'records': len(session.records),
+        'duration': session.get_duration(),
+        'ui_actions': len(fired),
+        'ui_mismatches': mismatches,
+    }
+    return canvas, stats
+
+def main():
+    """Replay a recorded session and write the resulting canvas"""
+    parser = argparse.ArgumentParser(description="Replay a recorded Air Canvas session")
+    parser.add_argument("session", help="Session file (.acses)")
+    parser.add_argument("--output", default="session_canvas.png",
+                        help="Where to write the final canvas")
+    parser.add_argument("--timelapse", default=None,
+                        help="Also export a time-lapse video of the session to this path")
+    parser.add_argument("--interval", type=float, default=config.TIMELAPSE_INTERVAL,
+                        help="Seconds of session between time-lapse frames; "
+                             "0 takes one per finished operation")
+    args = parser.parse_args()
+
+    import cv2
+
+    start = time.perf_counter()
+    session = Session.load(args.session)
+    canvas = Canvas(_DiscardWriter())
+    timelapse = None
+    if args.timelapse:
+        # Exporting waits for the encoder rather than dropping frames
+        writer = TimelapseWriter(args.timelapse, (canvas.width, canvas.height), camera=False,
+                                 block=True)
+        timelapse = Timelapse(writer, interval=args.interval or None)
+    canvas, stats = replay_session(session, canvas, timelapse)
+    if timelapse is not None:
+        timelapse.close()
+    elapsed = time.perf_counter() - start
+
+    speedup = stats['duration'] / elapsed if elapsed > 0 else float('inf')
+    print(f"Replayed {stats['records']} records ({stats['duration']:.1f}s of session) "
+          f"in {elapsed:.3f}s, {speedup:.0f}x real time")
+    if stats['ui_mismatches']:
+        print(f"Warning: {stats['ui_mismatches']} UI action(s) differ from the recording")
+
+    cv2.imwrite(args.output, canvas.canvas)
+    print(f"Final canvas written to {args.output}")
+    if timelapse is not None:
+        timelapse_stats = timelapse.get_stats()
+        print(f"Time-lapse of {timelapse_stats['written']} frame(s) written to {args.timelapse}")
+
+if __name__ == "__main__":
+    main()
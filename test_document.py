@@ -0,0 +1,96 @@
+"""
+test_document.py - Checks that a document re-rasterizes to what the canvas shows
+
+Run with: python -m pytest -q test_document.py
+"""
+
+import numpy as np
+from canvas import Canvas
+from document import Document
+from drawing_tools import ToolManager
+
+def make_canvas():
+    """A canvas whose board is just the viewport, so rasterizing stays small"""
+    canvas = Canvas(board_width=0, board_height=0)
+    return canvas, ToolManager(canvas)
+
+def stroke(manager, points):
+    """Draw a brush or eraser stroke through points and lift the pen"""
+    for point in points:
+        manager.handle_drawing(point)
+    manager.handle_drawing(None)
+    manager.canvas.save_state()
+
+def shape(manager, tool_name, start, end):
+    """Place a shape from start to end"""
+    manager.set_tool(tool_name)
+    manager.handle_drawing(start)
+    manager.handle_drawing(end)
+
+def assert_matches_view(canvas):
+    """Rasterize the document, also after a save/load round trip, and compare with the view"""
+    view = canvas.get_view()
+    for document in (canvas.document, Document.from_bytes(canvas.document.to_bytes())):
+        image = document.rasterize()
+        height, width = view.shape[:2]
+        differing = np.count_nonzero((image[:height, :width] != view).any(axis=2))
+        assert differing == 0, f"{differing} pixels differ from the canvas view"
+
+def test_stroke_over_shape_stays_below_it():
+    canvas, manager = make_canvas()
+    manager.set_color('red')
+    shape(manager, 'rectangle', (60, 60), (300, 260))
+    manager.set_color('blue')
+    manager.set_tool('brush')
+    stroke(manager, [(20, 200), (200, 200), (400, 200)])
+
+    # The rectangle's layer is above the strokes layer
+    assert tuple(canvas.get_view()[200, 60]) == (0, 0, 255)
+    assert_matches_view(canvas)
+
+def test_text_and_shapes_over_strokes():
+    canvas, manager = make_canvas()
+    manager.set_color('green')
+    manager.set_tool('text')
+    manager.handle_drawing((100, 150))
+    for char in "Layers":
+        manager.handle_key(ord(char))
+    manager.handle_key(13)
+
+    manager.set_color('purple')
+    shape(manager, 'circle', (200, 130), (260, 130))
+    shape(manager, 'line', (50, 100), (500, 160))
+
+    manager.set_color('orange')
+    manager.set_tool('brush')
+    stroke(manager, [(80, 120), (300, 140), (520, 120)])
+    assert_matches_view(canvas)
+
+def test_shape_that_draws_nothing_is_not_kept():
+    canvas, manager = make_canvas()
+    shape(manager, 'rectangle', (60, 60), (300, 260))
+
+    # A zero-radius circle leaves the board unchanged and is not a saved state
+    shape(manager, 'circle', (100, 100), (100, 100))
+    assert len(canvas.document.operations) == 1
+    assert len(canvas.document.checkpoints) == len(canvas.history.undo_stack) + 1
+
+    assert canvas.undo()
+    assert canvas.document.operations == []
+    assert_matches_view(canvas)
+
+def test_eraser_uncovers_background():
+    canvas, manager = make_canvas()
+    manager.set_tool('brush')
+    stroke(manager, [(0, 50), (600, 400)])
+    background = np.random.default_rng(0).integers(0, 256, (300, 400, 3), dtype=np.uint8)
+    canvas.set_background(background, (100, 80))
+    manager.set_color('red')
+    shape(manager, 'rectangle', (150, 100), (450, 350))
+
+    manager.set_tool('eraser')
+    stroke(manager, [(200, 150), (260, 200), (320, 260)])
+    assert_matches_view(canvas)
+
+    manager.clear_all()
+    assert_matches_view(canvas)
@@ -0,0 +1,349 @@
+"""
+tiles.py - Sparse tiled pixel storage for the Air Canvas board
+"""
+
+import os
+import tempfile
+from collections import OrderedDict
+import numpy as np
+import config
+
+class TiledSurface:
+    """A large image stored as square tiles allocated on first write.
+
+    Tiles never written to are implicitly filled with fill (white for a
+    BGR image, transparent for a BGRA layer) and take no memory. The
+    least recently used tiles beyond resident_limit are paged out to a
+    memory-mapped file and paged back in when touched, so memory in use
+    scales with the area being worked on rather than the board size.
+
+    Writes are tracked per tile: the first write to a tile since the last
+    commit() keeps a copy of it, so commit() can hand the changed regions
+    before and after to the undo history and revert() can undo them.
+    Beyond resident_limit, the oldest of these copies are paged out too,
+    so a long run of changes without a commit stays within the limit.
+    """
+    def __init__(self, width, height, channels=3, fill=255, tile_size=config.TILE_SIZE,
+                 resident_limit=config.TILE_RESIDENT_LIMIT, page_path=config.TILE_PAGE_FILE):
+        self.width = width
+        self.height = height
+        self.channels = channels
+        self.fill = fill
+        self.tile_size = tile_size
+        self.resident_limit = max(1, resident_limit)
+
+        # Tiles in memory, least recently used first, and paged-out tiles
+        self.tiles = OrderedDict()
+        self.paged = {}
+
+        # Page file, created on the first page-out
+        self.page_path = page_path
+        self.page_file_is_temp = False
+        self.pages = None
+        self.free_slots = []
+
+        # Changes since the last commit: key -> [original, changed rect in
+        # the tile], where the original is None for a blank tile, the tile
+        # as it was, or the page slot it was paged out to
+        self.changes = {}
+
+        # Keys of changes whose original is in memory, oldest first
+        self.resident_originals = OrderedDict()
+
+        self.page_outs = 0
+        self.page_ins = 0
+
+    def get_overlaps(self, rect):
+        """Yield (key, rect in the tile, rect in the region) for each tile under a rect"""
+        size = self.tile_size
+        x1, y1, x2, y2 = rect
+        for ty in range(y1 // size, (y2 - 1) // size + 1):
+            for tx in range(x1 // size, (x2 - 1) // size + 1):
+                ox, oy = tx * size, ty * size
+                ix1, iy1 = max(x1, ox), max(y1, oy)
+                ix2, iy2 = min(x2, ox + size), min(y2, oy + size)
+                yield ((tx, ty), (ix1 - ox, iy1 - oy, ix2 - ox, iy2 - oy),
+                       (ix1 - x1, iy1 - y1, ix2 - x1, iy2 - y1))
+
+    def is_blank(self, pixels):
+        """Check whether pixels are all the fill value"""
+        if self.fill == 0:
+            return pixels.max() == 0
+        if self.fill == 255:
+            return pixels.min() == 255
+        return bool((pixels == self.fill).all())
+
+    def has_tiles(self, rect):
+        """Check whether any tile under a rect was written"""
+        return any(key in self.tiles or key in self.paged
+                   for key, _, _ in self.get_overlaps(rect))
+
+    def get_tile(self, key):
+        """Get a tile, paging it in if needed, or None if it was never written"""
+        tile = self.tiles.get(key)
+        if tile is not None:
+            self.tiles.move_to_end(key)
+            return tile
+
+        slot = self.paged.pop(key, None)
+        if slot is None:
+            return None
+
+        tile = self.page_in(slot)
+        self.tiles[key] = tile
+        self.evict()
+        return tile
+
+    def allocate(self, key):
+        """Create a blank tile"""
+        tile = np.full((self.tile_size, self.tile_size, self.channels), self.fill, dtype=np.uint8)
+        self.tiles[key] = tile
+        self.evict()
+        return tile
+
+    def drop(self, key):
+        """Forget a tile, making it blank again"""
+        self.tiles.pop(key, None)
+        slot = self.paged.pop(key, None)
+        if slot is not None:
+            self.free_slots.append(slot)
+
+    def evict(self):
+        """Page out the least recently used tiles beyond the resident limit"""
+        while len(self.tiles) > self.resident_limit:
+            key, tile = self.tiles.popitem(last=False)
+            self.paged[key] = self.page_out(tile)
+
+    def evict_originals(self):
+        """Page out the oldest tracked originals beyond the resident limit"""
+        while len(self.resident_originals) > self.resident_limit:
+            key, _ = self.resident_originals.popitem(last=False)
+            change = self.changes[key]
+            change[0] = self.page_out(change[0])
+
+    def page_out(self, tile):
+        """Write a tile to a free page slot, returning the slot"""
+        if not self.free_slots:
+            self.grow_pages()
+        slot = self.free_slots.pop()
+        self.pages[slot] = tile
+        self.page_outs += 1
+        return slot
+
+    def page_in(self, slot):
+        """Read a tile back from a page slot, freeing the slot"""
+        tile = np.array(self.pages[slot])
+        self.free_slots.append(slot)
+        self.page_ins += 1
+        return tile
+
+    def get_original(self, original):
+        """Get the pixels of a tracked original, reading paged ones in place"""
+        if original is None or isinstance(original, np.ndarray):
+            return original
+        return self.pages[original]
+
+    def grow_pages(self):
+        """Create or enlarge the page file, doubling its slot count"""
+        size = self.tile_size
+        if self.pages is None:
+            if self.page_path is None:
+                fd, self.page_path = tempfile.mkstemp(prefix="aircanvas_", suffix=".tiles")
+                os.close(fd)
+                self.page_file_is_temp = True
+            capacity = max(16, self.resident_limit // 4)
+            mode = 'w+'
+        else:
+            capacity = 2 * len(self.pages)
+            self.pages.flush()
+            mode = 'r+'
+
+        old_capacity = 0 if self.pages is None else len(self.pages)
+        self.pages = np.memmap(self.page_path, dtype=np.uint8, mode=mode,
+                               shape=(capacity, size, size, self.channels))
+        self.free_slots.extend(range(capacity - 1, old_capacity - 1, -1))
+
+    def read_region(self, rect, out=None, original=False):
+        """Copy a board region into out (a new array by default).
+
+        With original set, tiles changed since the last commit are read as
+        they were before the changes.
+        """
+        x1, y1, x2, y2 = rect
+        if out is None:
+            out = np.empty((y2 - y1, x2 - x1, self.channels), dtype=np.uint8)
+        out.fill(self.fill)
+
+        for key, (tx1, ty1, tx2, ty2), (rx1, ry1, rx2, ry2) in self.get_overlaps(rect):
+            change = self.changes.get(key) if original else None
+            tile = self.get_original(change[0]) if change is not None else self.get_tile(key)
+            if tile is not None:
+                out[ry1:ry2, rx1:rx2] = tile[ty1:ty2, tx1:tx2]
+        return out
+
+    def write_region(self, rect, pixels, track=True):
+        """Copy pixels (None for blank) into a board region.
+
+        Tiles are only allocated where non-blank pixels land. Untracked
+        writes, such as undo restoring a region, are not committed.
+        """
+        for key, (tx1, ty1, tx2, ty2), (rx1, ry1, rx2, ry2) in self.get_overlaps(rect):
+            part = None if pixels is None else pixels[ry1:ry2, rx1:rx2]
+            tile = self.get_tile(key)
+            if tile is None:
+                if part is None or self.is_blank(part):
+                    continue
+                if track:
+                    self.track(key, None, (tx1, ty1, tx2, ty2))
+                tile = self.allocate(key)
+            elif track:
+                self.track(key, tile, (tx1, ty1, tx2, ty2))
+
+            if part is None:
+                tile[ty1:ty2, tx1:tx2] = self.fill
+            else:
+                tile[ty1:ty2, tx1:tx2] = part
+
+    def draw(self, rect, draw, track=True):
+        """Apply draw(image, origin) to a board region in place.
+
+        A region inside one allocated tile is drawn on a view of the tile;
+        anything else is assembled from its tiles, drawn and written back.
+        """
+        x1, y1, x2, y2 = rect
+        size = self.tile_size
+        key = (x1 // size, y1 // size)
+        if key == ((x2 - 1) // size, (y2 - 1) // size):
+            tile = self.get_tile(key)
+            if tile is not None:
+                ox, oy = key[0] * size, key[1] * size
+                if track:
+                    self.track(key, tile, (x1 - ox, y1 - oy, x2 - ox, y2 - oy))
+                draw(tile[y1 - oy:y2 - oy, x1 - ox:x2 - ox], (x1, y1))
+                return
+
+        pixels = self.read_region(rect)
+        draw(pixels, (x1, y1))
+        self.write_region(rect, pixels, track)
+
+    def track(self, key, tile, rect):
+        """Remember a tile's contents before its first change and grow its changed rect"""
+        change = self.changes.get(key)
+        if change is None:
+            self.changes[key] = [None if tile is None else tile.copy(), rect]
+            if tile is not None:
+                self.resident_originals[key] = None
+                self.evict_originals()
+            return
+
+        x1, y1, x2, y2 = change[1]
+        change[1] = (min(x1, rect[0]), min(y1, rect[1]), max(x2, rect[2]), max(y2, rect[3]))
+
+    def clear(self, track=True):
+        """Make the whole surface blank, returning the board rects cleared"""
+        size = self.tile_size
+        rects = self.get_tile_rects()
+        for key in list(self.tiles) + list(self.paged):
+            if track:
+                self.track(key, self.get_tile(key), (0, 0, size, size))
+            self.drop(key)
+        return rects
+
+    def commit(self):
+        """Accept the changes since the last commit.
+
+        Returns a (rect, before, after) board region per changed tile,
+        with None standing for blank. Tiles left entirely blank are freed.
+        """
+        size = self.tile_size
+        regions = []
+        for key, (original, (x1, y1, x2, y2)) in self.changes.items():
+            tile = self.get_tile(key)
+            if tile is not None and self.is_blank(tile):
+                self.drop(key)
+                tile = None
+            if original is None and tile is None:
+                continue
+
+            before = self.get_original(original)
+            if before is not None:
+                before = before[y1:y2, x1:x2]
+                if not isinstance(original, np.ndarray):
+                    before = np.array(before)
+                    self.free_slots.append(original)
+
+            ox, oy = key[0] * size, key[1] * size
+            regions.append(((ox + x1, oy + y1, ox + x2, oy + y2), before,
+                            None if tile is None else tile[y1:y2, x1:x2]))
+        self.changes = {}
+        self.resident_originals = OrderedDict()
+        return regions
+
+    def revert(self):
+        """Undo the changes since the last commit, returning the board rects restored"""
+        size = self.tile_size
+        rects = []
+        for key, (original, (x1, y1, x2, y2)) in self.changes.items():
+            self.drop(key)
+            if original is not None:
+                if not isinstance(original, np.ndarray):
+                    original = self.page_in(original)
+                self.tiles[key] = original
+            ox, oy = key[0] * size, key[1] * size
+            rects.append((ox + x1, oy + y1, ox + x2, oy + y2))
+        self.changes = {}
+        self.resident_originals = OrderedDict()
+        self.evict()
+        return rects
+
+    def get_tile_rects(self):
+        """Get the board rect of every allocated tile"""
+        size = self.tile_size
+        return [(tx * size, ty * size, (tx + 1) * size, (ty + 1) * size)
+                for tx, ty in list(self.tiles) + list(self.paged)]
+
+    def get_content_rect(self):
+        """Get the bounding rect of all non-blank pixels, or None"""
+        size = self.tile_size
+        tiles = list(self.tiles.items()) + [(key, self.pages[slot])
+                                            for key, slot in self.paged.items()]
+        rect = None
+        for (tx, ty), tile in tiles:
+            drawn = (tile != self.fill).any(axis=2)
+            rows = np.flatnonzero(drawn.any(axis=1))
+            if len(rows) == 0:
+                continue
+            cols = np.flatnonzero(drawn.any(axis=0))
+            ox, oy = tx * size, ty * size
+            tile_rect = (ox + cols[0], oy + rows[0], ox + cols[-1] + 1, oy + rows[-1] + 1)
+            if rect is None:
+                rect = tile_rect
+            else:
+                rect = (min(rect[0], tile_rect[0]), min(rect[1], tile_rect[1]),
+                        max(rect[2], tile_rect[2]), max(rect[3], tile_rect[3]))
+        return rect
+
+    def get_stats(self):
+        """Get tile counts and the memory they use"""
+        tile_bytes = self.tile_size * self.tile_size * self.channels
+        return {
+            'resident_tiles': len(self.tiles),
+            'paged_tiles': len(self.paged),
+            'resident_originals': len(self.resident_originals),
+            'resident_bytes': (len(self.tiles) + len(self.resident_originals)) * tile_bytes,
+            'page_file_bytes': 0 if self.pages is None else self.pages.nbytes,
+            'page_outs': self.page_outs,
+            'page_ins': self.page_ins,
+        }
+
+    def close(self):
+        """Release the page file, deleting it if it was temporary"""
+        if self.pages is not None:
+            self.pages.flush()
+            self.pages = None
+        if self.page_file_is_temp and self.page_path is not None:
+            os.remove(self.page_path)
+            self.page_path = None
+            self.page_file_is_temp = False
+        self.paged = {}
+        self.free_slots = []
@@ -0,0 +1,159 @@
+"""
+timelapse.py - Time-lapse video export for the Air Canvas application
+"""
+
+import queue
+import threading
+import cv2
+import numpy as np
+import config
+
+class TimelapseWriter:
+    """Encodes time-lapse frames into a video file on a background thread.
+
+    submit() copies the canvas image, and the camera image when it is shown
+    beside it, into a bounded queue and returns; the writer thread lays
+    them out side by side and feeds cv2.VideoWriter. At most max_pending
+    frames are held at any time, so memory stays flat however long the
+    recording. A full queue drops the frame rather than stall the caller,
+    unless block is set, as when exporting a replayed session.
+    """
+    def __init__(self, path, size, fps=config.TIMELAPSE_FPS, codec=config.TIMELAPSE_CODEC,
+                 camera=config.TIMELAPSE_CAMERA, max_pending=config.TIMELAPSE_MAX_PENDING,
+                 block=False):
+        self.path = path
+        self.width, self.height = size
+        self.camera = camera
+        self.block = block
+
+        frame_width = self.width * 2 if camera else self.width
+        self.video = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*codec), fps,
+                                     (frame_width, self.height))
+        if not self.video.isOpened():
+            raise IOError(f"Cannot open {path} for writing with codec {codec}")
+
+        # Output frame, only touched by the writer thread
+        self.frame = np.zeros((self.height, frame_width, 3), dtype=np.uint8)
+
+        self.queue = queue.Queue(maxsize=max(1, max_pending))
+        self.lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.closed = False
+
+        self.thread = threading.Thread(target=self._write_loop, name="timelapse-writer",
+                                       daemon=True)
+        self.thread.start()
+
+    def submit(self, canvas_image, camera_image=None):
+        """Queue a snapshot of one frame, returning False if it was dropped"""
+        if self.closed:
+            return False
+
+        # Checked before copying; only the writer thread makes room meanwhile
+        if not self.block and self.queue.full():
+            with self.lock:
+                self.dropped += 1
+            return False
+
+        camera_image = camera_image.copy() if self.camera and camera_image is not None else None
+        try:
+            self.queue.put((canvas_image.copy(), camera_image), block=self.block)
+        except queue.Full:
+            with self.lock:
+                self.dropped += 1
+            return False
+        return True
+
+    def place(self, image, x):
+        """Copy an image into the output frame at column x, resizing it if needed"""
+        target = self.frame[:, x:x + self.width]
+        if image.shape[:2] == target.shape[:2]:
+            np.copyto(target, image)
+        else:
+            target[:] = cv2.resize(image, (self.width, self.height),
+                                   interpolation=cv2.INTER_AREA)
+
+    def _write_loop(self):
+        """Lay out and encode queued frames until close() sends None"""
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            canvas_image, camera_image = item
+            self.place(canvas_image, 0)
+            if camera_image is not None:
+                self.place(camera_image, self.width)
+            self.video.write(self.frame)
+            with self.lock:
+                self.written += 1
+
+    def get_stats(self):
+        """Get counts of written and dropped frames and the current queue depth"""
+        with self.lock:
+            return {
+                'written': self.written,
+                'dropped': self.dropped,
+                'pending': self.queue.qsize(),
+            }
+
+    def close(self):
+        """Encode the queued frames and finish the file, returning its path"""
+        if not self.closed:
+            self.closed = True
+            self.queue.put(None)
+            self.thread.join()
+            self.video.release()
+        return self.path
+
+class Timelapse:
+    """Decides when the canvas is sampled into a TimelapseWriter.
+
+    With an interval, a frame is due every interval seconds of frame
+    timestamps; without one, whenever an operation is finished (a stroke
+    ends, a shape or text is placed) or the history is saved, undone or
+    redone. A due frame is only taken if the canvas version moved
+    since the last one, so idle stretches add nothing to the video.
+    """
+    def __init__(self, writer, interval=config.TIMELAPSE_INTERVAL):
+        self.writer = writer
+        self.interval = interval
+        self.last_time = None
+        self.last_operation = (0, 0)
+        self.last_version = None
+        self.samples = 0
+        self.duplicates = 0
+
+    def sample(self, canvas, timestamp, camera_image=None):
+        """Submit the canvas view if a frame is due, returning True if one was"""
+        if self.interval is None:
+            operation = (canvas.commits, canvas.document.get_finished_count())
+            if operation == self.last_operation:
+                return False
+            self.last_operation = operation
+        else:
+            if self.last_time is not None and timestamp - self.last_time < self.interval:
+                return False
+            self.last_time = timestamp
+
+        if canvas.version == self.last_version:
+            self.duplicates += 1
+            return False
+
+        if not self.writer.submit(canvas.canvas, camera_image):
+            return False
+        self.last_version = canvas.version
+        self.samples += 1
+        return True
+
+    def get_stats(self):
+        """Get sample counts together with the writer's"""
+        stats = self.writer.get_stats()
+        stats['samples'] = self.samples
+        stats['duplicates'] = self.duplicates
+        return stats
+
+    def close(self):
+        """Finish the video, returning its path"""
+        return self.writer.close()
@@ -2,10 +2,12 @@
 ui.py - User interface components and handling
 """
 
+import time
 import cv2
 import numpy as np
 import config
-from utils import create_button, draw_text_with_background, inside_rectangle
+from gestures import DwellActivator
+from utils import create_button, draw_text_with_background
 
 class UserInterface:
     def __init__(self, width, height):
@@ -28,98 +30,94 @@ class UserInterface:
         self.selected_tool = config.DEFAULT_TOOL
         self.selected_color = config.DEFAULT_COLOR
         self.brush_thickness = config.DEFAULT_BRUSH_THICKNESS
-    
-    def create_ui(self, tool_manager):
-        """Create the UI panel with all buttons"""
-        # Start with clean panel
-        ui = self.ui_panel.copy()
         
-        # Initialize position for buttons
+        # The layout never changes, so button positions and the hit-test
+        # table are computed once
+        self.build_layout()
+        
+        # Cached renders: buttons only, and buttons plus status text
+        self.button_panel = np.empty_like(self.ui_panel)
+        self.button_key = None
+        self.panel = np.empty_like(self.ui_panel)
+        self.panel_key = None
+        
+        # Last output buffer written and the panel it received
+        self.last_out = None
+        self.last_out_key = None
+        
+        # Dwell state of each tool manager's pointer, so hovering over a
+        # button fires it once instead of on every frame
+        self.activators = {}
+        
+        # Called with (tool_manager, layout index) whenever a button fires
+        self.on_action = None
+    
+    def build_layout(self):
+        """Compute button positions and the x-coordinate hit-test table"""
         x_start = self.button_spacing
-        y_center = self.height // 2
-        
-        # Clear button
-        clear_btn = create_button(
-            ui,
-            (x_start, y_center - self.button_height // 2),
-            (self.button_width, self.button_height),
-            "CLEAR",
-            color=(200, 200, 200),
-            text_color=(0, 0, 0)
-        )
-        self.buttons['clear'] = clear_btn
-        x_start += self.button_width + self.button_spacing
-        
-        # Undo button
-        undo_btn = create_button(
-            ui,
-            (x_start, y_center - self.button_height // 2),
-            (self.button_width, self.button_height),
-            "UNDO",
-            color=(200, 200, 200),
-            text_color=(0, 0, 0)
-        )
-        self.buttons['undo'] = undo_btn
-        x_start += self.button_width + self.button_spacing
-        
-        # Save button
-        save_btn = create_button(
-            ui,
-            (x_start, y_center - self.button_height // 2),
-            (self.button_width, self.button_height),
-            "SAVE",
-            color=(200, 200, 200),
-            text_color=(0, 0, 0)
-        )
-        self.buttons['save'] = save_btn
-        x_start += self.button_width + self.button_spacing
-        
-        # Add a separator
-        cv2.line(ui, (x_start, 10), (x_start, self.height - 10), (150, 150, 150), 1)
-        x_start += self.button_spacing
-        
-        # Tool buttons
-        self.buttons['tools'] = {}
-        for tool_name in config.TOOLS:
-            is_selected = tool_name == self.selected_tool
-            
-            # Create tool button
-            tool_btn = create_button(
-                ui,
-                (x_start, y_center - self.button_height // 2),
-                (self.button_width, self.button_height),
-                config.TOOLS[tool_name]['text'],
-                color=(180, 180, 180) if is_selected else (220, 220, 220),
-                text_color=(0, 0, 0),
-                selected=is_selected
-            )
-            self.buttons['tools'][tool_name] = tool_btn
-            x_start += self.button_width + self.button_spacing
-        
-        # Add a separator
-        cv2.line(ui, (x_start, 10), (x_start, self.height - 10), (150, 150, 150), 1)
-        x_start += self.button_spacing
-        
-        # Color buttons
-        self.buttons['colors'] = {}
-        for color_name in config.COLORS:
-            is_selected = color_name == self.selected_color
-            color_bgr = config.COLORS[color_name]['bgr']
-            text_color = config.COLORS[color_name]['text_color']
+        y_top = self.height // 2 - self.button_height // 2
+        
+        # Buttons in order: (group, name, label)
+        groups = [
+            [('clear', None, "CLEAR"), ('undo', None, "UNDO"), ('save', None, "SAVE")],
+            [('tools', tool_name, config.TOOLS[tool_name]['text']) for tool_name in config.TOOLS],
+            [('colors', color_name, color_name.upper()) for color_name in config.COLORS],
+        ]
+        
+        self.layout = []
+        self.layout_index = {}
+        self.separators = []
+        self.buttons = {'tools': {}, 'colors': {}}
+        for i, group in enumerate(groups):
+            if i > 0:
+                # Add a separator
+                self.separators.append(x_start)
+                x_start += self.button_spacing
             
-            # Create color button
-            color_btn = create_button(
-                ui,
-                (x_start, y_center - self.button_height // 2),
-                (self.button_width, self.button_height),
-                color_name.upper(),
-                color=color_bgr,
-                text_color=text_color,
-                selected=is_selected
-            )
-            self.buttons['colors'][color_name] = color_btn
-            x_start += self.button_width + self.button_spacing
-        
+            for group_name, name, label in group:
+                rect = (x_start, y_top, x_start + self.button_width, y_top + self.button_height)
+                self.layout_index[(group_name, name)] = len(self.layout)
+                self.layout.append((group_name, name, label, rect))
+                if name is None:
+                    self.buttons[group_name] = rect
+                else:
+                    self.buttons[group_name][name] = rect
+                x_start += self.button_width + self.button_spacing
+        
+        # hit_table[x] is the index into layout of the button covering
+        # column x, or -1; all buttons share the same vertical extent
+        self.hit_table = np.full(self.width, -1, dtype=np.int16)
+        for index, (_, _, _, (x1, _, x2, _)) in enumerate(self.layout):
+            self.hit_table[max(0, x1):min(self.width, x2 + 1)] = index
+        self.hit_top = y_top
+        self.hit_bottom = y_top + self.button_height
+    
+    def render_buttons(self, ui):
+        """Draw all buttons and separators onto a clean panel"""
+        np.copyto(ui, self.ui_panel)
+        
+        for x in self.separators:
+            cv2.line(ui, (x, 10), (x, self.height - 10), (150, 150, 150), 1)
+        
+        for group_name, name, label, (x1, y1, x2, y2) in self.layout:
+            position = (x1, y1)
+            size = (x2 - x1, y2 - y1)
+            if group_name == 'tools':
+                is_selected = name == self.selected_tool
+                create_button(ui, position, size, label,
+                              color=(180, 180, 180) if is_selected else (220, 220, 220),
+                              text_color=(0, 0, 0), selected=is_selected)
+            elif group_name == 'colors':
+                create_button(ui, position, size, label,
+                              color=config.COLORS[name]['bgr'],
+                              text_color=config.COLORS[name]['text_color'],
+                              selected=name == self.selected_color)
+            else:
+                create_button(ui, position, size, label,
+                              color=(200, 200, 200), text_color=(0, 0, 0))
+    
+    def draw_status(self, ui, tool_manager):
+        """Draw the current settings and any text being typed"""
         # Show current settings at the right end
         size_text = f"Size: {tool_manager.current_thickness}"
         tool_text = f"Tool: {tool_manager.current_tool_name}"
@@ -142,50 +140,115 @@ class UserInterface:
                 (10, self.height - 10),
                 bg_color=(240, 240, 240)
             )
+    
+    def create_ui(self, tool_manager, out=None):
+        """Create the UI panel with all buttons, drawing into out if given.
+        
+        The panel is cached and only redrawn when the selections or the
+        tool manager's state version change.
+        """
+        button_key = (self.selected_tool, self.selected_color)
+        if button_key != self.button_key:
+            self.render_buttons(self.button_panel)
+            self.button_key = button_key
+            self.panel_key = None
+        
+        panel_key = (button_key, id(tool_manager), tool_manager.version)
+        if panel_key != self.panel_key:
+            # Buttons are unchanged, only the status text is redrawn
+            np.copyto(self.panel, self.button_panel)
+            self.draw_status(self.panel, tool_manager)
+            self.panel_key = panel_key
+        
+        # Dwell progress rings, quantized so the output is only rewritten
+        # when a ring visibly grows
+        rings = tuple((activator.target, int(activator.get_progress() * 36))
+                      for activator in self.activators.values()
+                      if activator.get_progress() > 0)
+        out_key = (panel_key, rings)
+        
+        if out is None:
+            out = self.panel.copy()
+            self.draw_dwell_rings(out, rings)
+            return out
+        
+        # A persistent output buffer only needs writing when the panel changed
+        if out is not self.last_out or self.last_out_key != out_key:
+            np.copyto(out, self.panel)
+            self.draw_dwell_rings(out, rings)
+            self.last_out = out
+            self.last_out_key = out_key
+        return out
+    
+    def draw_dwell_rings(self, ui, rings):
+        """Draw a progress ring on each button being dwelled on"""
+        for (group_name, name), steps in rings:
+            rect = self.buttons[group_name] if name is None else self.buttons[group_name][name]
+            x1, y1, x2, y2 = rect
+            center = ((x1 + x2) // 2, (y1 + y2) // 2)
+            radius = min(x2 - x1, y2 - y1) // 2 - config.DWELL_RING_THICKNESS
+            cv2.ellipse(ui, center, (radius, radius), -90, 0, steps * 10,
+                        config.DWELL_RING_COLOR, config.DWELL_RING_THICKNESS, cv2.LINE_AA)
+    
+    def get_button_at(self, position):
+        """Get the (group, name) of the button at a position, or None"""
+        x, y = position
+        if not (self.hit_top <= y <= self.hit_bottom) or not (0 <= x < self.width):
+            return None
         
-        return ui
+        index = self.hit_table[x]
+        if index < 0:
+            return None
+        
+        group_name, name, _, _ = self.layout[index]
+        return group_name, name
+    
+    def get_activator(self, tool_manager):
+        """Get the dwell state of a tool manager's pointer"""
+        activator = self.activators.get(id(tool_manager))
+        if activator is None:
+            activator = self.activators[id(tool_manager)] = DwellActivator()
+        return activator
     
-    def handle_click(self, position, tool_manager, canvas):
-        """Handle clicks on UI elements"""
+    def handle_click(self, position, tool_manager, canvas, now=None):
+        """Handle clicks on UI elements.
+        
+        A button fires once the pointer has dwelled on it, and only once per
+        hover. Returns True while the pointer is over a button, so it does
+        not draw. now is the time of the frame, monotonic time by default.
+        """
+        if now is None:
+            now = time.monotonic()
+        
         x, y = position
+        activator = self.get_activator(tool_manager)
         
         # Only handle if in UI area
-        if y > self.height:
+        button = self.get_button_at(position) if y <= self.height else None
+        fired = activator.update(button, now)
+        if button is None:
             return False
-        
-        # Check clear button
-        if inside_rectangle(position, (self.buttons['clear'][0], self.buttons['clear'][1]), 
-                          (self.buttons['clear'][2], self.buttons['clear'][3])):
-            tool_manager.clear_all()
+        if not fired:
             return True
         
-        # Check undo button
-        if inside_rectangle(position, (self.buttons['undo'][0], self.buttons['undo'][1]), 
-                          (self.buttons['undo'][2], self.buttons['undo'][3])):
-            canvas.undo()
-            return True
+        if self.on_action is not None:
+            self.on_action(tool_manager, self.layout_index[button])
         
-        # Check save button
-        if inside_rectangle(position, (self.buttons['save'][0], self.buttons['save'][1]), 
-                          (self.buttons['save'][2], self.buttons['save'][3])):
+        group_name, name = button
+        if group_name == 'clear':
+            tool_manager.clear_all()
+        elif group_name == 'undo':
+            canvas.undo()
+        elif group_name == 'save':
             canvas.save()
-            return True
-        
-        # Check tool buttons
-        for tool_name, btn in self.buttons['tools'].items():
-            if inside_rectangle(position, (btn[0], btn[1]), (btn[2], btn[3])):
-                self.selected_tool = tool_name
-                tool_manager.set_tool(tool_name)
-                return True
-        
-        # Check color buttons
-        for color_name, btn in self.buttons['colors'].items():
-            if inside_rectangle(position, (btn[0], btn[1]), (btn[2], btn[3])):
-                self.selected_color = color_name
-                tool_manager.set_color(color_name)
-                return True
-        
-        return False
+        elif group_name == 'tools':
+            self.selected_tool = name
+            tool_manager.set_tool(name)
+        elif group_name == 'colors':
+            self.selected_color = name
+            tool_manager.set_color(name)
+        
+        return True
     
     def update_brush_thickness(self, thickness):
         """Update the brush thickness"""
@@ -3,11 +3,16 @@ utils.py - Utility functions for the Air Canvas application
 """
 
 import os
+import threading
 import cv2
 import numpy as np
 from datetime import datetime
 import config
 
+# Paths handed out by get_save_path, which may not be written yet
+_issued_paths = set()
+_issued_lock = threading.Lock()
+
 def nothing(x):
     """Empty callback function for trackbars"""
     pass
@@ -16,11 +21,36 @@ def create_directories():
     """Create necessary directories for the application"""
     os.makedirs(config.SAVE_DIR, exist_ok=True)
 
-def save_image(image, prefix="drawing"):
-    """Save an image with timestamp in the filename"""
+def get_save_path(prefix, extension):
+    """Get a unique path in the save directory with a timestamp in the filename.
+    
+    Saves within the same second get a numbered suffix instead of
+    overwriting each other, even before the earlier file is written.
+    """
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = os.path.join(config.SAVE_DIR, f"{prefix}_{timestamp}.png")
-    cv2.imwrite(filename, image)
+    with _issued_lock:
+        path = os.path.join(config.SAVE_DIR, f"{prefix}_{timestamp}.{extension}")
+        count = 1
+        while path in _issued_paths or os.path.exists(path):
+            count += 1
+            path = os.path.join(config.SAVE_DIR, f"{prefix}_{timestamp}_{count}.{extension}")
+        _issued_paths.add(path)
+    return path
+
+def get_encode_params(image_format):
+    """Get the cv2.imwrite parameters configured for an image format"""
+    if image_format == 'png':
+        return [cv2.IMWRITE_PNG_COMPRESSION, config.PNG_COMPRESSION]
+    if image_format in ('jpg', 'jpeg'):
+        return [cv2.IMWRITE_JPEG_QUALITY, config.JPEG_QUALITY]
+    if image_format == 'webp':
+        return [cv2.IMWRITE_WEBP_QUALITY, config.WEBP_QUALITY]
+    return []
+
+def save_image(image, prefix="drawing", image_format=config.SAVE_FORMAT):
+    """Save an image with timestamp in the filename"""
+    filename = get_save_path(prefix, image_format)
+    cv2.imwrite(filename, image, get_encode_params(image_format))
     print(f"Image saved as {filename}")
     return filename
 
@@ -106,4 +136,35 @@ def create_button(image, position, size, text, color=(200, 200, 200),
                 config.FONT_THICKNESS, config.FONT_LINE_TYPE)
     
     # Return the button's bounding box for hit testing
-    return (x, y, x + width, y + height)
\ No newline at end of file
+    return (x, y, x + width, y + height)
+
+def clip_rect(rect, width, height):
+    """Clip an (x1, y1, x2, y2) rectangle to an image, None if nothing is left"""
+    if rect is None:
+        return None
+    
+    x1, y1, x2, y2 = rect
+    x1 = max(0, min(width, int(x1)))
+    y1 = max(0, min(height, int(y1)))
+    x2 = max(0, min(width, int(x2)))
+    y2 = max(0, min(height, int(y2)))
+    
+    if x2 <= x1 or y2 <= y1:
+        return None
+    return (x1, y1, x2, y2)
+
+def union_rect(rect1, rect2):
+    """Get the bounding rectangle of two (x1, y1, x2, y2) rectangles"""
+    if rect1 is None:
+        return rect2
+    if rect2 is None:
+        return rect1
+    
+    return (min(rect1[0], rect2[0]), min(rect1[1], rect2[1]),
+            max(rect1[2], rect2[2]), max(rect1[3], rect2[3]))
+
+def points_rect(points, margin=0):
+    """Get the bounding rectangle of a list of points, grown by margin"""
+    xs = [p[0] for p in points]
+    ys = [p[1] for p in points]
+    return (min(xs) - margin, min(ys) - margin, max(xs) + margin + 1, max(ys) + margin + 1)